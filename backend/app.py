@@ -75,9 +75,56 @@ def create_app():
             'model': ai_service.model
         })
     
+    # 按已有数据重新生成后台统计的每日汇总：flask --app app backfill-stats
+    @app.cli.command('backfill-stats')
+    def backfill_stats():
+        from services.daily_stats import daily_stats
+        filled = daily_stats.backfill(db)
+        db.session.commit()
+        print(f"📊 已回填 {filled} 天的统计汇总")
+    
     # 创建数据库表
     with app.app_context():
+        # SQLite 连接配置（WAL 等）需要在建表、迁移之前注册
+        from services.sqlite_tuning import sqlite_tuning
+        sqlite_tuning.init_app(app, db)
         db.create_all()
+        # 为已有数据库补齐新增的列
+        from migrations import run_migrations
+        run_migrations(db)
+        # 回填/修复点赞、收藏冗余计数
+        from models import Animation
+        repaired = Animation.reconcile_counters()
+        db.session.commit()
+        if repaired:
+            logger.info(f"🔧 已修复 {repaired} 个动画的点赞/收藏计数")
+        # 创建全文搜索索引，与动画表不一致时重建
+        from services.search_index import search_index
+        rebuilt = search_index.setup(db)
+        db.session.commit()
+        if rebuilt:
+            logger.info(f"🔎 已重建 {rebuilt} 个动画的搜索索引")
+        # 分类计数：注册同步事件，与动画表不一致时重建
+        from services.category_facets import category_facets
+        counted = category_facets.setup(db)
+        db.session.commit()
+        if counted:
+            logger.info(f"🗂️ 已重建 {counted} 个分类的动画数")
+        # 社区排行：注册同步事件、启动后台刷新，首次部署时按已有数据生成
+        from services.ranking import ranking
+        ranked = ranking.init_app(app, db)
+        db.session.commit()
+        if ranked:
+            logger.info(f"🏆 已生成 {ranked} 个动画的排行")
+        # 相似度索引：后台线程建立，之后定期同步其他 worker 的修改
+        from services.similarity_index import similarity_index
+        similarity_index.init_app(app)
+        # 后台统计的每日汇总：注册同步事件，首次部署时按已有数据回填
+        from services.daily_stats import daily_stats
+        filled = daily_stats.setup(db)
+        db.session.commit()
+        if filled:
+            logger.info(f"📊 已回填 {filled} 天的统计汇总")
         # 创建默认管理员账户
         if not User.query.filter_by(username='admin').first():
             admin = User(
@@ -14,7 +14,24 @@ class Config:
     DB_PATH = os.path.join(DB_FOLDER, 'easyanimate.db')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f'sqlite:///{DB_PATH}')
     
+    # 系统配置版本戳文件：任一 worker 修改 SystemConfig 后更新此文件，其他 worker 据此刷新缓存
+    CONFIG_VERSION_FILE = os.environ.get('CONFIG_VERSION_FILE', os.path.join(DB_FOLDER, 'config.version'))
+    
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # SQLite 并发配置（多 worker 共用一个数据库文件）：WAL、忙等待、页缓存、内存映射、WAL checkpoint 间隔（秒，0 关闭）
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', 'true').lower() == 'true'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '10000'))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384'))
+    SQLITE_MMAP_SIZE_MB = int(os.environ.get('SQLITE_MMAP_SIZE_MB', '256'))
+    SQLITE_WAL_SIZE_LIMIT_MB = int(os.environ.get('SQLITE_WAL_SIZE_LIMIT_MB', '64'))
+    SQLITE_CHECKPOINT_INTERVAL = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', '30'))
+    
+    # 社区排行：热度半衰期（小时，修改后启动时重建排行）、后台修复排行的间隔（秒，0 关闭）
+    RANKING_HALF_LIFE_HOURS = float(os.environ.get('RANKING_HALF_LIFE_HOURS', '24'))
+    RANKING_REFRESH_INTERVAL = int(os.environ.get('RANKING_REFRESH_INTERVAL', '300'))
+    # 相似度索引：后台同步其他 worker 修改的间隔（秒，0 只在启动时建立）
+    SIMILARITY_SYNC_INTERVAL = int(os.environ.get('SIMILARITY_SYNC_INTERVAL', '30'))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     
@@ -23,6 +40,11 @@ class Config:
     CLAUDE_API_BASE_URL = os.environ.get('CLAUDE_API_BASE_URL', 'https://yunwu.ai/v1')
     CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-haiku-4-5-20251001')
     
+    # SVG 优化：坐标保留的小数位数，以及是否用无头浏览器校验优化前后渲染一致
+    # 校验会在保存动画的请求中同步启动 Chromium 渲染，默认关闭
+    SVG_OPTIMIZE_PRECISION = int(os.environ.get('SVG_OPTIMIZE_PRECISION', '2'))
+    SVG_OPTIMIZE_VERIFY = os.environ.get('SVG_OPTIMIZE_VERIFY', 'false').lower() == 'true'
+    
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     
@@ -0,0 +1,130 @@
+"""
+轻量级数据库迁移
+db.create_all() 只会创建缺失的表，不会给已有的表补列，
+这里在启动时检查并补齐新增的列（SQLite ALTER TABLE ADD COLUMN）和索引
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# (表名, 列名, 列定义)
+COLUMN_MIGRATIONS = [
+    # Token 用量统计
+    ('generation_tasks', 'model', 'VARCHAR(100)'),
+    ('generation_tasks', 'prompt_tokens', 'INTEGER DEFAULT 0'),
+    ('generation_tasks', 'completion_tokens', 'INTEGER DEFAULT 0'),
+    ('generation_tasks', 'usage_estimated', 'BOOLEAN DEFAULT 0'),
+    ('generation_tasks', 'cost', 'FLOAT DEFAULT 0'),
+    ('generation_tasks', 'ttft_ms', 'INTEGER'),
+    ('generation_tasks', 'duration_ms', 'INTEGER'),
+    ('generation_tasks', 'tokens_per_second', 'FLOAT'),
+    # 提示词模板版本
+    ('generation_tasks', 'prompt_version', 'VARCHAR(20)'),
+    # 重复请求合并
+    ('generation_tasks', 'idempotency_key', 'VARCHAR(64)'),
+    ('generation_tasks', 'animation_id', 'INTEGER'),
+    # 点赞/收藏冗余计数（启动时由 reconcile_counters 回填）
+    ('animations', 'likes_count', 'INTEGER DEFAULT 0'),
+    ('animations', 'favorites_count', 'INTEGER DEFAULT 0'),
+    # 每日汇总：AI 局部编辑单独计数
+    ('daily_stats', 'edits', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# (源表, 目标表, 目标表中指向源表 id 的列, 迁移的列)：大字段移到独立的表后从源表删除
+TABLE_SPLITS = [
+    ('animations', 'animation_contents', 'animation_id', ['svg_content', 'animation_data']),
+]
+
+# (索引名, 表名, 列)：create_all 不会为已有的表补建索引，名称与 models.py 中的声明保持一致
+INDEX_MIGRATIONS = [
+    ('ix_generation_tasks_idempotency_key', 'generation_tasks', 'idempotency_key'),
+    # 社区列表、分类列表、个人主页、管理后台、我的收藏的查询形状（见 tests/test_query_plan.py）
+    ('ix_animations_public_category_created', 'animations', 'is_public, category, created_at'),
+    ('ix_animations_public_created', 'animations', 'is_public, created_at'),
+    ('ix_animations_user_created', 'animations', 'user_id, created_at'),
+    ('ix_animations_created', 'animations', 'created_at'),
+    ('ix_animations_updated', 'animations', 'updated_at'),
+    ('ix_likes_animation', 'likes', 'animation_id'),
+    ('ix_favorites_user_created', 'favorites', 'user_id, created_at'),
+    ('ix_favorites_animation', 'favorites', 'animation_id'),
+    ('ix_quota_ledger_user', 'quota_ledger', 'user_id'),
+    # 管理后台用户列表的排序和统计
+    ('ix_users_created', 'users', 'created_at'),
+    ('ix_users_quota', 'users', 'quota'),
+]
+
+# (索引名, 表名, 列, 条件, 建索引前清理重复行的语句)：部分唯一索引，名称与 models.py 中的声明保持一致
+UNIQUE_INDEX_MIGRATIONS = [
+    # 同一 key 同时只能有一个进行中的生成任务：旧数据中重复的只保留最新一个的 key
+    ('uq_generation_tasks_active_key', 'generation_tasks', 'user_id, idempotency_key',
+     "status = 'processing' AND idempotency_key IS NOT NULL",
+     "UPDATE generation_tasks SET idempotency_key = NULL "
+     "WHERE status = 'processing' AND idempotency_key IS NOT NULL AND id NOT IN ("
+     "SELECT MAX(id) FROM generation_tasks WHERE status = 'processing' AND idempotency_key IS NOT NULL "
+     "GROUP BY user_id, idempotency_key)"),
+]
+
+
+def run_migrations(db):
+    """补齐已有表中缺失的列和索引，可重复执行"""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    columns_cache = {}
+    applied = 0
+
+    for table, column, ddl in COLUMN_MIGRATIONS:
+        if table not in tables:
+            continue
+        if table not in columns_cache:
+            columns_cache[table] = {c['name'] for c in inspector.get_columns(table)}
+        if column in columns_cache[table]:
+            continue
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+        columns_cache[table].add(column)
+        applied += 1
+        logger.info(f"🛠️ 数据库迁移: {table}.{column}")
+
+    for source, target, key, columns in TABLE_SPLITS:
+        if source not in tables or target not in tables:
+            continue
+        moving = [c for c in columns if c in {col['name'] for col in inspector.get_columns(source)}]
+        if not moving:
+            continue
+        column_list = ', '.join(moving)
+        moved = db.session.execute(text(
+            f'INSERT INTO {target} ({key}, {column_list}) SELECT id, {column_list} FROM {source} '
+            f'WHERE id NOT IN (SELECT {key} FROM {target})'
+        )).rowcount
+        for column in moving:
+            try:
+                db.session.execute(text(f'ALTER TABLE {source} DROP COLUMN {column}'))
+            except OperationalError:
+                # SQLite 3.35 之前不支持 DROP COLUMN：清空旧列，至少不再占用行空间
+                db.session.execute(text(f'UPDATE {source} SET {column} = NULL'))
+        logger.info(f"🛠️ 数据库迁移: {source}.{column_list} -> {target}（{moved} 行）")
+
+    indexes = 0
+    for name, table, columns in INDEX_MIGRATIONS:
+        if table not in tables:
+            continue
+        if name in {i['name'] for i in inspector.get_indexes(table)}:
+            continue
+        db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+        indexes += 1
+        logger.info(f"🛠️ 数据库迁移: 索引 {name}")
+
+    for name, table, columns, where, dedupe in UNIQUE_INDEX_MIGRATIONS:
+        if table not in tables:
+            continue
+        if name in {i['name'] for i in inspector.get_indexes(table)}:
+            continue
+        db.session.execute(text(dedupe))
+        db.session.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns}) WHERE {where}'))
+        indexes += 1
+        logger.info(f"🛠️ 数据库迁移: 唯一索引 {name}")
+
+    db.session.commit()
+    if applied or indexes:
+        logger.info(f"✅ 数据库迁移完成，新增 {applied} 列、{indexes} 个索引")
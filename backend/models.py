@@ -1,5 +1,10 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import deferred
+from datetime import datetime, timedelta
+import hashlib
+import hmac
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
@@ -19,6 +24,12 @@ class User(db.Model):
     likes = db.relationship('Like', backref='user', lazy='dynamic')
     favorites = db.relationship('Favorite', backref='user', lazy='dynamic')
 
+    # 管理后台用户列表按注册时间/配额排序，统计近 7 天新用户
+    __table_args__ = (
+        db.Index('ix_users_created', 'created_at'),
+        db.Index('ix_users_quota', 'quota'),
+    )
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -41,9 +52,7 @@ class Animation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, default='')
-    prompt = db.Column(db.Text, nullable=False)  # 用户输入的描述
-    svg_content = db.Column(db.Text)  # SVG动画内容
-    animation_data = db.Column(db.Text)  # JSON格式的动画数据
+    prompt = deferred(db.Column(db.Text, nullable=False))  # 用户输入的描述（列表不读取）
     thumbnail = db.Column(db.String(256), default='')
     duration = db.Column(db.Integer, default=30)  # 时长(秒)
     category = db.Column(db.String(50), default='其他')
@@ -51,32 +60,156 @@ class Animation(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 点赞/收藏数冗余计数：点赞、收藏切换时在同一事务中原子增减，reconcile_counters 修复漂移
+    likes_count = db.Column(db.Integer, default=0)
+    favorites_count = db.Column(db.Integer, default=0)
     
     likes = db.relationship('Like', backref='animation', lazy='dynamic', cascade='all, delete-orphan')
     favorites = db.relationship('Favorite', backref='animation', lazy='dynamic', cascade='all, delete-orphan')
+    # SVG 和动画数据存放在 animation_contents 中，只有详情、导出等用到时才加载
+    content = db.relationship('AnimationContent', uselist=False, lazy='select', cascade='all, delete-orphan')
 
-    def to_dict(self, include_content=False):
-        data = {
+    # 与列表查询的过滤/排序一致：社区（全部/按分类）、个人主页、管理后台均按 created_at 倒序；
+    # 相似度索引按 updated_at 同步其他 worker 的修改
+    __table_args__ = (
+        db.Index('ix_animations_public_category_created', 'is_public', 'category', 'created_at'),
+        db.Index('ix_animations_public_created', 'is_public', 'created_at'),
+        db.Index('ix_animations_user_created', 'user_id', 'created_at'),
+        db.Index('ix_animations_created', 'created_at'),
+        db.Index('ix_animations_updated', 'updated_at'),
+    )
+
+    def _set_content(self, field, value):
+        if self.content is None:
+            self.content = AnimationContent()
+        setattr(self.content, field, value)
+        # 内容在另一张表中，手动更新版本（相似度索引、预览地址依赖 updated_at）
+        if self.id is not None:
+            self.updated_at = datetime.utcnow()
+
+    @property
+    def svg_content(self):
+        return self.content.svg_content if self.content else None
+
+    @svg_content.setter
+    def svg_content(self, value):
+        self._set_content('svg_content', value)
+
+    @property
+    def animation_data(self):
+        return self.content.animation_data if self.content else None
+
+    @animation_data.setter
+    def animation_data(self, value):
+        self._set_content('animation_data', value)
+
+    def preview_version(self) -> int:
+        """内容版本（updated_at 毫秒数）：编辑、发布、取消公开都会更新 updated_at"""
+        return int(self.updated_at.timestamp() * 1000) if self.updated_at else 0
+
+    def preview_url(self) -> str:
+        """带签名的预览地址（相对 /api），私有动画也可以用 <img> 加载。
+        签名绑定内容版本和公开状态，动画修改或取消公开后旧地址失效"""
+        version = self.preview_version()
+        signature = Animation.preview_signature(self.id, version, self.is_public)
+        return f"/animations/{self.id}/preview.svg?v={version}&sig={signature}"
+
+    @staticmethod
+    def preview_signature(animation_id, version, is_public) -> str:
+        key = current_app.config['SECRET_KEY'].encode('utf-8')
+        scope = 'public' if is_public else 'private'
+        message = f"preview:{animation_id}:{version}:{scope}".encode('utf-8')
+        return hmac.new(key, message, hashlib.sha256).hexdigest()[:20]
+
+    @staticmethod
+    def adjust_counter(animation_id, column, delta):
+        """原子增减计数（不提交），不改动 updated_at"""
+        if not delta:
+            return
+        Animation.query.filter_by(id=animation_id).update(
+            {column: column + delta, Animation.updated_at: Animation.updated_at},
+            synchronize_session=False
+        )
+
+    @staticmethod
+    def reconcile_counters(animation_ids=None):
+        """按点赞/收藏表重新计算计数（不提交），返回修复的动画数"""
+        likes = db.select(db.func.count(Like.id)).where(Like.animation_id == Animation.id)\
+            .correlate(Animation).scalar_subquery()
+        favorites = db.select(db.func.count(Favorite.id)).where(Favorite.animation_id == Animation.id)\
+            .correlate(Animation).scalar_subquery()
+        query = Animation.query.filter(
+            (db.func.coalesce(Animation.likes_count, -1) != likes) |
+            (db.func.coalesce(Animation.favorites_count, -1) != favorites)
+        )
+        if animation_ids is not None:
+            query = query.filter(Animation.id.in_(list(animation_ids)))
+        return query.update(
+            {Animation.likes_count: likes, Animation.favorites_count: favorites,
+             Animation.updated_at: Animation.updated_at},
+            synchronize_session=False
+        )
+
+    def to_summary(self):
+        """列表用的摘要：不读取提示词、SVG 和动画数据，卡片通过 preview_url 加载预览"""
+        return {
             'id': self.id,
             'title': self.title,
             'description': self.description,
-            'prompt': self.prompt,
             'thumbnail': self.thumbnail,
             'duration': self.duration,
             'category': self.category,
             'is_public': self.is_public,
             'user_id': self.user_id,
             'author': self.author.username if self.author else None,
-            'likes_count': self.likes.count(),
-            'favorites_count': self.favorites.count(),
+            'likes_count': self.likes_count or 0,
+            'favorites_count': self.favorites_count or 0,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'svg_content': self.svg_content  # 始终包含SVG内容用于预览
+            'preview_url': self.preview_url()
         }
+
+    def to_dict(self, include_content=False):
+        """详情：摘要 + 提示词和SVG内容"""
+        data = self.to_summary()
+        data['prompt'] = self.prompt
+        data['svg_content'] = self.svg_content
         if include_content:
             data['animation_data'] = self.animation_data
         return data
 
+class AnimationContent(db.Model):
+    """动画的大字段，与列表、排序用到的元数据分开存放"""
+    __tablename__ = 'animation_contents'
+    animation_id = db.Column(db.Integer, db.ForeignKey('animations.id'), primary_key=True)
+    svg_content = db.Column(db.Text)  # SVG动画内容
+    animation_data = db.Column(db.Text)  # JSON格式的动画数据
+
+class AnimationRanking(db.Model):
+    """公开动画的排行数据，由 services/ranking.py 维护；只有公开动画有记录"""
+    __tablename__ = 'animation_rankings'
+    animation_id = db.Column(db.Integer, db.ForeignKey('animations.id'), primary_key=True)
+    category = db.Column(db.String(50))
+    # 累计点赞+收藏数
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+    # 热度：log2(Σ 2^((点赞/收藏时间 - 起点)/半衰期))，不随时间变化，0 表示没有点赞/收藏（见 services/ranking.py）
+    hot_score = db.Column(db.Float, nullable=False, default=0.0)
+    decayed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # 热度的计算时间
+    
+    # 热门、最多赞（全部/按分类）均按索引顺序读取前几行
+    __table_args__ = (
+        db.Index('ix_rankings_hot', 'hot_score', 'total_score', 'animation_id'),
+        db.Index('ix_rankings_total', 'total_score', 'animation_id'),
+        db.Index('ix_rankings_category_hot', 'category', 'hot_score', 'total_score', 'animation_id'),
+        db.Index('ix_rankings_category_total', 'category', 'total_score', 'animation_id'),
+    )
+
+class CategoryCount(db.Model):
+    """各分类的公开动画数，由 services/category_facets.py 维护"""
+    __tablename__ = 'category_counts'
+    category = db.Column(db.String(50), primary_key=True)
+    public_count = db.Column(db.Integer, nullable=False, default=0)
+
 class Like(db.Model):
     __tablename__ = 'likes'
     id = db.Column(db.Integer, primary_key=True)
@@ -84,7 +217,11 @@ class Like(db.Model):
     animation_id = db.Column(db.Integer, db.ForeignKey('animations.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'animation_id'),)
+    # (user_id, animation_id) 唯一约束已覆盖按用户查询，这里补按动画查询（计数修复、删除动画）
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'animation_id'),
+        db.Index('ix_likes_animation', 'animation_id'),
+    )
 
 class Favorite(db.Model):
     __tablename__ = 'favorites'
@@ -93,19 +230,59 @@ class Favorite(db.Model):
     animation_id = db.Column(db.Integer, db.ForeignKey('animations.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'animation_id'),)
+    # 我的收藏按 created_at 倒序；按动画查询用于计数修复、删除动画
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'animation_id'),
+        db.Index('ix_favorites_user_created', 'user_id', 'created_at'),
+        db.Index('ix_favorites_animation', 'animation_id'),
+    )
 
 class GenerationTask(db.Model):
     __tablename__ = 'generation_tasks'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     prompt = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
+    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed, cancelled
     result = db.Column(db.Text)
     error_message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
 
+    # Token 用量（优先取自 provider 返回的 usage，缺失时为本地估算）
+    model = db.Column(db.String(100))
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    usage_estimated = db.Column(db.Boolean, default=False)
+    cost = db.Column(db.Float, default=0)  # 美元
+    ttft_ms = db.Column(db.Integer)  # 首token延迟
+    duration_ms = db.Column(db.Integer)  # 请求总耗时
+    tokens_per_second = db.Column(db.Float)
+    prompt_version = db.Column(db.String(20))  # 使用的提示词模板版本
+
+    # 重复请求合并：相同 key 的请求复用同一个任务的结果
+    idempotency_key = db.Column(db.String(64), index=True)
+    animation_id = db.Column(db.Integer)  # 生成成功后保存的动画
+
+    # 同一用户同一 key 同时只能有一个进行中的任务：多个 worker 并发插入时只有一个成功，其余跟随该任务
+    __table_args__ = (
+        db.Index('uq_generation_tasks_active_key', 'user_id', 'idempotency_key', unique=True,
+                 sqlite_where=db.text("status = 'processing' AND idempotency_key IS NOT NULL")),
+    )
+
+    def apply_usage(self, usage):
+        """写入一次生成的用量数据（不提交）"""
+        if not usage:
+            return
+        self.model = usage.get('model')
+        self.prompt_tokens = usage.get('prompt_tokens', 0)
+        self.completion_tokens = usage.get('completion_tokens', 0)
+        self.usage_estimated = usage.get('estimated', False)
+        self.cost = usage.get('cost', 0)
+        self.ttft_ms = usage.get('ttft_ms')
+        self.duration_ms = usage.get('duration_ms')
+        self.tokens_per_second = usage.get('tokens_per_second')
+        self.prompt_version = usage.get('prompt_version')
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -114,10 +291,237 @@ class GenerationTask(db.Model):
             'status': self.status,
             'result': self.result,
             'error_message': self.error_message,
+            'model': self.model,
+            'animation_id': self.animation_id,
+            'prompt_tokens': self.prompt_tokens or 0,
+            'completion_tokens': self.completion_tokens or 0,
+            'usage_estimated': bool(self.usage_estimated),
+            'cost': self.cost or 0,
+            'ttft_ms': self.ttft_ms,
+            'duration_ms': self.duration_ms,
+            'tokens_per_second': self.tokens_per_second,
+            'prompt_version': self.prompt_version,
             'created_at': self.created_at.isoformat(),
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
         }
 
+class UsageStat(db.Model):
+    """Token 用量日汇总（日期 x 用户 x 模型），供后台按用户/模型/日期查询"""
+    __tablename__ = 'usage_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    generations = db.Column(db.Integer, default=0)
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0)
+    total_ttft_ms = db.Column(db.Integer, default=0)
+    total_duration_ms = db.Column(db.Integer, default=0)
+
+    __table_args__ = (db.UniqueConstraint('day', 'user_id', 'model'),)
+
+    @staticmethod
+    def record(user_id, usage, day=None):
+        """累加一次生成的用量（原子自增，不提交，由调用方统一提交）"""
+        if not usage:
+            return
+        day = day or datetime.utcnow().date()
+        model = usage.get('model') or 'unknown'
+        increments = {
+            UsageStat.generations: UsageStat.generations + 1,
+            UsageStat.prompt_tokens: UsageStat.prompt_tokens + usage.get('prompt_tokens', 0),
+            UsageStat.completion_tokens: UsageStat.completion_tokens + usage.get('completion_tokens', 0),
+            UsageStat.cost: UsageStat.cost + usage.get('cost', 0),
+            UsageStat.total_ttft_ms: UsageStat.total_ttft_ms + (usage.get('ttft_ms') or 0),
+            UsageStat.total_duration_ms: UsageStat.total_duration_ms + (usage.get('duration_ms') or 0),
+        }
+        updated = UsageStat.query.filter_by(day=day, user_id=user_id, model=model)\
+            .update(increments, synchronize_session=False)
+        if not updated:
+            db.session.add(UsageStat(
+                day=day,
+                user_id=user_id,
+                model=model,
+                generations=1,
+                prompt_tokens=usage.get('prompt_tokens', 0),
+                completion_tokens=usage.get('completion_tokens', 0),
+                cost=usage.get('cost', 0),
+                total_ttft_ms=usage.get('ttft_ms') or 0,
+                total_duration_ms=usage.get('duration_ms') or 0
+            ))
+        DailyStat.record(tokens=usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0), day=day)
+
+class DailyStat(db.Model):
+    """站点每日汇总，由写入对应数据的代码原子累加，后台统计直接读取；
+    删除、取消类的指标单独计数，总数 = 各天新增之和 - 各天删除之和"""
+    __tablename__ = 'daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+    deleted_users = db.Column(db.Integer, nullable=False, default=0)
+    new_animations = db.Column(db.Integer, nullable=False, default=0)
+    deleted_animations = db.Column(db.Integer, nullable=False, default=0)
+    publishes = db.Column(db.Integer, nullable=False, default=0)
+    unpublishes = db.Column(db.Integer, nullable=False, default=0)  # 取消公开，含删除公开的动画
+    generations = db.Column(db.Integer, nullable=False, default=0)  # 成功的生成
+    edits = db.Column(db.Integer, nullable=False, default=0)  # 成功的 AI 局部编辑（不消耗生成配额）
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    exports = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    unlikes = db.Column(db.Integer, nullable=False, default=0)
+    favorites = db.Column(db.Integer, nullable=False, default=0)
+    unfavorites = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    quota = db.Column(db.Integer, nullable=False, default=0)  # 全部用户配额之和的变化
+
+    METRICS = ('new_users', 'deleted_users', 'new_animations', 'deleted_animations', 'publishes', 'unpublishes',
+               'generations', 'edits', 'failures', 'exports', 'likes', 'unlikes', 'favorites', 'unfavorites', 'tokens', 'quota')
+
+    @staticmethod
+    def record(connection=None, day=None, **counts):
+        """累加当天的指标（原子自增，不提交）；在 ORM 事件中调用时传入事件的 connection"""
+        counts = {metric: value for metric, value in counts.items() if value}
+        if not counts:
+            return
+        statement = sqlite_insert(DailyStat).values(day=day or datetime.utcnow().date(), **counts)
+        (connection or db.session).execute(statement.on_conflict_do_update(
+            index_elements=[DailyStat.day],
+            set_={metric: getattr(DailyStat, metric) + statement.excluded[metric] for metric in counts}
+        ))
+
+class QuotaLedger(db.Model):
+    """配额流水：生成前原子预留，成功后确认，失败或取消时退还；管理员调整和注册赠送也各记一笔"""
+    __tablename__ = 'quota_ledger'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('generation_tasks.id'))
+    kind = db.Column(db.String(20), nullable=False)  # reserve, grant, admin
+    amount = db.Column(db.Integer, nullable=False)  # 配额变化量，预留为 -1
+    status = db.Column(db.String(20))  # 仅预留记录：reserved, committed, refunded
+    note = db.Column(db.String(200), default='')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    settled_at = db.Column(db.DateTime)
+
+    # 按用户倒序列出流水（id 隐含在索引中）；按用户+状态查找待确认的预留
+    __table_args__ = (
+        db.Index('ix_quota_ledger_user', 'user_id'),
+        db.Index('ix_quota_ledger_user_status', 'user_id', 'status'),
+    )
+
+    # 任务仍在进行中、但已超过该时长的预留视为进程异常退出遗留，自动退还；
+    # 远长于任何一次生成（含续写、长动画的全部场景），不会退还仍在运行的生成
+    STALE_AFTER = timedelta(hours=6)
+
+    @staticmethod
+    def reserve(user_id, task_ids=(None,)):
+        """为每个任务原子预留 1 次配额，并与会话中未提交的改动（如新建的任务）一起立即提交。
+        配额不足时回滚整个会话并返回 None，否则返回预留记录 id 列表（与 task_ids 顺序一致）"""
+        QuotaLedger.release_stale(user_id)
+        # 条件更新：配额检查与扣减在同一条语句中完成，并发请求不会超扣
+        reserved = User.query.filter(User.id == user_id, User.quota >= len(task_ids))\
+            .update({User.quota: User.quota - len(task_ids)}, synchronize_session=False)
+        if not reserved:
+            db.session.rollback()
+            return None
+        DailyStat.record(quota=-len(task_ids))
+        entries = [
+            QuotaLedger(user_id=user_id, task_id=task_id, kind='reserve', amount=-1, status='reserved')
+            for task_id in task_ids
+        ]
+        db.session.add_all(entries)
+        db.session.flush()
+        # 提交前取出 id：提交后再访问会逐条重新加载
+        reservation_ids = [entry.id for entry in entries]
+        db.session.commit()
+        return reservation_ids
+
+    @staticmethod
+    def settle(reservation_ids):
+        """确认预留（生成成功），不提交"""
+        QuotaLedger.query.filter(QuotaLedger.id.in_(reservation_ids), QuotaLedger.status == 'reserved')\
+            .update({QuotaLedger.status: 'committed', QuotaLedger.settled_at: datetime.utcnow()},
+                    synchronize_session=False)
+
+    @staticmethod
+    def refund(reservation_ids):
+        """退还仍处于预留状态的配额（可重复调用），不提交，返回退还次数"""
+        rows = QuotaLedger.query.with_entities(QuotaLedger.user_id)\
+            .filter(QuotaLedger.id.in_(reservation_ids), QuotaLedger.status == 'reserved').all()
+        if not rows:
+            return 0
+        refunded = QuotaLedger.query.filter(QuotaLedger.id.in_(reservation_ids), QuotaLedger.status == 'reserved')\
+            .update({QuotaLedger.status: 'refunded', QuotaLedger.settled_at: datetime.utcnow()},
+                    synchronize_session=False)
+        User.query.filter(User.id == rows[0].user_id)\
+            .update({User.quota: User.quota + refunded}, synchronize_session=False)
+        DailyStat.record(quota=refunded)
+        return refunded
+
+    @staticmethod
+    def release_stale(user_id):
+        """按任务状态处理该用户遗留的预留，不提交：任务已完成的确认；任务已结束或不存在的退还；
+        任务仍为进行中的只有超过 STALE_AFTER 才退还，并把任务标记为失败"""
+        cutoff = datetime.utcnow() - QuotaLedger.STALE_AFTER
+        rows = db.session.query(QuotaLedger.id, QuotaLedger.task_id, QuotaLedger.created_at,
+                                GenerationTask.status, GenerationTask.created_at.label('task_created_at'))\
+            .outerjoin(GenerationTask, GenerationTask.id == QuotaLedger.task_id)\
+            .filter(QuotaLedger.user_id == user_id, QuotaLedger.status == 'reserved').all()
+        settled, refunded, expired_tasks = [], [], []
+        for row in rows:
+            if row.status == 'completed':
+                settled.append(row.id)
+            elif row.status == 'processing':
+                if row.task_created_at < cutoff:
+                    refunded.append(row.id)
+                    expired_tasks.append(row.task_id)
+            elif row.task_id is not None or row.created_at < cutoff:
+                refunded.append(row.id)
+        if settled:
+            QuotaLedger.settle(settled)
+        if expired_tasks:
+            GenerationTask.query.filter(GenerationTask.id.in_(expired_tasks), GenerationTask.status == 'processing')\
+                .update({GenerationTask.status: 'failed', GenerationTask.error_message: '生成超时，已退还配额'},
+                        synchronize_session=False)
+            DailyStat.record(failures=len(expired_tasks))
+        if refunded:
+            QuotaLedger.refund(refunded)
+
+    @staticmethod
+    def set_quota(user_id, quota, kind='admin', note=''):
+        """把配额设置为 quota 并按实际变化量记账，不提交，返回原配额。
+        条件更新（配额仍为读取到的值）失败说明期间有生成预留或退还，重新读取后重试"""
+        while True:
+            old_quota = db.session.query(User.quota).filter(User.id == user_id).scalar()
+            if old_quota is None:
+                return None
+            if User.query.filter(User.id == user_id, User.quota == old_quota)\
+                    .update({User.quota: quota}, synchronize_session=False):
+                break
+        if quota != old_quota:
+            DailyStat.record(quota=quota - old_quota)
+            db.session.add(QuotaLedger(user_id=user_id, kind=kind, amount=quota - old_quota, note=note))
+        return old_quota
+
+    @staticmethod
+    def adjust(user_id, amount, kind='admin', note=''):
+        """原子增减配额并记账，不提交"""
+        User.query.filter(User.id == user_id)\
+            .update({User.quota: User.quota + amount}, synchronize_session=False)
+        DailyStat.record(quota=amount)
+        db.session.add(QuotaLedger(user_id=user_id, kind=kind, amount=amount, note=note))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'kind': self.kind,
+            'amount': self.amount,
+            'status': self.status,
+            'note': self.note,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'settled_at': self.settled_at.isoformat() if self.settled_at else None
+        }
+
 class SystemConfig(db.Model):
     """系统配置表"""
     __tablename__ = 'system_config'
@@ -143,6 +547,9 @@ class SystemConfig(db.Model):
             config = SystemConfig(key=key, value=value, description=description)
             db.session.add(config)
         db.session.commit()
+        # 通知所有 worker 刷新配置缓存
+        from services.config_cache import config_cache
+        config_cache.invalidate()
         return config
 
     def to_dict(self):
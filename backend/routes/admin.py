@@ -1,8 +1,19 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Animation, Like, Favorite, GenerationTask, SystemConfig
+from models import db, User, Animation, Like, Favorite, GenerationTask, SystemConfig, UsageStat, DailyStat, QuotaLedger
 from services.ai_service import ai_service
+from services.category_facets import category_facets
+from services.config_cache import config_cache
+from services.daily_stats import daily_stats
+from services.model_router import model_router
+from services.pagination import paginate_keyset, count_cache, CursorError
+from services.ranking import ranking
+from services.search_index import search_index
+from services.sqlite_tuning import sqlite_tuning
+from services.similarity_index import similarity_index
+from sqlalchemy.orm import joinedload
 from functools import wraps
+import json
 from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
@@ -21,7 +32,7 @@ def admin_required(fn):
 @admin_bp.route('/users', methods=['GET'])
 @admin_required
 def get_users():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 20, type=int)
     search = request.args.get('search', '')
     sort_by = request.args.get('sort_by', 'created_at')
@@ -33,28 +44,38 @@ def get_users():
             (User.email.contains(search))
         )
     
-    # 排序
+    # 排序（每种排序都以唯一的列结尾，作为游标）
     if sort_by == 'username':
-        query = query.order_by(User.username)
+        keys = [(User.username, False)]
     elif sort_by == 'quota':
-        query = query.order_by(User.quota.desc())
+        keys = [(User.quota, True), (User.id, True)]
     else:
-        query = query.order_by(User.created_at.desc())
-    
-    pagination = query.paginate(page=page, per_page=per_page)
+        sort_by = 'created_at'
+        keys = [(User.created_at, True), (User.id, True)]
     
+    try:
+        users, next_cursor = paginate_keyset(query, keys, sort_by, cursor, per_page)
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 一次查询本页所有用户的动画数
+    animation_counts = dict(db.session.query(Animation.user_id, db.func.count(Animation.id))
+                            .filter(Animation.user_id.in_([u.id for u in users]))
+                            .group_by(Animation.user_id).all())
     users_data = []
-    for u in pagination.items:
+    for u in users:
         user_dict = u.to_dict()
-        user_dict['animations_count'] = u.animations.count()
+        user_dict['animations_count'] = animation_counts.get(u.id, 0)
         users_data.append(user_dict)
     
-    return jsonify({
+    result = {
         'users': users_data,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
-    })
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+    if request.args.get('include_total', type=int):
+        result['total'] = count_cache.get(('admin_users', search), query)
+    return jsonify(result)
 
 @admin_bp.route('/users/<int:user_id>', methods=['GET'])
 @admin_required
@@ -83,9 +104,10 @@ def update_user_quota(user_id):
     if quota is None or not isinstance(quota, int) or quota < 0:
         return jsonify({'error': '配额必须是非负整数'}), 400
     
-    old_quota = user.quota
-    user.quota = quota
+    # 条件更新设置为绝对值，按实际变化量记账（期间有生成预留或退还时重新读取）
+    old_quota = QuotaLedger.set_quota(user_id, quota, note=f'管理员设置为 {quota}')
     db.session.commit()
+    db.session.refresh(user)
     
     return jsonify({
         'message': f'配额已从 {old_quota} 更新为 {quota}',
@@ -106,8 +128,9 @@ def add_user_quota(user_id):
     if not isinstance(amount, int) or amount <= 0:
         return jsonify({'error': '增加数量必须是正整数'}), 400
     
-    user.quota += amount
+    QuotaLedger.adjust(user_id, amount, note='管理员增加')
     db.session.commit()
+    db.session.refresh(user)
     
     return jsonify({
         'message': f'已增加 {amount} 次配额',
@@ -134,6 +157,33 @@ def toggle_admin(user_id):
         'user': user.to_dict()
     })
 
+@admin_bp.route('/users/<int:user_id>/quota/ledger', methods=['GET'])
+@admin_required
+def get_user_quota_ledger(user_id):
+    """用户配额流水"""
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', 20, type=int)
+    
+    query = QuotaLedger.query.filter_by(user_id=user_id)
+    try:
+        entries, next_cursor = paginate_keyset(query, [(QuotaLedger.id, True)], 'newest', cursor, per_page)
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    result = {
+        'user': user.to_dict(),
+        'entries': [e.to_dict() for e in entries],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+    if request.args.get('include_total', type=int):
+        result['total'] = count_cache.get(('quota_ledger', user_id), query)
+    return jsonify(result)
+
 @admin_bp.route('/users/<int:user_id>', methods=['DELETE'])
 @admin_required
 def delete_user(user_id):
@@ -148,46 +198,61 @@ def delete_user(user_id):
     
     username = user.username
     
+    # 该用户点赞/收藏过的其他动画，删除后需要修复计数和排行
+    touched_ids = {row[0] for row in db.session.query(Like.animation_id).filter_by(user_id=user_id)} | \
+                  {row[0] for row in db.session.query(Favorite.animation_id).filter_by(user_id=user_id)}
+    
     # 删除用户的所有关联数据
-    Like.query.filter_by(user_id=user_id).delete()
-    Favorite.query.filter_by(user_id=user_id).delete()
+    unlikes = Like.query.filter_by(user_id=user_id).delete()
+    unfavorites = Favorite.query.filter_by(user_id=user_id).delete()
+    QuotaLedger.query.filter_by(user_id=user_id).delete()
     GenerationTask.query.filter_by(user_id=user_id).delete()
     
     # 删除用户的动画
     animations = Animation.query.filter_by(user_id=user_id).all()
+    animation_ids = [animation.id for animation in animations]
     for animation in animations:
-        Like.query.filter_by(animation_id=animation.id).delete()
-        Favorite.query.filter_by(animation_id=animation.id).delete()
+        unlikes += Like.query.filter_by(animation_id=animation.id).delete()
+        unfavorites += Favorite.query.filter_by(animation_id=animation.id).delete()
         db.session.delete(animation)
     
     db.session.delete(user)
+    DailyStat.record(unlikes=unlikes, unfavorites=unfavorites)
+    Animation.reconcile_counters(touched_ids - set(animation_ids))
+    ranking.rescore(db, touched_ids - set(animation_ids))
     db.session.commit()
+    for animation_id in animation_ids:
+        similarity_index.remove(animation_id)
     
     return jsonify({'message': f'已删除用户 {username} 及其所有数据'})
 
 @admin_bp.route('/animations', methods=['GET'])
 @admin_required
 def get_all_animations():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 20, type=int)
     search = request.args.get('search', '')
     
-    query = Animation.query
+    query = Animation.query.options(joinedload(Animation.author))
+    keys = [(Animation.created_at, True), (Animation.id, True)]
     if search:
-        query = query.filter(
-            (Animation.title.contains(search)) |
-            (Animation.description.contains(search))
-        )
-    
-    pagination = query.order_by(Animation.created_at.desc())\
-        .paginate(page=page, per_page=per_page)
+        query, rank = search_index.search(query, search)
+        if rank is not None:
+            keys.insert(0, (rank, False))
     
-    return jsonify({
-        'animations': [a.to_dict() for a in pagination.items],
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
-    })
+    try:
+        animations, next_cursor = paginate_keyset(query, keys, 'search' if search else 'newest', cursor, per_page)
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    result = {
+        'animations': [a.to_summary() for a in animations],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+    if request.args.get('include_total', type=int):
+        result['total'] = count_cache.get(('admin_animations', search), query)
+    return jsonify(result)
 
 @admin_bp.route('/animations/<int:animation_id>', methods=['DELETE'])
 @admin_required
@@ -199,47 +264,153 @@ def delete_animation(animation_id):
     title = animation.title
     
     # 删除相关的点赞和收藏
-    Like.query.filter_by(animation_id=animation_id).delete()
-    Favorite.query.filter_by(animation_id=animation_id).delete()
+    DailyStat.record(unlikes=Like.query.filter_by(animation_id=animation_id).delete(),
+                     unfavorites=Favorite.query.filter_by(animation_id=animation_id).delete())
     
     db.session.delete(animation)
     db.session.commit()
+    similarity_index.remove(animation_id)
     
     return jsonify({'message': f'已删除动画 "{title}"'})
 
+@admin_bp.route('/maintenance/reconcile-counters', methods=['POST'])
+@admin_required
+def reconcile_counters():
+    """按点赞/收藏表修复动画的冗余计数"""
+    repaired = Animation.reconcile_counters()
+    db.session.commit()
+    return jsonify({'message': f'已修复 {repaired} 个动画的计数', 'repaired': repaired})
+
+@admin_bp.route('/maintenance/rebuild-search-index', methods=['POST'])
+@admin_required
+def rebuild_search_index():
+    """按动画表重建全文搜索索引"""
+    indexed = search_index.rebuild(db)
+    db.session.commit()
+    return jsonify({'message': f'已重建 {indexed} 个动画的搜索索引', 'indexed': indexed})
+
+@admin_bp.route('/maintenance/rebuild-rankings', methods=['POST'])
+@admin_required
+def rebuild_rankings():
+    """按动画表和最近的点赞、收藏重建社区排行"""
+    ranked = ranking.rebuild(db)
+    db.session.commit()
+    return jsonify({'message': f'已重建 {ranked} 个动画的排行', 'ranked': ranked})
+
+@admin_bp.route('/maintenance/rebuild-categories', methods=['POST'])
+@admin_required
+def rebuild_categories():
+    """按动画表重建各分类的公开动画数"""
+    counted = category_facets.rebuild(db)
+    db.session.commit()
+    return jsonify({'message': f'已重建 {counted} 个分类的动画数', 'categories': counted})
+
+@admin_bp.route('/maintenance/backfill-stats', methods=['POST'])
+@admin_required
+def backfill_stats():
+    """按已有数据重新生成后台统计的每日汇总（导出次数、删除和取消公开的记录无法还原，从 0 开始）"""
+    filled = daily_stats.backfill(db)
+    db.session.commit()
+    return jsonify({'message': f'已回填 {filled} 天的统计汇总', 'days': filled})
+
+@admin_bp.route('/maintenance/database', methods=['GET'])
+@admin_required
+def database_status():
+    """查看 SQLite 连接设置（日志模式、忙等待等）和最近一次 WAL checkpoint"""
+    return jsonify(sqlite_tuning.status())
+
+@admin_bp.route('/maintenance/wal-checkpoint', methods=['POST'])
+@admin_required
+def wal_checkpoint():
+    """立即执行一次 WAL checkpoint（PASSIVE，不阻塞读写）"""
+    result = sqlite_tuning.checkpoint()
+    if result is None:
+        return jsonify({'error': '未启用 SQLite WAL'}), 400
+    return jsonify(result)
+
 @admin_bp.route('/stats', methods=['GET'])
 @admin_required
 def get_stats():
-    """获取系统统计信息"""
-    total_users = User.query.count()
-    total_animations = Animation.query.count()
-    public_animations = Animation.query.filter_by(is_public=True).count()
-    
-    # 7天内新增用户
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    new_users_7d = User.query.filter(User.created_at >= seven_days_ago).count()
-    
-    # 7天内新增动画
-    new_animations_7d = Animation.query.filter(Animation.created_at >= seven_days_ago).count()
-    
-    # 总点赞数
-    total_likes = db.session.query(Like).count()
+    """获取系统统计信息：总数和最近 days 天（7/30/90）的每日趋势，均读取每日汇总"""
+    days = request.args.get('days', 7, type=int)
+    if days not in daily_stats.SERIES_DAYS:
+        return jsonify({'error': 'days 必须是 7、30 或 90'}), 400
     
-    # 总收藏数
-    total_favorites = db.session.query(Favorite).count()
+    with sqlite_tuning.read_only_session() as session:
+        totals = daily_stats.totals(session)
+        series = daily_stats.series(session, days)
     
-    # 平均配额
-    avg_quota = db.session.query(db.func.avg(User.quota)).scalar() or 0
+    total_users = totals['new_users'] - totals['deleted_users']
+    # 最近 7 天（含今天）
+    recent = series[-7:]
     
     return jsonify({
         'total_users': total_users,
-        'total_animations': total_animations,
-        'public_animations': public_animations,
-        'new_users_7d': new_users_7d,
-        'new_animations_7d': new_animations_7d,
-        'total_likes': total_likes,
-        'total_favorites': total_favorites,
-        'avg_quota': round(avg_quota, 2)
+        'total_animations': totals['new_animations'] - totals['deleted_animations'],
+        'public_animations': totals['publishes'] - totals['unpublishes'],
+        'new_users_7d': sum(day['new_users'] for day in recent),
+        'new_animations_7d': sum(day['new_animations'] for day in recent),
+        'total_likes': totals['likes'] - totals['unlikes'],
+        'total_favorites': totals['favorites'] - totals['unfavorites'],
+        'avg_quota': round(totals['quota'] / total_users, 2) if total_users else 0,
+        'totals': totals,
+        'days': days,
+        'series': series
+    })
+
+@admin_bp.route('/usage', methods=['GET'])
+@admin_required
+def get_usage():
+    """获取 Token 用量汇总，按 day / user / model 分组"""
+    group_by = request.args.get('group_by', 'day')
+    days = request.args.get('days', 30, type=int)
+    days = max(1, min(365, days))
+    
+    group_columns = {
+        'day': UsageStat.day,
+        'user': UsageStat.user_id,
+        'model': UsageStat.model
+    }
+    if group_by not in group_columns:
+        return jsonify({'error': 'group_by 必须是 day、user 或 model'}), 400
+    
+    key = group_columns[group_by]
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = db.session.query(
+        key,
+        db.func.sum(UsageStat.generations),
+        db.func.sum(UsageStat.prompt_tokens),
+        db.func.sum(UsageStat.completion_tokens),
+        db.func.sum(UsageStat.cost),
+        db.func.sum(UsageStat.total_ttft_ms),
+        db.func.sum(UsageStat.total_duration_ms)
+    ).filter(UsageStat.day >= since).group_by(key).order_by(key).all()
+    
+    usernames = {}
+    if group_by == 'user':
+        user_ids = [r[0] for r in rows]
+        usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+    
+    items = []
+    for key_value, generations, prompt_tokens, completion_tokens, cost, ttft_ms, duration_ms in rows:
+        decode_seconds = ((duration_ms or 0) - (ttft_ms or 0)) / 1000
+        item = {
+            group_by: key_value.isoformat() if group_by == 'day' else key_value,
+            'generations': generations or 0,
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'cost': round(cost or 0, 6),
+            'avg_ttft_ms': round((ttft_ms or 0) / generations) if generations else None,
+            'tokens_per_second': round(completion_tokens / decode_seconds, 2) if decode_seconds > 0 else None
+        }
+        if group_by == 'user':
+            item['username'] = usernames.get(key_value)
+        items.append(item)
+    
+    return jsonify({
+        'group_by': group_by,
+        'days': days,
+        'items': items
     })
 
 # ============ 模型配置 API ============
@@ -278,6 +449,46 @@ def set_current_model():
     else:
         return jsonify({'error': '更新失败'}), 500
 
+@admin_bp.route('/models/routing', methods=['GET'])
+@admin_required
+def get_routing_policy():
+    """获取模型路由策略和各模型最近的健康度统计"""
+    policy = model_router.get_policy()
+    return jsonify({
+        'policy': policy,
+        'stats': model_router.get_stats(policy['window_minutes']),
+        'models': ai_service.get_available_models()
+    })
+
+@admin_bp.route('/models/routing', methods=['PUT'])
+@admin_required
+def update_routing_policy():
+    """更新模型路由策略（只需提交要修改的项）"""
+    data = request.get_json() or {}
+    try:
+        policy = model_router.validate_policy(dict(model_router.get_policy(), **data))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    SystemConfig.set('routing_policy', json.dumps(policy, ensure_ascii=False), '模型路由策略')
+    return jsonify({
+        'message': '路由策略已更新',
+        'policy': policy
+    })
+
+@admin_bp.route('/models/routing/preview', methods=['POST'])
+@admin_required
+def preview_routing():
+    """预览某个请求会被路由到哪个模型"""
+    data = request.get_json() or {}
+    prompt = data.get('prompt')
+    if not prompt:
+        return jsonify({'error': '请输入动画描述'}), 400
+    
+    decision = model_router.select(prompt, data.get('duration', 30), data.get('params') or {},
+                                   ai_service.get_current_model_info()['id'])
+    return jsonify(decision)
+
 @admin_bp.route('/config', methods=['GET'])
 @admin_required
 def get_system_config():
@@ -308,11 +519,7 @@ def update_system_config(key):
 @admin_required
 def get_settings():
     """获取系统设置"""
-    default_quota = SystemConfig.get('default_quota', '10')
-    try:
-        default_quota = int(default_quota)
-    except:
-        default_quota = 10
+    default_quota = config_cache.get_int('default_quota', 10)
     
     return jsonify({
         'default_quota': default_quota
@@ -1,12 +1,317 @@
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, jwt_required
-from models import db, User, Animation, Like, Favorite, GenerationTask
+from models import db, User, Animation, AnimationContent, Like, Favorite, GenerationTask, UsageStat, DailyStat, QuotaLedger
 from services.ai_service import ai_service
-from datetime import datetime
+from services.svg_optimizer import svg_optimizer
+from services.svg_patch import ensure_ids, apply_patch, SVGPatchError
+from services.similarity_index import similarity_index
+from services.single_flight import single_flight
+from services.pagination import paginate_keyset, count_cache, CursorError
+from services.sqlite_tuning import sqlite_tuning
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hashlib
+import hmac
 import json
+import time
 
 animations_bp = Blueprint('animations', __name__)
 
+QUOTA_EXHAUSTED = '生成次数已用完，请联系管理员'
+
+# 批量生成单次最多条目数
+MAX_BATCH_SIZE = 10
+
+# 动画时长范围（秒）：单个动画（含批量中的每一项）、长动画
+DURATION_RANGE = (5, 120)
+LONG_DURATION_RANGE = (30, 180)
+
+# 重复请求合并：未带 Idempotency-Key 时，相同用户、相同参数的请求在此时间内视为重复提交（秒）
+AUTO_IDEMPOTENCY_WINDOW = 10
+# 显式 Idempotency-Key 的有效期（秒）
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+# 跟随其他 worker 上相同任务时的轮询间隔与最长等待时间（秒）
+FOLLOW_POLL_INTERVAL = 1
+FOLLOW_TIMEOUT = 600
+
+# 未指定变体参数时依次使用的配色和速度
+VARIANT_PRESETS = [
+    {'bgColor': '#0f172a', 'primaryColor': '#6366f1', 'accentColor': '#22d3ee', 'speed': 1.0},
+    {'bgColor': '#1e1b4b', 'primaryColor': '#f472b6', 'accentColor': '#facc15', 'speed': 1.0},
+    {'bgColor': '#052e16', 'primaryColor': '#22c55e', 'accentColor': '#a3e635', 'speed': 0.8},
+    {'bgColor': '#1c1917', 'primaryColor': '#f97316', 'accentColor': '#fde047', 'speed': 1.2},
+    {'bgColor': '#0c4a6e', 'primaryColor': '#38bdf8', 'accentColor': '#f0abfc', 'speed': 0.8},
+    {'bgColor': '#ffffff', 'primaryColor': '#2563eb', 'accentColor': '#dc2626', 'speed': 1.2},
+]
+
+def _sse_response(events):
+    """把事件（dict）以 SSE 格式流式返回；客户端断开时关闭事件源"""
+    def stream():
+        try:
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            events.close()
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def _parse_duration(value, duration_range):
+    """解析动画时长并限制在范围内，无法解析时抛出 ValueError"""
+    try:
+        duration = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('动画时长无效')
+    low, high = duration_range
+    return max(low, min(duration, high))
+
+@contextmanager
+def _unit_of_work():
+    """一段短的数据库操作：结束时关闭会话（未提交的改动回滚），连接立即归还连接池。
+    生成可能持续数分钟，流式输出期间不能持有连接，数据库操作只在流开始前和结束后进行"""
+    try:
+        yield
+    finally:
+        db.session.close()
+
+def _cancel_tasks(task_ids):
+    """把仍在进行中的生成任务标记为已取消"""
+    GenerationTask.query.filter(GenerationTask.id.in_(task_ids), GenerationTask.status == 'processing')\
+        .update({GenerationTask.status: 'cancelled', GenerationTask.error_message: '客户端已断开'},
+                synchronize_session=False)
+    db.session.commit()
+
+def _fail_task(task_id, reservation_id, message):
+    """保存结果失败（会话已回滚）：任务标记为失败并退还配额"""
+    GenerationTask.query.filter_by(id=task_id)\
+        .update({GenerationTask.status: 'failed', GenerationTask.error_message: message}, synchronize_session=False)
+    QuotaLedger.refund([reservation_id])
+    DailyStat.record(failures=1)
+    db.session.commit()
+
+def _reserve_tasks(user_id, prompts, idempotency_key=None):
+    """创建生成任务并原子预留配额（同一事务提交），配额不足时返回 (None, None)"""
+    tasks = [
+        GenerationTask(user_id=user_id, prompt=prompt, status='processing', idempotency_key=idempotency_key)
+        for prompt in prompts
+    ]
+    db.session.add_all(tasks)
+    db.session.flush()
+    task_ids = [t.id for t in tasks]
+    reservation_ids = QuotaLedger.reserve(user_id, task_ids)
+    if reservation_ids is None:
+        return None, None
+    return task_ids, reservation_ids
+
+def _record_failure(task_id, reservation_id, user_id, message, usage, model=None):
+    """生成失败：任务标记为失败、记录用量并退还配额；没有用量时也记下模型，计入模型路由的失败率"""
+    t = GenerationTask.query.get(task_id)
+    if t:
+        t.status = 'failed'
+        t.error_message = message
+        t.apply_usage(usage)
+        t.model = t.model or model
+    UsageStat.record(user_id, usage)
+    DailyStat.record(failures=1)
+    QuotaLedger.refund([reservation_id])
+    db.session.commit()
+
+def _save_result(task_id, reservation_id, user_id, prompt, duration, animation_result, usage):
+    """保存生成结果：创建动画、完成任务并确认配额；保存失败时任务标记为失败、退还配额后重新抛出异常"""
+    try:
+        # 创建动画记录
+        animation = Animation(
+            title=animation_result.get('title', '未命名动画'),
+            description=animation_result.get('description', ''),
+            prompt=prompt,
+            svg_content=svg_optimizer.optimize(animation_result.get('svg_content', '')),
+            animation_data=json.dumps(animation_result.get('animation_data', {})),
+            duration=duration,
+            category=animation_result.get('category', '其他'),
+            user_id=user_id
+        )
+        db.session.add(animation)
+        db.session.flush()
+        
+        # 更新任务状态
+        t = GenerationTask.query.get(task_id)
+        if t:
+            t.status = 'completed'
+            t.result = json.dumps(animation_result)
+            t.completed_at = datetime.utcnow()
+            t.animation_id = animation.id
+            t.apply_usage(usage)
+        UsageStat.record(user_id, usage)
+        DailyStat.record(generations=1)
+        
+        # 确认预留的配额
+        QuotaLedger.settle([reservation_id])
+        db.session.commit()
+        return animation
+    except Exception as e:
+        db.session.rollback()
+        _fail_task(task_id, reservation_id, str(e))
+        raise
+
+def _complete_event(animation, user_id, **extra):
+    u = User.query.get(user_id)
+    return {
+        'type': 'complete',
+        'animation': animation.to_dict(include_content=True),
+        'remaining_quota': u.quota if u else 0,
+        **extra
+    }
+
+def _finish_generation(task_id, reservation_id, user_id, prompt, duration, animation_result, usage):
+    """生成结束后的数据库操作单元：保存结果并构造完成事件，保存失败时返回错误事件"""
+    with _unit_of_work():
+        try:
+            animation = _save_result(task_id, reservation_id, user_id, prompt, duration, animation_result, usage)
+        except Exception as e:
+            return {'type': 'error', 'message': str(e)}
+        return _complete_event(animation, user_id)
+
+def _stream_generation(events, task_id, reservation_id, user_id, prompt, duration):
+    """转发生成事件，完成后保存动画、更新任务并确认预留的配额；失败或取消时退还配额"""
+    animation_result = None
+    usage = None
+    
+    try:
+        for event in events:
+            if event['type'] == 'progress':
+                yield event
+            elif event['type'] == 'complete':
+                animation_result = event['data']
+                usage = event.get('usage')
+                # 先发送完成进度
+                yield {'type': 'progress', 'progress': 100, 'tokens': event.get('tokens', 0), 'message': '保存中...'}
+            elif event['type'] == 'error':
+                with _unit_of_work():
+                    _record_failure(task_id, reservation_id, user_id, event['message'], event.get('usage'),
+                                    event.get('model'))
+                yield {'type': 'error', 'message': event['message']}
+                return
+    except GeneratorExit:
+        # 客户端全部断开：立即关闭上游流，任务标记为已取消，不保存动画并退还配额
+        events.close()
+        with _unit_of_work():
+            QuotaLedger.refund([reservation_id])
+            _cancel_tasks([task_id])
+        raise
+    
+    if animation_result:
+        yield _finish_generation(task_id, reservation_id, user_id, prompt, duration, animation_result, usage)
+
+def _generate_once(task_id, reservation_id, user_id, prompt, duration, params):
+    """非流式生成，只产出最终的完成或错误事件"""
+    result = ai_service.generate_animation(prompt, duration, params)
+    
+    if not result['success']:
+        with _unit_of_work():
+            _record_failure(task_id, reservation_id, user_id, result['error'], result.get('usage'), result.get('model'))
+        yield {'type': 'error', 'message': result['error']}
+        return
+    
+    yield _finish_generation(task_id, reservation_id, user_id, prompt, duration, result['data'], result.get('usage'))
+
+# ============ 重复请求合并 ============
+
+def _idempotency_key(user_id, endpoint, payload):
+    """Idempotency-Key 请求头优先；没有时由用户、接口和请求参数自动派生。返回 (key, 去重窗口秒数)"""
+    header = request.headers.get('Idempotency-Key', '').strip()
+    if header:
+        raw, window = f"{user_id}:{endpoint}:{header}", IDEMPOTENCY_KEY_TTL
+    else:
+        raw = json.dumps([user_id, endpoint, payload], sort_keys=True, ensure_ascii=False)
+        window = AUTO_IDEMPOTENCY_WINDOW
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest(), window
+
+def _find_duplicate(user_id, key, window):
+    """查找去重窗口内相同 key 的进行中或已完成的任务（可能由其他 worker 处理）"""
+    return GenerationTask.query.filter(
+        GenerationTask.user_id == user_id,
+        GenerationTask.idempotency_key == key,
+        GenerationTask.status.in_(['processing', 'completed']),
+        GenerationTask.created_at >= datetime.utcnow() - timedelta(seconds=window)
+    ).order_by(GenerationTask.id.desc()).first()
+
+def _claim_task(user_id, prompt, key, window):
+    """按 key 去重后创建任务并预留配额，返回 (重复任务 id, task_ids, reservation_ids)。
+    查找和插入之间其他 worker 可能已插入相同 key 的任务：进行中任务的唯一索引使插入失败，此时跟随该任务"""
+    duplicate = _find_duplicate(user_id, key, window)
+    if duplicate:
+        return duplicate.id, None, None
+    try:
+        task_ids, reservation_ids = _reserve_tasks(user_id, [prompt], key)
+    except IntegrityError:
+        db.session.rollback()
+        active = GenerationTask.query.filter_by(user_id=user_id, idempotency_key=key, status='processing')\
+            .order_by(GenerationTask.id.desc()).first()
+        # 对方已在这期间结束：按已完成的任务去重
+        duplicate = active or _find_duplicate(user_id, key, window)
+        if not duplicate:
+            raise
+        return duplicate.id, None, None
+    return None, task_ids, reservation_ids
+
+def _follow_task(task_id, user_id):
+    """跟随已存在的相同任务：已完成则直接返回结果，进行中则轮询直到结束"""
+    deadline = time.monotonic() + FOLLOW_TIMEOUT
+    while True:
+        # 每轮轮询是一个单独的操作单元：等待期间不持有连接，下一轮读取其他 worker 提交的最新状态
+        with _unit_of_work():
+            t = GenerationTask.query.get(task_id)
+            if t and t.status == 'completed':
+                animation = Animation.query.get(t.animation_id) if t.animation_id else None
+                event = _complete_event(animation, user_id, deduplicated=True) if animation else \
+                    {'type': 'error', 'message': '相同请求的生成结果已不存在，请重试'}
+            elif not t or t.status != 'processing':
+                event = {'type': 'error', 'message': (t.error_message if t else None) or '相同请求生成失败，请重试'}
+            elif time.monotonic() > deadline:
+                event = {'type': 'error', 'message': '等待相同请求的生成结果超时'}
+            else:
+                event = None
+        if event:
+            yield event
+            return
+        yield {'type': 'progress', 'progress': 0, 'tokens': 0, 'message': '相同的请求正在生成中，等待结果...'}
+        time.sleep(FOLLOW_POLL_INTERVAL)
+
+def _coalesced_generation(user_id, endpoint, payload, prompt, producer):
+    """相同请求合并到同一次生成：同一进程内直接订阅进行中的生成，否则按任务表去重；
+    都没有时预留配额并在后台启动 producer(task_id, reservation_id)。
+    返回事件生成器；配额不足时返回 None。
+    请求线程的数据库操作到此结束，之后只等待事件，不再持有连接"""
+    key, window = _idempotency_key(user_id, endpoint, payload)
+    flight, leader = single_flight.join_or_create(key)
+    if not leader:
+        db.session.close()
+        return flight.subscribe()
+    
+    app = current_app._get_current_object()
+    with _unit_of_work():
+        # 创建生成任务并预留配额
+        duplicate_id, task_ids, reservation_ids = _claim_task(user_id, prompt, key, window)
+    
+    if duplicate_id:
+        single_flight.run(flight, app, lambda: _follow_task(duplicate_id, user_id))
+        return flight.subscribe()
+    if not task_ids:
+        single_flight.fail(flight, {'type': 'error', 'message': QUOTA_EXHAUSTED})
+        return None
+    
+    single_flight.run(flight, app, lambda: producer(task_ids[0], reservation_ids[0]))
+    return flight.subscribe()
+
 @animations_bp.route('/generate-stream', methods=['POST'])
 @jwt_required()
 def generate_animation_stream():
@@ -17,86 +322,59 @@ def generate_animation_stream():
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    if user.quota <= 0:
-        return jsonify({'error': '生成次数已用完，请联系管理员'}), 403
-    
     data = request.get_json()
     prompt = data.get('prompt')
-    duration = data.get('duration', 30)
     params = data.get('params', {})
+    try:
+        duration = _parse_duration(data.get('duration', 30), DURATION_RANGE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     if not prompt:
         return jsonify({'error': '请输入动画描述'}), 400
     
-    # 创建生成任务
-    task = GenerationTask(user_id=user_id, prompt=prompt, status='processing')
-    db.session.add(task)
-    db.session.commit()
-    task_id = task.id
+    events = _coalesced_generation(
+        user_id, 'generate-stream', [prompt, duration, params], prompt,
+        lambda task_id, reservation_id: _stream_generation(
+            ai_service.generate_animation_stream(prompt, duration, params),
+            task_id, reservation_id, user_id, prompt, duration
+        )
+    )
+    if events is None:
+        return jsonify({'error': QUOTA_EXHAUSTED}), 403
+    return _sse_response(events)
+
+@animations_bp.route('/generate-long', methods=['POST'])
+@jwt_required()
+def generate_long_animation():
+    """长动画：先规划分镜，再并行生成各场景并合成，实时返回进度"""
+    user_id = int(get_jwt_identity())
+    user = User.query.get(user_id)
     
-    def generate():
-        animation_result = None
-        
-        for event in ai_service.generate_animation_stream(prompt, duration, params):
-            if event['type'] == 'progress':
-                yield f"data: {json.dumps(event)}\n\n"
-            elif event['type'] == 'complete':
-                animation_result = event['data']
-                # 先发送完成进度
-                yield f"data: {json.dumps({'type': 'progress', 'progress': 100, 'tokens': event.get('tokens', 0), 'message': '保存中...'})}\n\n"
-            elif event['type'] == 'error':
-                # 更新任务状态
-                with db.session.begin():
-                    t = GenerationTask.query.get(task_id)
-                    if t:
-                        t.status = 'failed'
-                        t.error_message = event['message']
-                yield f"data: {json.dumps(event)}\n\n"
-                return
-        
-        if animation_result:
-            try:
-                # 创建动画记录
-                animation = Animation(
-                    title=animation_result.get('title', '未命名动画'),
-                    description=animation_result.get('description', ''),
-                    prompt=prompt,
-                    svg_content=animation_result.get('svg_content', ''),
-                    animation_data=json.dumps(animation_result.get('animation_data', {})),
-                    duration=duration,
-                    category=animation_result.get('category', '其他'),
-                    user_id=user_id
-                )
-                db.session.add(animation)
-                
-                # 更新任务状态
-                t = GenerationTask.query.get(task_id)
-                if t:
-                    t.status = 'completed'
-                    t.result = json.dumps(animation_result)
-                    t.completed_at = datetime.utcnow()
-                
-                # 扣减配额
-                u = User.query.get(user_id)
-                if u:
-                    u.quota -= 1
-                
-                db.session.commit()
-                
-                yield f"data: {json.dumps({'type': 'complete', 'animation': animation.to_dict(include_content=True), 'remaining_quota': u.quota if u else 0})}\n\n"
-            except Exception as e:
-                db.session.rollback()
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
     
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'
-        }
+    data = request.get_json()
+    prompt = data.get('prompt')
+    params = data.get('params', {})
+    try:
+        duration = _parse_duration(data.get('duration', 60), LONG_DURATION_RANGE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not prompt:
+        return jsonify({'error': '请输入动画描述'}), 400
+    
+    events = _coalesced_generation(
+        user_id, 'generate-long', [prompt, duration, params], prompt,
+        lambda task_id, reservation_id: _stream_generation(
+            ai_service.generate_long_animation_stream(prompt, duration, params, user_id),
+            task_id, reservation_id, user_id, prompt, duration
+        )
     )
+    if events is None:
+        return jsonify({'error': QUOTA_EXHAUSTED}), 403
+    return _sse_response(events)
 
 @animations_bp.route('/generate', methods=['POST'])
 @jwt_required()
@@ -107,80 +385,200 @@ def generate_animation():
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    if user.quota <= 0:
-        return jsonify({'error': '生成次数已用完，请联系管理员'}), 403
-    
     data = request.get_json()
     prompt = data.get('prompt')
-    duration = data.get('duration', 30)
     params = data.get('params', {})  # SVG参数
+    try:
+        duration = _parse_duration(data.get('duration', 30), DURATION_RANGE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     if not prompt:
         return jsonify({'error': '请输入动画描述'}), 400
     
-    # 创建生成任务
-    task = GenerationTask(user_id=user_id, prompt=prompt, status='processing')
-    db.session.add(task)
-    db.session.commit()
+    events = _coalesced_generation(
+        user_id, 'generate', [prompt, duration, params], prompt,
+        lambda task_id, reservation_id: _generate_once(task_id, reservation_id, user_id, prompt, duration, params)
+    )
+    if events is None:
+        return jsonify({'error': QUOTA_EXHAUSTED}), 403
     
-    # 调用AI服务生成动画
-    result = ai_service.generate_animation(prompt, duration, params)
+    # 等待生成结束（重复请求等待同一次生成的结果）
+    result = None
+    for event in events:
+        result = event
     
-    if result['success']:
-        animation_data = result['data']
-        
-        # 创建动画记录
-        animation = Animation(
-            title=animation_data.get('title', '未命名动画'),
-            description=animation_data.get('description', ''),
-            prompt=prompt,
-            svg_content=animation_data.get('svg_content', ''),
-            animation_data=json.dumps(animation_data.get('animation_data', {})),
-            duration=duration,
-            category=animation_data.get('category', '其他'),
-            user_id=user_id
-        )
-        db.session.add(animation)
-        
-        # 更新任务状态
-        task.status = 'completed'
-        task.result = json.dumps(animation_data)
-        task.completed_at = datetime.utcnow()
-        
-        # 扣减配额
-        user.quota -= 1
-        
-        db.session.commit()
-        
+    if result and result['type'] == 'complete':
         return jsonify({
             'message': '生成成功',
-            'animation': animation.to_dict(include_content=True),
-            'remaining_quota': user.quota
+            'animation': result['animation'],
+            'remaining_quota': result['remaining_quota']
         })
+    return jsonify({'error': f'生成失败: {result["message"] if result else "未知错误"}'}), 500
+
+def _parse_batch_items(data):
+    """解析批量请求：prompts 列表（字符串或 {prompt, duration, params}），或 prompt + variants（数量或参数列表）；
+    每一项的时长与单个生成一样校验并限制范围"""
+    duration = _parse_duration(data.get('duration', 30), DURATION_RANGE)
+    params = data.get('params') or {}
+    items = []
+    
+    if data.get('prompts') is not None:
+        if not isinstance(data['prompts'], list):
+            raise ValueError('prompts 必须是列表')
+        for entry in data['prompts']:
+            if isinstance(entry, str):
+                entry = {'prompt': entry}
+            if not isinstance(entry, dict):
+                raise ValueError('prompts 条目格式无效')
+            items.append({
+                'prompt': entry.get('prompt'),
+                'duration': _parse_duration(entry.get('duration', duration), DURATION_RANGE),
+                'params': {**params, **(entry.get('params') or {})}
+            })
     else:
-        task.status = 'failed'
-        task.error_message = result['error']
-        db.session.commit()
-        return jsonify({'error': f'生成失败: {result["error"]}'}), 500
+        variants = data.get('variants', 1)
+        if isinstance(variants, int) and not isinstance(variants, bool):
+            if variants < 1 or variants > len(VARIANT_PRESETS):
+                raise ValueError(f'变体数量必须在 1-{len(VARIANT_PRESETS)} 之间')
+            variants = VARIANT_PRESETS[:variants]
+        if not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants):
+            raise ValueError('variants 必须是数量或参数列表')
+        for variant in variants:
+            items.append({'prompt': data.get('prompt'), 'duration': duration, 'params': {**params, **variant}})
+    
+    if not items:
+        raise ValueError('请至少提供一个动画描述')
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f'单次最多批量生成 {MAX_BATCH_SIZE} 个动画')
+    if not all(item['prompt'] for item in items):
+        raise ValueError('请输入动画描述')
+    return items
 
-@animations_bp.route('/', methods=['GET'])
+@animations_bp.route('/generate-batch', methods=['POST'])
 @jwt_required()
-def get_my_animations():
+def generate_batch():
+    """批量生成：一次预留整批配额，并发生成，通过同一个 SSE 连接逐项返回进度（带条目序号）和结果，失败的条目退还配额"""
     user_id = int(get_jwt_identity())
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    user = User.query.get(user_id)
+    
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    try:
+        items = _parse_batch_items(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 创建生成任务并原子地预留整批配额，配额不足时一个也不创建
+    with _unit_of_work():
+        task_ids, reservation_ids = _reserve_tasks(user_id, [item['prompt'] for item in items])
+    if not task_ids:
+        return jsonify({'error': f'生成次数不足，本次需要 {len(items)} 次'}), 403
+    
+    def _save_item(index, event):
+        """单个条目完成后的数据库操作单元，返回条目事件"""
+        item = items[index]
+        with _unit_of_work():
+            try:
+                animation = _save_result(task_ids[index], reservation_ids[index], user_id,
+                                         item['prompt'], item['duration'], event['data'], event.get('usage'))
+            except Exception as e:
+                return {'type': 'item', 'index': index, 'success': False, 'error': str(e)}
+            return {'type': 'item', 'index': index, 'success': True, 'animation': animation.to_dict(include_content=True)}
+    
+    def generate():
+        succeeded = 0
+        events = ai_service.generate_batch_stream(items)
+        try:
+            yield {'type': 'start', 'total': len(items), 'task_ids': task_ids}
+            
+            for event in events:
+                index = event['index']
+                
+                if event['type'] == 'progress':
+                    yield event
+                    continue
+                
+                if not event['success']:
+                    with _unit_of_work():
+                        _record_failure(task_ids[index], reservation_ids[index], user_id, event['error'],
+                                        event.get('usage'), event.get('model'))
+                    yield {'type': 'item', 'index': index, 'success': False, 'error': event['error']}
+                    continue
+                
+                item_event = _save_item(index, event)
+                if item_event['success']:
+                    succeeded += 1
+                yield item_event
+        finally:
+            # 客户端断开时停止尚未开始的条目
+            events.close()
+            # 退还因保存失败或客户端断开而未确认的配额（已退还的条目不会重复退还）
+            with _unit_of_work():
+                QuotaLedger.refund(reservation_ids)
+                _cancel_tasks(task_ids)
+            refunded = len(items) - succeeded
+        
+        with _unit_of_work():
+            u = User.query.get(user_id)
+            remaining_quota = u.quota if u else 0
+        yield {'type': 'complete', 'succeeded': succeeded, 'failed': refunded, 'refunded': refunded,
+               'remaining_quota': remaining_quota}
+    
+    return _sse_response(generate())
+
+@animations_bp.route('/similar', methods=['GET'])
+def get_similar_animations():
+    """生成前查找社区中相似的公开动画，可直接复用而不必重新生成"""
+    started = time.perf_counter()
+    prompt = request.args.get('prompt', '').strip()
+    limit = max(1, min(request.args.get('limit', 5, type=int), 20))
     
-    pagination = Animation.query.filter_by(user_id=user_id)\
-        .order_by(Animation.created_at.desc())\
-        .paginate(page=page, per_page=per_page)
+    if not prompt:
+        return jsonify({'error': '请输入动画描述'}), 400
+    
+    matches = similarity_index.query(prompt, limit=limit)
+    animations = {a.id: a for a in Animation.query.options(joinedload(Animation.author)).filter(
+        Animation.id.in_([animation_id for animation_id, _ in matches]),
+        Animation.is_public == True
+    ).all()} if matches else {}
+    
+    results = []
+    for animation_id, score in matches:
+        if animation_id in animations:
+            results.append({**animations[animation_id].to_summary(), 'similarity': round(score, 3)})
     
     return jsonify({
-        'animations': [a.to_dict() for a in pagination.items],
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
+        'animations': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
     })
 
+@animations_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_my_animations():
+    user_id = int(get_jwt_identity())
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', 10, type=int)
+    
+    with sqlite_tuning.read_only_session() as session:
+        query = session.query(Animation).options(joinedload(Animation.author)).filter_by(user_id=user_id)
+        try:
+            animations, next_cursor = paginate_keyset(
+                query, [(Animation.created_at, True), (Animation.id, True)], 'newest', cursor, per_page
+            )
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        result = {
+            'animations': [a.to_summary() for a in animations],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if request.args.get('include_total', type=int):
+            result['total'] = count_cache.get(('my_animations', user_id), query)
+    return jsonify(result)
+
 @animations_bp.route('/<int:animation_id>', methods=['GET'])
 @jwt_required(optional=True)
 def get_animation(animation_id):
@@ -198,6 +596,28 @@ def get_animation(animation_id):
     return jsonify(animation.to_dict(include_content=True))
 
 
+@animations_bp.route('/<int:animation_id>/preview.svg', methods=['GET'])
+def get_animation_preview(animation_id):
+    """列表卡片的预览图：地址中的版本须是动画当前的版本，签名须与当前的公开状态一致，
+    私有动画的地址只在作者自己的列表（和管理后台）中下发；地址随版本变化，可长期缓存"""
+    animation = Animation.query.get(animation_id)
+    if not animation or str(animation.preview_version()) != request.args.get('v', ''):
+        return jsonify({'error': '动画不存在'}), 404
+    
+    signature = Animation.preview_signature(animation_id, animation.preview_version(), animation.is_public)
+    if not hmac.compare_digest(request.args.get('sig', ''), signature):
+        return jsonify({'error': '无权访问'}), 403
+    
+    content = db.session.get(AnimationContent, animation_id)
+    if not content or not content.svg_content:
+        return jsonify({'error': '动画不存在'}), 404
+    
+    response = Response(content.svg_content, mimetype='image/svg+xml')
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    # 作为图片加载时也禁止脚本和外部资源
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; img-src data:"
+    return response
+
 @animations_bp.route('/<int:animation_id>', methods=['PUT'])
 @jwt_required()
 def update_animation(animation_id):
@@ -217,7 +637,7 @@ def update_animation(animation_id):
     if 'description' in data:
         animation.description = data['description']
     if 'svg_content' in data:
-        animation.svg_content = data['svg_content']
+        animation.svg_content = svg_optimizer.optimize(data['svg_content'])
     if 'animation_data' in data:
         animation.animation_data = json.dumps(data['animation_data'])
     if 'is_public' in data:
@@ -226,8 +646,80 @@ def update_animation(animation_id):
         animation.category = data['category']
     
     db.session.commit()
+    similarity_index.update(animation)
     return jsonify({'message': '更新成功', 'animation': animation.to_dict(include_content=True)})
 
+@animations_bp.route('/<int:animation_id>/ai-edit', methods=['POST'])
+@jwt_required()
+def ai_edit_animation(animation_id):
+    """AI 局部编辑：模型只返回按元素 id 定位的修改操作，由服务端校验并应用到现有SVG"""
+    user_id = int(get_jwt_identity())
+    animation = Animation.query.get(animation_id)
+    
+    if not animation:
+        return jsonify({'error': '动画不存在'}), 404
+    
+    if animation.user_id != user_id:
+        return jsonify({'error': '无权修改'}), 403
+    
+    data = request.get_json() or {}
+    instruction = (data.get('instruction') or '').strip()
+    preview = bool(data.get('preview', False))
+    
+    if not instruction:
+        return jsonify({'error': '请输入修改要求'}), 400
+    
+    if not animation.svg_content:
+        return jsonify({'error': '动画内容为空'}), 400
+    
+    # 发送压缩后的SVG，并给所有元素补上 id 供补丁引用
+    try:
+        svg_content = ensure_ids(svg_optimizer.optimize(animation.svg_content))
+    except SVGPatchError as e:
+        return jsonify({'error': f'当前动画无法局部编辑: {e}'}), 400
+    
+    task = GenerationTask(user_id=user_id, prompt=instruction, status='processing')
+    db.session.add(task)
+    db.session.commit()
+    
+    result = ai_service.edit_animation(svg_content, instruction)
+    usage = result.get('usage')
+    task.apply_usage(usage)
+    UsageStat.record(user_id, usage)
+    
+    if result['success']:
+        try:
+            patched = svg_optimizer.optimize(apply_patch(svg_content, result['data']['operations']))
+        except SVGPatchError as e:
+            result = {'success': False, 'error': str(e)}
+    
+    if not result['success']:
+        task.status = 'failed'
+        task.error_message = result['error']
+        DailyStat.record(failures=1)
+        db.session.commit()
+        return jsonify({'error': f'修改失败: {result["error"]}'}), 500
+    
+    task.status = 'completed'
+    task.result = json.dumps(result['data'])
+    task.completed_at = datetime.utcnow()
+    DailyStat.record(edits=1)
+    if not preview:
+        animation.svg_content = patched
+    db.session.commit()
+    
+    response = {
+        'message': '修改成功',
+        'summary': result['data'].get('summary', ''),
+        'operations': result['data']['operations'],
+        'usage': usage
+    }
+    if preview:
+        response['svg_content'] = patched
+    else:
+        response['animation'] = animation.to_dict(include_content=True)
+    return jsonify(response)
+
 @animations_bp.route('/<int:animation_id>', methods=['DELETE'])
 @jwt_required()
 def delete_animation(animation_id):
@@ -240,8 +732,12 @@ def delete_animation(animation_id):
     if animation.user_id != user_id:
         return jsonify({'error': '无权删除'}), 403
     
+    # 点赞、收藏随动画一起删除，计入每日汇总
+    DailyStat.record(unlikes=Like.query.filter_by(animation_id=animation_id).delete(),
+                     unfavorites=Favorite.query.filter_by(animation_id=animation_id).delete())
     db.session.delete(animation)
     db.session.commit()
+    similarity_index.remove(animation_id)
     return jsonify({'message': '删除成功'})
 
 @animations_bp.route('/<int:animation_id>/publish', methods=['POST'])
@@ -258,6 +754,7 @@ def publish_animation(animation_id):
     
     animation.is_public = True
     db.session.commit()
+    similarity_index.update(animation)
     return jsonify({'message': '发布成功', 'animation': animation.to_dict()})
 
 
@@ -276,6 +773,7 @@ def unpublish_animation(animation_id):
     
     animation.is_public = False
     db.session.commit()
+    similarity_index.update(animation)
     return jsonify({'message': '已取消分享', 'animation': animation.to_dict()})
 
 @animations_bp.route('/<int:animation_id>/fork', methods=['POST'])
@@ -357,6 +855,8 @@ def export_animation(animation_id, format):
         safe_filename = f"animation_{animation_id}.{format}"
         original_filename = f"{animation.title or 'animation'}.{format}"
         encoded_filename = quote(original_filename)
+        DailyStat.record(exports=1)
+        db.session.commit()
         
         return Response(
             data,
@@ -408,6 +908,8 @@ def export_animation_stream(animation_id, format):
     
     svg_content = animation.svg_content
     title = animation.title or 'animation'
+    # 导出可能持续数十秒，推流前归还数据库连接
+    db.session.close()
     
     def generate():
         progress_queue = queue.Queue()
@@ -452,6 +954,10 @@ def export_animation_stream(animation_id, format):
         if result_holder['error']:
             yield f"data: {json.dumps({'type': 'error', 'message': result_holder['error']})}\n\n"
         else:
+            # 导出次数计入每日汇总（短事务，立即归还连接）
+            DailyStat.record(exports=1)
+            db.session.commit()
+            db.session.close()
             # 将文件数据转为 base64
             data_base64 = base64.b64encode(result_holder['data']).decode('utf-8')
             yield f"data: {json.dumps({'type': 'complete', 'data': data_base64, 'filename': f'{title}.{format}', 'mimetype': 'video/mp4' if format == 'mp4' else 'image/gif'})}\n\n"
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from models import db, User, SystemConfig
+from models import db, User, QuotaLedger
+from services.config_cache import config_cache
+from services.pagination import paginate_keyset, count_cache, CursorError
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -21,15 +23,13 @@ def register():
         return jsonify({'error': '邮箱已被注册'}), 400
 
     # 获取系统配置的默认配额
-    default_quota = 10
-    try:
-        default_quota = int(SystemConfig.get('default_quota', '10'))
-    except:
-        pass
+    default_quota = config_cache.get_int('default_quota', 10)
 
     user = User(username=username, email=email, quota=default_quota)
     user.set_password(password)
     db.session.add(user)
+    db.session.flush()
+    db.session.add(QuotaLedger(user_id=user.id, kind='grant', amount=default_quota, note='注册赠送'))
     db.session.commit()
 
     access_token = create_access_token(identity=str(user.id))
@@ -68,6 +68,34 @@ def get_current_user():
         return jsonify({'error': '用户不存在'}), 404
     return jsonify(user.to_dict())
 
+@auth_bp.route('/me/quota', methods=['GET'])
+@jwt_required()
+def get_quota_history():
+    """当前用户的配额流水"""
+    user_id = int(get_jwt_identity())
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', 20, type=int)
+    
+    query = QuotaLedger.query.filter_by(user_id=user_id)
+    try:
+        entries, next_cursor = paginate_keyset(query, [(QuotaLedger.id, True)], 'newest', cursor, per_page)
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    result = {
+        'quota': user.quota,
+        'entries': [e.to_dict() for e in entries],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+    if request.args.get('include_total', type=int):
+        result['total'] = count_cache.get(('quota_ledger', user_id), query)
+    return jsonify(result)
+
 @auth_bp.route('/me', methods=['PUT'])
 @jwt_required()
 def update_profile():
@@ -1,62 +1,67 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, jwt_required
-from models import db, Animation, Like, Favorite, User
-from sqlalchemy import distinct
+from models import db, Animation, Like, Favorite, User, DailyStat
+from services.category_facets import category_facets
+from services.pagination import paginate_keyset, count_cache, CursorError
+from services.ranking import ranking
+from services.search_index import search_index
+from services.sqlite_tuning import sqlite_tuning
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 community_bp = Blueprint('community', __name__)
 
-# 预设分类（确保这些分类始终显示）
-DEFAULT_CATEGORIES = ['计算机科学', '电子通信', '物理', '数学', '天文', '化学', '生物', '地理', '其他']
-
-def get_all_categories():
-    """获取所有分类：预设分类 + 数据库中的分类"""
-    # 从数据库获取所有公开动画的分类
-    db_categories = db.session.query(distinct(Animation.category))\
-        .filter(Animation.is_public == True)\
-        .filter(Animation.category != None)\
-        .filter(Animation.category != '')\
-        .all()
-    db_categories = [c[0] for c in db_categories if c[0]]
-    
-    # 合并预设分类和数据库分类，去重并保持顺序
-    all_categories = ['全部']
-    for cat in DEFAULT_CATEGORIES:
-        if cat not in all_categories:
-            all_categories.append(cat)
-    for cat in db_categories:
-        if cat not in all_categories:
-            all_categories.append(cat)
-    
-    return all_categories
+@community_bp.route('/categories', methods=['GET'])
+def get_categories():
+    """分类及各分类的公开动画数，带 ETag，内容未变化（If-None-Match 相同）时返回 304"""
+    with sqlite_tuning.read_only_session() as session:
+        facets = category_facets.facets(session)
+    
+    response = jsonify({'categories': facets})
+    response.set_etag(category_facets.etag(facets))
+    # 可以缓存，但每次使用前用 ETag 向服务器确认
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @community_bp.route('/animations', methods=['GET'])
 def get_public_animations():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 12, type=int)
     category = request.args.get('category', '全部')
     search = request.args.get('search', '')
+    # newest 最新 / trending 热门 / top 最多赞；有关键词时按相关度排序
+    sort = request.args.get('sort', 'newest')
     
-    query = Animation.query.filter_by(is_public=True)
-    
-    if category and category != '全部':
-        query = query.filter_by(category=category)
-    
-    if search:
-        query = query.filter(
-            (Animation.title.contains(search)) | 
-            (Animation.description.contains(search))
-        )
-    
-    pagination = query.order_by(Animation.created_at.desc())\
-        .paginate(page=page, per_page=per_page)
-    
-    return jsonify({
-        'animations': [a.to_dict() for a in pagination.items],
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page,
-        'categories': get_all_categories()
-    })
+    with sqlite_tuning.read_only_session() as session:
+        query = session.query(Animation).options(joinedload(Animation.author))
+        
+        if sort in ranking.SORTS and not search:
+            query, keys = ranking.apply(query, sort, category if category != '全部' else None)
+        else:
+            sort = 'search' if search else 'newest'
+            query = query.filter_by(is_public=True)
+            if category and category != '全部':
+                query = query.filter_by(category=category)
+            keys = [(Animation.created_at, True), (Animation.id, True)]
+            if search:
+                query, rank = search_index.search(query, search)
+                if rank is not None:
+                    keys.insert(0, (rank, False))
+        
+        try:
+            animations, next_cursor = paginate_keyset(query, keys, sort, cursor, per_page)
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        result = {
+            'animations': [a.to_summary() for a in animations],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if request.args.get('include_total', type=int):
+            result['total'] = count_cache.get(('community', category, search), query)
+    return jsonify(result)
 
 @community_bp.route('/animations/<int:animation_id>', methods=['GET'])
 def get_public_animation(animation_id):
@@ -67,6 +72,34 @@ def get_public_animation(animation_id):
     
     return jsonify(animation.to_dict(include_content=True))
 
+def _toggle(model, counter, metric, user_id, animation_id):
+    """切换点赞/收藏，记录与计数、排行、每日汇总在同一事务中更新，返回 (切换后的状态, 最新计数)
+    metric 为每日汇总的指标（likes / favorites），取消时计入 unlikes / unfavorites"""
+    # 取回被删除记录的时间，排行按它已衰减的热度扣除
+    removed = db.session.execute(
+        db.delete(model).where(model.user_id == user_id, model.animation_id == animation_id)
+        .returning(model.created_at)
+    ).scalars().all()
+    if removed:
+        Animation.adjust_counter(animation_id, counter, -len(removed))
+        ranking.record(animation_id, -len(removed), removed[0])
+        DailyStat.record(**{f'un{metric}': len(removed)})
+        db.session.commit()
+        active = False
+    else:
+        try:
+            db.session.add(model(user_id=user_id, animation_id=animation_id))
+            Animation.adjust_counter(animation_id, counter, 1)
+            ranking.record(animation_id, 1)
+            DailyStat.record(**{metric: 1})
+            db.session.commit()
+        except IntegrityError:
+            # 并发的相同请求已经插入，计数由那次请求负责
+            db.session.rollback()
+        active = True
+    count = db.session.query(counter).filter(Animation.id == animation_id).scalar()
+    return active, count or 0
+
 @community_bp.route('/animations/<int:animation_id>/like', methods=['POST'])
 @jwt_required()
 def like_animation(animation_id):
@@ -76,17 +109,8 @@ def like_animation(animation_id):
     if not animation or not animation.is_public:
         return jsonify({'error': '动画不存在'}), 404
     
-    existing = Like.query.filter_by(user_id=user_id, animation_id=animation_id).first()
-    
-    if existing:
-        db.session.delete(existing)
-        db.session.commit()
-        return jsonify({'message': '取消点赞', 'liked': False, 'likes_count': animation.likes.count()})
-    
-    like = Like(user_id=user_id, animation_id=animation_id)
-    db.session.add(like)
-    db.session.commit()
-    return jsonify({'message': '点赞成功', 'liked': True, 'likes_count': animation.likes.count()})
+    liked, likes_count = _toggle(Like, Animation.likes_count, 'likes', user_id, animation_id)
+    return jsonify({'message': '点赞成功' if liked else '取消点赞', 'liked': liked, 'likes_count': likes_count})
 
 @community_bp.route('/animations/<int:animation_id>/favorite', methods=['POST'])
 @jwt_required()
@@ -97,70 +121,46 @@ def favorite_animation(animation_id):
     if not animation or not animation.is_public:
         return jsonify({'error': '动画不存在'}), 404
     
-    existing = Favorite.query.filter_by(user_id=user_id, animation_id=animation_id).first()
-    
-    if existing:
-        db.session.delete(existing)
-        db.session.commit()
-        return jsonify({'message': '取消收藏', 'favorited': False, 'favorites_count': animation.favorites.count()})
-    
-    favorite = Favorite(user_id=user_id, animation_id=animation_id)
-    db.session.add(favorite)
-    db.session.commit()
-    return jsonify({'message': '收藏成功', 'favorited': True, 'favorites_count': animation.favorites.count()})
+    favorited, favorites_count = _toggle(Favorite, Animation.favorites_count, 'favorites', user_id, animation_id)
+    return jsonify({'message': '收藏成功' if favorited else '取消收藏', 'favorited': favorited,
+                    'favorites_count': favorites_count})
 
 @community_bp.route('/favorites', methods=['GET'])
 @jwt_required()
 def get_my_favorites():
     user_id = int(get_jwt_identity())
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 12, type=int)
     
-    favorites = Favorite.query.filter_by(user_id=user_id)\
-        .order_by(Favorite.created_at.desc())\
-        .paginate(page=page, per_page=per_page)
-    
-    animations = [f.animation.to_dict() for f in favorites.items if f.animation]
-    
-    return jsonify({
-        'animations': animations,
-        'total': favorites.total,
-        'pages': favorites.pages,
-        'current_page': page
-    })
+    with sqlite_tuning.read_only_session() as session:
+        query = session.query(Favorite).options(joinedload(Favorite.animation).joinedload(Animation.author))\
+            .filter_by(user_id=user_id)
+        try:
+            favorites, next_cursor = paginate_keyset(
+                query, [(Favorite.created_at, True), (Favorite.id, True)], 'newest', cursor, per_page
+            )
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        result = {
+            'animations': [f.animation.to_summary() for f in favorites if f.animation],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if request.args.get('include_total', type=int):
+            result['total'] = count_cache.get(('favorites', user_id), query)
+    return jsonify(result)
 
 @community_bp.route('/featured', methods=['GET'])
 def get_featured_animations():
-    """获取精选推荐动画 - 按点赞+收藏数排序取前3名"""
-    from sqlalchemy import func
-    from models import Like, Favorite
-    
-    # 子查询：计算每个动画的点赞数
-    likes_count = db.session.query(
-        Like.animation_id,
-        func.count(Like.id).label('likes')
-    ).group_by(Like.animation_id).subquery()
-    
-    # 子查询：计算每个动画的收藏数
-    favorites_count = db.session.query(
-        Favorite.animation_id,
-        func.count(Favorite.id).label('favorites')
-    ).group_by(Favorite.animation_id).subquery()
-    
-    # 主查询：按点赞+收藏总数排序
-    animations = db.session.query(Animation)\
-        .outerjoin(likes_count, Animation.id == likes_count.c.animation_id)\
-        .outerjoin(favorites_count, Animation.id == favorites_count.c.animation_id)\
-        .filter(Animation.is_public == True)\
-        .order_by(
-            (func.coalesce(likes_count.c.likes, 0) + func.coalesce(favorites_count.c.favorites, 0)).desc(),
-            Animation.created_at.desc()
-        )\
-        .limit(3).all()
-    
-    return jsonify({
-        'animations': [a.to_dict() for a in animations]
-    })
+    """获取精选推荐动画 - 热门排行前3名（热度相同时按点赞+收藏数）"""
+    with sqlite_tuning.read_only_session() as session:
+        query, keys = ranking.apply(session.query(Animation).options(joinedload(Animation.author)), 'trending')
+        animations = query.order_by(*(expr.desc() for expr, _ in keys)).limit(3).all()
+        
+        return jsonify({
+            'animations': [a.to_summary() for a in animations]
+        })
 
 @community_bp.route('/animations/<int:animation_id>/export/<format>', methods=['GET'])
 def export_public_animation(animation_id, format):
@@ -204,6 +204,8 @@ def export_public_animation(animation_id, format):
         safe_filename = f"animation_{animation_id}.{format}"
         original_filename = f"{animation.title or 'animation'}.{format}"
         encoded_filename = quote(original_filename)
+        DailyStat.record(exports=1)
+        db.session.commit()
         
         return Response(
             data,
@@ -250,6 +252,8 @@ def export_public_animation_stream(animation_id, format):
     
     svg_content = animation.svg_content
     title = animation.title or 'animation'
+    # 导出可能持续数十秒，推流前归还数据库连接
+    db.session.close()
     
     def generate():
         progress_queue = queue.Queue()
@@ -294,6 +298,10 @@ def export_public_animation_stream(animation_id, format):
         if result_holder['error']:
             yield f"data: {json.dumps({'type': 'error', 'message': result_holder['error']})}\n\n"
         else:
+            # 导出次数计入每日汇总（短事务，立即归还连接）
+            DailyStat.record(exports=1)
+            db.session.commit()
+            db.session.close()
             # 将文件数据转为 base64
             data_base64 = base64.b64encode(result_holder['data']).decode('utf-8')
             yield f"data: {json.dumps({'type': 'complete', 'data': data_base64, 'filename': f'{title}.{format}', 'mimetype': 'video/mp4' if format == 'mp4' else 'image/gif'})}\n\n"
@@ -1,28 +1,79 @@
 import json
 import os
+import re
+import time
+import queue
+import threading
 import requests
 import logging
 from dotenv import load_dotenv
 from typing import Generator, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.prompts import (
+    ANIMATION_PROMPT, ANIMATION_STREAM_PROMPT, STORYBOARD_PROMPT, SCENE_PROMPT, EDIT_PROMPT, CONTINUE_PROMPT,
+    PROMPT_VERSION
+)
+from services.json_repair import parse_model_json
 
 # 确保环境变量已加载
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# 可用模型列表
+# 可用模型列表（价格单位：美元 / 百万 tokens；quality 为模型路由使用的质量等级 1-3）
 AVAILABLE_MODELS = [
-    {'id': 'claude-haiku-4-5-20251001', 'name': 'Claude Haiku 4.5', 'provider': 'claude'},
-    {'id': 'gemini-3-flash-preview', 'name': 'Gemini 3 Flash', 'provider': 'gemini'},
-    {'id': 'gemini-3-pro-preview-11-2025', 'name': 'Gemini 3 Pro', 'provider': 'gemini'},
+    {'id': 'claude-haiku-4-5-20251001', 'name': 'Claude Haiku 4.5', 'provider': 'claude', 'input_price': 1.0, 'output_price': 5.0, 'quality': 2},
+    {'id': 'gemini-3-flash-preview', 'name': 'Gemini 3 Flash', 'provider': 'gemini', 'input_price': 0.5, 'output_price': 3.0, 'quality': 1},
+    {'id': 'gemini-3-pro-preview-11-2025', 'name': 'Gemini 3 Pro', 'provider': 'gemini', 'input_price': 2.0, 'output_price': 12.0, 'quality': 3},
 ]
 
+# CJK 字符（中日韩文字及全角标点）大致 1 字符 = 1 token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算token数（provider未返回usage时的兜底）：CJK约1字符1 token，其余约4字符1 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_text(message: dict) -> str:
+    """取出消息文本（content 可能是字符串或多段 content parts）"""
+    content = message.get('content', '')
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content)
+    return content or ''
+
+
+def calculate_cost(model_id: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按模型价格表计算费用（美元）"""
+    for m in AVAILABLE_MODELS:
+        if m['id'] == model_id:
+            cost = prompt_tokens * m.get('input_price', 0) + completion_tokens * m.get('output_price', 0)
+            return round(cost / 1_000_000, 6)
+    return 0.0
+
+class AIServiceError(Exception):
+    """上游 API 返回错误"""
+    pass
+
 class AIService:
     def __init__(self):
         # 直接从环境变量读取，而不是从Config
         self.api_key = os.environ.get('CLAUDE_API_KEY', '')
         self.base_url = os.environ.get('CLAUDE_API_BASE_URL', 'https://yunwu.ai/v1')
         self.default_model = os.environ.get('CLAUDE_MODEL', 'claude-haiku-4-5-20251001')
+        # 输出因 max_tokens 截断时最多续写的次数
+        self.max_continuations = int(os.environ.get('AI_MAX_CONTINUATIONS', '3'))
+        # 长动画：单个用户同时生成的场景数上限、分镜最多场景数
+        self.scene_concurrency = int(os.environ.get('AI_SCENE_CONCURRENCY', '3'))
+        self.max_scenes = int(os.environ.get('AI_MAX_SCENES', '12'))
+        # 批量生成：单个批次同时请求上游的数量
+        self.batch_concurrency = int(os.environ.get('AI_BATCH_CONCURRENCY', '3'))
+        self._user_slots = {}
+        self._slots_lock = threading.Lock()
         self._current_model = None  # 缓存当前模型
         
         # 验证配置
@@ -39,19 +90,25 @@ class AIService:
         }
 
     def _get_current_model(self):
-        """从数据库获取当前配置的模型"""
+        """获取当前配置的模型"""
         try:
-            # 延迟导入避免循环依赖
-            from models import SystemConfig, db
-            # 确保在应用上下文中
-            if db.session:
-                model = SystemConfig.get('ai_model', self.default_model)
-                return model if model else self.default_model
-            return self.default_model
+            # 读取进程内配置缓存，不再每次查询数据库
+            from services.config_cache import config_cache
+            return config_cache.get('ai_model', self.default_model)
         except Exception as e:
             logger.warning(f"获取模型配置失败: {e}, 使用默认模型")
             return self.default_model
 
+    def _route_model(self, prompt: str, duration, params: dict = None) -> str:
+        """按路由策略为本次生成选择模型，路由失败时使用全局配置的模型"""
+        default_model = self._get_current_model()
+        try:
+            from services.model_router import model_router
+            return model_router.select(prompt, duration, params, default_model)['model'] or default_model
+        except Exception as e:
+            logger.warning(f"模型路由失败: {e}, 使用当前模型")
+            return default_model
+
     def _validate_config(self) -> tuple[bool, str]:
         """验证API配置"""
         if not self.api_key:
@@ -60,6 +117,104 @@ class AIService:
             return False, "CLAUDE_API_BASE_URL 未配置"
         return True, ""
 
+    def _build_usage(self, model: str, raw_usage: dict, messages: list, content: str,
+                     started_at: float, first_token_at: float = None, finished_at: float = None) -> dict:
+        """整理一次请求的用量：优先使用 provider 返回的 usage，缺失时本地估算"""
+        finished_at = finished_at or time.time()
+        raw_usage = raw_usage or {}
+        estimated = not raw_usage.get('completion_tokens')
+
+        if estimated:
+            prompt_tokens = sum(estimate_tokens(message_text(m)) for m in messages)
+            completion_tokens = estimate_tokens(content)
+        else:
+            prompt_tokens = raw_usage.get('prompt_tokens', 0)
+            completion_tokens = raw_usage.get('completion_tokens', 0)
+
+        ttft_ms = int((first_token_at - started_at) * 1000) if first_token_at else None
+        decode_seconds = finished_at - (first_token_at or started_at)
+        tokens_per_second = round(completion_tokens / decode_seconds, 2) if decode_seconds > 0 else None
+
+        return {
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'estimated': estimated,
+            'cost': calculate_cost(model, prompt_tokens, completion_tokens),
+            'cached_tokens': self._get_cached_tokens(raw_usage),
+            'ttft_ms': ttft_ms,
+            'duration_ms': int((finished_at - started_at) * 1000),
+            'tokens_per_second': tokens_per_second,
+            'prompt_version': PROMPT_VERSION
+        }
+
+    @staticmethod
+    def _get_cached_tokens(raw_usage: dict) -> int:
+        """命中前缀缓存的输入token数（OpenAI 兼容格式或 Anthropic 格式）"""
+        details = raw_usage.get('prompt_tokens_details') or {}
+        return details.get('cached_tokens') or raw_usage.get('cache_read_input_tokens') or 0
+
+    def _get_provider(self, model_id: str) -> str:
+        """根据模型ID获取 provider"""
+        for m in AVAILABLE_MODELS:
+            if m['id'] == model_id:
+                return m['provider']
+        return 'claude' if model_id.startswith('claude') else 'unknown'
+
+    @staticmethod
+    def _merge_usage(total: dict, leg: dict, continuation: bool = True) -> dict:
+        """合并多段请求（续写或多个场景）的用量"""
+        if not total:
+            return dict(leg, continuations=0)
+
+        def decode_seconds(u):
+            return u['completion_tokens'] / u['tokens_per_second'] if u.get('tokens_per_second') else 0
+
+        merged = dict(total)
+        for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens', 'duration_ms'):
+            merged[key] = total.get(key, 0) + leg.get(key, 0)
+        merged['cost'] = round(total['cost'] + leg['cost'], 6)
+        merged['estimated'] = total['estimated'] or leg['estimated']
+        merged['continuations'] = total.get('continuations', 0) + leg.get('continuations', 0) + (1 if continuation else 0)
+        seconds = decode_seconds(total) + decode_seconds(leg)
+        merged['tokens_per_second'] = round(merged['completion_tokens'] / seconds, 2) if seconds > 0 else None
+        return merged
+
+    @staticmethod
+    def _stitch(previous: str, piece: str) -> str:
+        """拼接续写内容：去掉开头的代码块标记以及与已有内容重叠的部分"""
+        if not previous:
+            return piece
+        piece = re.sub(r'^\s*```[a-zA-Z]*\s*\n', '', piece)
+        for overlap in range(min(len(previous), len(piece), 500), 20, -1):
+            if previous.endswith(piece[:overlap]):
+                return previous + piece[overlap:]
+        return previous + piece
+
+    @staticmethod
+    def _continuation_payload(payload: dict, partial: str) -> dict:
+        """构造续写请求：把已输出的部分作为 assistant 消息回传"""
+        continuation = dict(payload)
+        continuation['messages'] = payload['messages'] + [
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": CONTINUE_PROMPT}
+        ]
+        return continuation
+
+    def _raise_for_status(self, response):
+        """非 200 响应转换为 AIServiceError"""
+        if response.status_code == 200:
+            return
+        error_text = response.text
+        logger.error(f"❌ API 错误: {response.status_code} - {error_text}")
+        # 尝试解析错误信息
+        try:
+            error_msg = response.json().get('error', {}).get('message', error_text)
+        except Exception:
+            error_msg = error_text
+        raise AIServiceError(f"API Error: {response.status_code} - {error_msg}")
+
     def get_available_models(self):
         """获取可用模型列表"""
         return AVAILABLE_MODELS
@@ -90,7 +245,48 @@ class AIService:
             logger.error(f"设置模型失败: {e}")
             return False
 
-    def generate_animation(self, prompt: str, duration: int = 30, params: dict = None) -> dict:
+    def _complete_json(self, model: str, payload: dict):
+        """非流式请求并解析 JSON，输出被截断时自动续写，返回 (结果dict或None, usage)"""
+        content = ""
+        usage = None
+        finish_reason = None
+        for leg in range(self.max_continuations + 1):
+            leg_payload = self._continuation_payload(payload, content) if leg else payload
+            started_at = time.time()
+            response = requests.post(
+                f"{self.base_url}/chat/completions",
+                headers=self._get_headers(),
+                json=leg_payload,
+                timeout=240
+            )
+            
+            logger.info(f"📊 API 响应状态码: {response.status_code}")
+            self._raise_for_status(response)
+            
+            data = response.json()
+            piece = data['choices'][0]['message']['content']
+            finish_reason = data['choices'][0].get('finish_reason')
+            content = self._stitch(content, piece)
+            # 非流式请求无法区分首token时间，ttft 记为空
+            usage = self._merge_usage(usage, self._build_usage(model, data.get('usage'), leg_payload['messages'], piece, started_at))
+            
+            # 未被截断，或拼接后的 JSON 已经闭合
+            if finish_reason != 'length' or parse_model_json(content) is not None:
+                break
+            if leg < self.max_continuations:
+                logger.info(f"✂️ 输出被截断，发起第 {leg + 1} 次续写")
+        
+        logger.debug(f"✅ API 返回内容长度: {len(content)}")
+        logger.info(f"📈 Token 用量: prompt={usage['prompt_tokens']} (cached={usage['cached_tokens']}), completion={usage['completion_tokens']}, "
+                    f"continuations={usage['continuations']}, estimated={usage['estimated']}")
+        
+        # 解析JSON（输出被截断时尝试修复）
+        result = parse_model_json(content, truncated=finish_reason == 'length')
+        if result is None:
+            logger.warning(f"⚠️ 无法解析 JSON, finish_reason={finish_reason}")
+        return result, usage
+
+    def generate_animation(self, prompt: str, duration: int = 30, params: dict = None, model: str = None) -> dict:
         """根据用户描述生成SVG动画数据"""
         
         # 验证配置
@@ -98,8 +294,8 @@ class AIService:
         if not is_valid:
             return {"success": False, "error": error_msg}
         
-        # 获取当前模型
-        model = self._get_current_model()
+        # 按路由策略选择模型（在工作线程中调用时由调用方传入，避免访问数据库）
+        model = model or self._route_model(prompt, duration, params)
         
         # 用户可调参数
         params = params or {}
@@ -108,90 +304,18 @@ class AIService:
         accent_color = params.get('accentColor', '#22d3ee')
         animation_speed = params.get('speed', 1.0)
         
-        system_prompt = f"""你是一个专业的SVG动画生成助手。根据用户的描述，生成教学演示用的SVG动画。
-
-【重要】你必须返回一个有效的JSON对象，不要包含任何其他文字说明。
-
-JSON格式要求：
-{{
-    "title": "动画标题（简短）",
-    "description": "动画描述",
-    "category": "分类（物理/化学/生物/数学/地理/其他）",
-    "svg_content": "完整的SVG代码字符串",
-    "animation_data": {{
-        "elements": [],
-        "duration": {duration},
-        "width": 800,
-        "height": 600,
-        "params": {{
-            "bgColor": "{bg_color}",
-            "primaryColor": "{primary_color}",
-            "accentColor": "{accent_color}",
-            "speed": {animation_speed}
-        }}
-    }}
-}}
-
-【SVG动画核心要求】：
-1. 必须使用CSS @keyframes定义真实的动画效果
-2. 动画必须是连续循环的，使用 animation: name Xs infinite
-3. 包含多个动画元素，每个元素有不同的动画效果
-4. 使用transform进行移动、旋转、缩放动画
-5. 使用opacity进行淡入淡出效果
-6. 动画时长约{duration}秒，速度系数{animation_speed}
-
-【文字布局规范 - 非常重要】：
-1. 画布尺寸为 800x600，合理规划布局区域
-2. 标题放在顶部（y=40-60），字号24-28px
-3. 主要动画内容放在中间区域（y=100-450）
-4. 说明文字/标签放在底部或元素旁边，避免与动画元素重叠
-5. 每个文字元素之间至少保持30px的垂直间距
-6. 使用 text-anchor="middle" 居中对齐文字
-7. 标签文字使用较小字号（12-14px），放在对应元素附近但不重叠
-8. 如果有多行文字，使用不同的y坐标，每行间隔25-30px
-9. 动态文字（如数值显示）要预留足够空间，避免数字变化时重叠
-10. 文字不要放在动画路径上，避免被移动的元素遮挡
-
-【配色方案】：
-- 背景色: {bg_color}
-- 主色调: {primary_color}
-- 强调色: {accent_color}
-- 文字颜色: #e2e8f0（主要文字）、#94a3b8（次要文字/标签）
-
-【SVG代码示例结构】：
-<svg viewBox="0 0 800 600" xmlns="http://www.w3.org/2000/svg">
-  <defs>
-    <style>
-      @keyframes move {{ 0% {{ transform: translateX(0); }} 50% {{ transform: translateX(100px); }} 100% {{ transform: translateX(0); }} }}
-      @keyframes rotate {{ from {{ transform: rotate(0deg); }} to {{ transform: rotate(360deg); }} }}
-      @keyframes pulse {{ 0%, 100% {{ opacity: 1; }} 50% {{ opacity: 0.5; }} }}
-      .title {{ font-size: 26px; font-weight: bold; fill: #e2e8f0; text-anchor: middle; }}
-      .label {{ font-size: 14px; fill: #94a3b8; text-anchor: middle; }}
-      .animated {{ animation: move {duration}s ease-in-out infinite; }}
-    </style>
-  </defs>
-  <rect width="800" height="600" fill="{bg_color}"/>
-  <!-- 标题区域 y=50 -->
-  <text x="400" y="50" class="title">标题</text>
-  <!-- 动画内容区域 y=100-450 -->
-  <!-- 说明文字区域 y=500-580 -->
-</svg>
-
-【必须包含的动画类型】：
-- 位移动画 (translateX/Y)
-- 旋转动画 (rotate)  
-- 缩放动画 (scale)
-- 透明度动画 (opacity)
-
-请确保SVG代码完整、有效，动画流畅自然，文字布局清晰不重叠。"""
-
         try:
             payload = {
                 "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"请为以下主题生成一个{duration}秒的教学动画，要求动画效果丰富、流畅：\n\n{prompt}"}
-                ],
+                "messages": ANIMATION_PROMPT.build_messages(
+                    self._get_provider(model),
+                    prompt=prompt,
+                    duration=duration,
+                    bg_color=bg_color,
+                    primary_color=primary_color,
+                    accent_color=accent_color,
+                    speed=animation_speed
+                ),
                 "temperature": 0.7,
                 "max_tokens": 8000
             }
@@ -199,78 +323,27 @@ JSON格式要求：
             logger.info(f"📡 发送API请求: {self.base_url}/chat/completions, 模型: {model}")
             logger.debug(f"Payload: {json.dumps(payload, ensure_ascii=False)[:200]}...")
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self._get_headers(),
-                json=payload,
-                timeout=240
-            )
+            result, usage = self._complete_json(model, payload)
+            if result is None:
+                return {"success": False, "error": "AI 返回内容无法解析，请重试", "usage": usage}
             
-            logger.info(f"📊 API 响应状态码: {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"❌ API 错误: {response.status_code} - {error_text}")
-                
-                # 尝试解析错误信息
-                try:
-                    error_data = response.json()
-                    error_msg = error_data.get('error', {}).get('message', error_text)
-                except:
-                    error_msg = error_text
-                
-                return {"success": False, "error": f"API Error: {response.status_code} - {error_msg}"}
-            
-            data = response.json()
-            content = data['choices'][0]['message']['content']
-            
-            logger.debug(f"✅ API 返回内容长度: {len(content)}")
-            
-            # 尝试解析JSON
-            try:
-                result = json.loads(content)
-                logger.info("✅ JSON 解析成功")
-            except json.JSONDecodeError as e:
-                logger.warning(f"⚠️ JSON 解析失败: {str(e)}")
-                # 如果不是纯JSON，尝试提取JSON部分
-                import re
-                
-                # 尝试多种方式提取JSON
-                json_patterns = [
-                    r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}',  # 嵌套JSON
-                    r'\{.*\}',  # 简单JSON
-                ]
-                
-                result = None
-                for pattern in json_patterns:
-                    json_match = re.search(pattern, content, re.DOTALL)
-                    if json_match:
-                        try:
-                            result = json.loads(json_match.group())
-                            logger.info(f"✅ 从响应中提取 JSON 成功 (使用模式: {pattern[:20]}...)")
-                            break
-                        except json.JSONDecodeError:
-                            continue
-                
-                if result is None:
-                    logger.warning("⚠️ 无法解析 JSON，使用默认动画")
-                    result = self._generate_default_animation(prompt, duration)
-            
-            return {"success": True, "data": result}
+            return {"success": True, "data": result, "usage": usage}
+        except AIServiceError as e:
+            return {"success": False, "error": str(e), "model": model}
         except requests.exceptions.Timeout:
             error_msg = "请求超时，API 服务器响应缓慢"
             logger.error(f"❌ {error_msg}")
-            return {"success": False, "error": error_msg}
+            return {"success": False, "error": error_msg, "model": model}
         except requests.exceptions.ConnectionError as e:
             error_msg = f"连接失败: {str(e)}"
             logger.error(f"❌ {error_msg}")
-            return {"success": False, "error": error_msg}
+            return {"success": False, "error": error_msg, "model": model}
         except Exception as e:
             error_msg = f"发生错误: {str(e)}"
             logger.error(f"❌ {error_msg}")
-            return {"success": False, "error": error_msg}
+            return {"success": False, "error": error_msg, "model": model}
 
-    def generate_storyboard(self, prompt: str) -> dict:
+    def generate_storyboard(self, prompt: str, duration: int = 60, model: str = None) -> dict:
         """生成分镜规划"""
         
         # 验证配置
@@ -278,152 +351,337 @@ JSON格式要求：
         if not is_valid:
             return {"success": False, "error": error_msg}
         
-        system_prompt = """你是一个教学动画分镜规划师。根据用户描述，规划动画的分镜脚本。
-
-返回JSON格式：
-{
-    "scenes": [
-        {
-            "scene_number": 1,
-            "duration": 5,
-            "description": "场景描述",
-            "elements": ["元素列表"],
-            "animation_notes": "动画说明"
-        }
-    ],
-    "total_duration": 总时长,
-    "style_guide": "风格指南"
-}"""
-
+        model = model or self._get_current_model()
+        
         try:
             payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "user", "content": f"{system_prompt}\n\n{prompt}"}
-                ],
+                "model": model,
+                "messages": STORYBOARD_PROMPT.build_messages(
+                    self._get_provider(model),
+                    prompt=prompt,
+                    duration=duration
+                ),
                 "temperature": 0.7,
                 "max_tokens": 2000
             }
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self._get_headers(),
-                json=payload,
-                timeout=240
-            )
-            
-            if response.status_code != 200:
-                return {"success": False, "error": f"API Error: {response.status_code}"}
+            result, usage = self._complete_json(model, payload)
+            if not result or not result.get('scenes'):
+                return {"success": False, "error": "分镜规划解析失败，请重试", "usage": usage}
             
-            data = response.json()
-            content = data['choices'][0]['message']['content']
+            return {"success": True, "data": result, "usage": usage}
+        except AIServiceError as e:
+            return {"success": False, "error": str(e)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def edit_animation(self, svg_content: str, instruction: str) -> dict:
+        """按修改要求生成结构化补丁（不重新生成整个SVG），返回 {"summary", "operations"}"""
+        
+        # 验证配置
+        is_valid, error_msg = self._validate_config()
+        if not is_valid:
+            return {"success": False, "error": error_msg}
+        
+        model = self._get_current_model()
+        
+        try:
+            payload = {
+                "model": model,
+                "messages": EDIT_PROMPT.build_messages(
+                    self._get_provider(model),
+                    svg=svg_content,
+                    instruction=instruction
+                ),
+                "temperature": 0.2,
+                "max_tokens": 4000
+            }
             
-            try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                else:
-                    result = {"scenes": [], "total_duration": 0, "style_guide": ""}
+            result, usage = self._complete_json(model, payload)
+            if not result or not isinstance(result.get('operations'), list):
+                return {"success": False, "error": "AI 返回的修改无法解析，请重试", "usage": usage}
             
-            return {"success": True, "data": result}
+            return {"success": True, "data": result, "usage": usage}
+        except AIServiceError as e:
+            return {"success": False, "error": str(e)}
+        except requests.exceptions.Timeout:
+            return {"success": False, "error": "请求超时，API 服务器响应缓慢"}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def _generate_default_animation(self, prompt: str, duration: int, params: dict = None) -> dict:
-        """生成默认SVG动画（当API返回非JSON时）"""
+    def _user_slot(self, user_id) -> threading.BoundedSemaphore:
+        """每个用户一个信号量，限制该用户同时进行的场景生成数"""
+        with self._slots_lock:
+            if user_id not in self._user_slots:
+                self._user_slots[user_id] = threading.BoundedSemaphore(self.scene_concurrency)
+            return self._user_slots[user_id]
+
+    def _generate_scene(self, model: str, scene: dict, storyboard: dict, topic: str,
+                        params: dict, user_id=None) -> tuple:
+        """生成单个场景的SVG，返回 (场景, SVG, usage)"""
+        payload = {
+            "model": model,
+            "messages": SCENE_PROMPT.build_messages(
+                self._get_provider(model),
+                topic=topic,
+                style_guide=storyboard.get('style_guide') or '简洁、统一的扁平风格',
+                scene_number=scene['scene_number'],
+                scene_total=len(storyboard['scenes']),
+                duration=scene['duration'],
+                description=scene.get('description', ''),
+                elements='、'.join(str(e) for e in scene.get('elements') or []) or '自行设计',
+                notes=scene.get('animation_notes', ''),
+                bg_color=params.get('bgColor', '#0f172a'),
+                primary_color=params.get('primaryColor', '#6366f1'),
+                accent_color=params.get('accentColor', '#22d3ee')
+            ),
+            "temperature": 0.7,
+            "max_tokens": 8000
+        }
+        with self._user_slot(user_id):
+            result, usage = self._complete_json(model, payload)
+        if not result or not result.get('svg_content'):
+            raise AIServiceError(f"场景 {scene['scene_number']} 生成失败")
+        return scene, result['svg_content'], usage
+
+    @staticmethod
+    def _normalize_scenes(scenes: list, duration: int, max_scenes: int) -> list:
+        """整理分镜：限制场景数量，并把各场景时长按比例缩放到目标总时长"""
+        scenes = [s for s in scenes if isinstance(s, dict)][:max_scenes]
+        weights = []
+        for s in scenes:
+            try:
+                weights.append(max(float(s.get('duration') or 0), 1.0))
+            except (TypeError, ValueError):
+                weights.append(1.0)
+        total = sum(weights) or 1.0
+        for index, (scene, weight) in enumerate(zip(scenes, weights), start=1):
+            scene['scene_number'] = index
+            scene['duration'] = max(1, round(duration * weight / total))
+        return scenes
+
+    def generate_long_animation_stream(self, prompt: str, duration: int = 60, params: dict = None,
+                                       user_id=None) -> Generator:
+        """长动画：先生成分镜，再并发生成各场景SVG，最后合成为一条时间轴"""
+        
+        # 验证配置
+        is_valid, error_msg = self._validate_config()
+        if not is_valid:
+            yield {"type": "error", "message": error_msg}
+            return
+        
+        # 分镜和所有场景使用同一个模型，保证风格统一
         params = params or {}
-        bg_color = params.get('bgColor', '#0f172a')
-        primary_color = params.get('primaryColor', '#6366f1')
-        accent_color = params.get('accentColor', '#22d3ee')
+        model = self._route_model(prompt, duration, params)
         
-        return {
-            "title": prompt[:50] or "教学动画",
-            "description": prompt,
-            "category": "其他",
-            "svg_content": f"""<svg viewBox="0 0 800 600" xmlns="http://www.w3.org/2000/svg">
-  <defs>
-    <style>
-      @keyframes rotate {{
-        from {{ transform: rotate(0deg); }}
-        to {{ transform: rotate(360deg); }}
-      }}
-      @keyframes pulse {{
-        0%, 100% {{ transform: scale(1); opacity: 1; }}
-        50% {{ transform: scale(1.1); opacity: 0.8; }}
-      }}
-      @keyframes float {{
-        0%, 100% {{ transform: translateY(0); }}
-        50% {{ transform: translateY(-20px); }}
-      }}
-      @keyframes dash {{
-        to {{ stroke-dashoffset: 0; }}
-      }}
-      .bg {{ fill: {bg_color}; }}
-      .circle-outer {{ 
-        fill: none; 
-        stroke: {accent_color}; 
-        stroke-width: 3;
-        transform-origin: 400px 280px;
-        animation: rotate {duration}s linear infinite;
-      }}
-      .circle-inner {{ 
-        fill: none; 
-        stroke: {primary_color}; 
-        stroke-width: 2;
-        transform-origin: 400px 280px;
-        animation: rotate {duration * 0.7}s linear infinite reverse;
-      }}
-      .center-dot {{
-        fill: {accent_color};
-        transform-origin: 400px 280px;
-        animation: pulse 2s ease-in-out infinite;
-      }}
-      .orbit-dot {{
-        fill: {primary_color};
-        animation: float 3s ease-in-out infinite;
-      }}
-      .title {{ 
-        font-size: 28px; 
-        font-weight: bold; 
-        fill: #e2e8f0;
-        text-anchor: middle;
-      }}
-      .subtitle {{
-        font-size: 16px;
-        fill: #94a3b8;
-        text-anchor: middle;
-      }}
-    </style>
-  </defs>
-  <rect width="800" height="600" class="bg"/>
-  <circle cx="400" cy="280" r="120" class="circle-outer"/>
-  <circle cx="400" cy="280" r="80" class="circle-inner"/>
-  <circle cx="400" cy="280" r="15" class="center-dot"/>
-  <circle cx="400" cy="160" r="10" class="orbit-dot"/>
-  <circle cx="520" cy="280" r="8" class="orbit-dot" style="animation-delay: 0.5s;"/>
-  <circle cx="400" cy="400" r="8" class="orbit-dot" style="animation-delay: 1s;"/>
-  <circle cx="280" cy="280" r="8" class="orbit-dot" style="animation-delay: 1.5s;"/>
-  <text x="400" y="500" class="title">{prompt[:30]}</text>
-  <text x="400" y="530" class="subtitle">教学演示动画</text>
-</svg>""",
-            "animation_data": {
-                "elements": [
-                    {"id": "circle-outer", "type": "circle", "animation": {"type": "rotate", "duration": f"{duration}s"}},
-                    {"id": "circle-inner", "type": "circle", "animation": {"type": "rotate", "duration": f"{duration * 0.7}s"}},
-                    {"id": "center-dot", "type": "circle", "animation": {"type": "pulse", "duration": "2s"}},
-                    {"id": "orbit-dots", "type": "circle", "animation": {"type": "float", "duration": "3s"}}
-                ],
-                "duration": duration,
-                "width": 800,
-                "height": 600,
-                "params": params
-            }
+        yield {"type": "progress", "progress": 2, "tokens": 0, "message": "规划分镜中..."}
+        storyboard_result = self.generate_storyboard(prompt, duration, model)
+        if not storyboard_result['success']:
+            yield {"type": "error", "message": storyboard_result['error'], "usage": storyboard_result.get('usage'), "model": model}
+            return
+        
+        storyboard = storyboard_result['data']
+        usage = storyboard_result['usage']
+        storyboard['scenes'] = self._normalize_scenes(storyboard['scenes'], duration, self.max_scenes)
+        scene_count = len(storyboard['scenes'])
+        if not scene_count:
+            yield {"type": "error", "message": "分镜规划解析失败，请重试", "usage": usage}
+            return
+        
+        yield {
+            "type": "progress",
+            "progress": 10,
+            "tokens": usage['completion_tokens'],
+            "message": f"分镜完成，共 {scene_count} 个场景，并行生成中...",
+            "storyboard": storyboard
+        }
+        
+        # 并发生成所有场景，总耗时取决于最慢的场景
+        scene_svgs = {}
+        executor = ThreadPoolExecutor(max_workers=min(self.scene_concurrency, scene_count))
+        try:
+            futures = [
+                executor.submit(self._generate_scene, model, scene, storyboard, prompt, params, user_id)
+                for scene in storyboard['scenes']
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                scene, svg_content, scene_usage = future.result()
+                scene_svgs[scene['scene_number']] = svg_content
+                usage = self._merge_usage(usage, scene_usage, continuation=False)
+                yield {
+                    "type": "progress",
+                    "progress": 10 + int(done / scene_count * 85),
+                    "tokens": usage['completion_tokens'],
+                    "message": f"场景 {scene['scene_number']} 完成 ({done}/{scene_count})",
+                    "scene": scene['scene_number']
+                }
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            logger.error(f"❌ 场景生成失败: {str(e)}")
+            yield {"type": "error", "message": f"生成失败: {str(e)}", "usage": usage, "model": model}
+            return
+        finally:
+            # 客户端断开时不再发起尚未开始的场景
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        yield {"type": "progress", "progress": 97, "tokens": usage['completion_tokens'], "message": "合成时间轴..."}
+        
+        from services.scene_composer import scene_composer
+        scenes = [dict(scene, svg_content=scene_svgs[scene['scene_number']]) for scene in storyboard['scenes']]
+        try:
+            svg_content = scene_composer.compose(scenes, params.get('bgColor', '#0f172a'))
+        except ValueError as e:
+            logger.error(f"❌ 场景合成失败: {str(e)}")
+            yield {"type": "error", "message": f"场景合成失败: {str(e)}", "usage": usage}
+            return
+        
+        yield {
+            "type": "complete",
+            "data": {
+                "title": storyboard.get('title') or prompt[:50],
+                "description": storyboard.get('description') or prompt,
+                "category": storyboard.get('category', '其他'),
+                "svg_content": svg_content,
+                "animation_data": {
+                    "duration": sum(scene['duration'] for scene in storyboard['scenes']),
+                    "width": 800,
+                    "height": 600,
+                    "params": params,
+                    "style_guide": storyboard.get('style_guide', ''),
+                    "scenes": [
+                        {k: scene.get(k) for k in ('scene_number', 'duration', 'description', 'elements', 'animation_notes')}
+                        for scene in storyboard['scenes']
+                    ]
+                }
+            },
+            "tokens": usage['completion_tokens'],
+            "usage": usage
         }
 
-    def generate_animation_stream(self, prompt: str, duration: int = 30, params: dict = None) -> Generator:
+    def _batch_item(self, index: int, item: dict, model: str, events: queue.Queue, stopped: threading.Event):
+        """在工作线程中流式生成一个条目：进度（百分比变化时）和最终结果都带上条目序号放入 events"""
+        stream = self.generate_animation_stream(item['prompt'], item['duration'], item['params'], model)
+        result = {"success": False, "error": "生成已取消"}
+        last_progress = None
+        try:
+            for event in stream:
+                if stopped.is_set():
+                    break
+                if event['type'] == 'progress':
+                    if event['progress'] != last_progress:
+                        last_progress = event['progress']
+                        events.put({"type": "progress", "index": index, "progress": event['progress'],
+                                    "tokens": event.get('tokens', 0), "message": event.get('message', '')})
+                elif event['type'] == 'complete':
+                    result = {"success": True, "data": event['data'], "usage": event.get('usage')}
+                elif event['type'] == 'error':
+                    result = {"success": False, "error": event['message'], "usage": event.get('usage'),
+                              "model": event.get('model')}
+        except Exception as e:
+            result = {"success": False, "error": str(e), "model": model}
+        finally:
+            # 客户端断开时关闭上游流，停止继续消耗 token
+            stream.close()
+            events.put({"type": "item", "index": index, **result})
+
+    def generate_batch_stream(self, items: list) -> Generator:
+        """批量生成：items 为 [{'prompt', 'duration', 'params'}]，有界并发流式请求上游，
+        各条目的进度事件（type=progress）和结果（type=item）都带 index，结果按完成顺序返回"""
+        
+        # 验证配置
+        is_valid, error_msg = self._validate_config()
+        if not is_valid:
+            for index in range(len(items)):
+                yield {"type": "item", "index": index, "success": False, "error": error_msg}
+            return
+        
+        # 在当前线程中逐项路由模型，工作线程不访问数据库
+        models = [self._route_model(item['prompt'], item['duration'], item['params']) for item in items]
+        events = queue.Queue()
+        stopped = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.batch_concurrency, len(items))))
+        try:
+            for index, item in enumerate(items):
+                executor.submit(self._batch_item, index, item, models[index], events, stopped)
+            remaining = len(items)
+            while remaining:
+                event = events.get()
+                if event['type'] == 'item':
+                    remaining -= 1
+                yield event
+        finally:
+            # 客户端断开时不再发起尚未开始的请求，进行中的条目在下一个事件时停止
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # 流式进度条按此输出长度估算
+    ESTIMATED_MAX_TOKENS = 6000
+
+    def _stream_leg(self, payload: dict, leg: int, tokens_before: int) -> Generator:
+        """执行一次流式请求并逐块产出进度事件，返回 (内容, finish_reason, 原始usage, 首token时间)"""
+        response = requests.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._get_headers(),
+            json=payload,
+            timeout=240,
+            stream=True
+        )
+        try:
+            self._raise_for_status(response)
+            return (yield from self._read_stream(response, leg, tokens_before))
+        finally:
+            # 正常结束或客户端断开（生成器被关闭）时都立即释放上游连接，停止继续消耗 token
+            response.close()
+
+    def _read_stream(self, response, leg: int, tokens_before: int) -> Generator:
+        """逐行解析上游的 SSE 响应并产出进度事件"""
+        content = ""
+        tokens = tokens_before
+        raw_usage = None
+        first_token_at = None
+        finish_reason = None
+        
+        for line in response.iter_lines():
+            if line:
+                line_text = line.decode('utf-8')
+                if line_text.startswith('data: '):
+                    data_str = line_text[6:]
+                    if data_str == '[DONE]':
+                        break
+                    try:
+                        data = json.loads(data_str)
+                        if data.get('usage'):
+                            raw_usage = data['usage']
+                        if 'choices' in data and len(data['choices']) > 0:
+                            finish_reason = data['choices'][0].get('finish_reason') or finish_reason
+                            delta = data['choices'][0].get('delta', {})
+                            chunk = delta.get('content', '')
+                            if chunk:
+                                if first_token_at is None:
+                                    first_token_at = time.time()
+                                content += chunk
+                                # 流式过程中 usage 尚未返回，按增量本地估算
+                                tokens += estimate_tokens(chunk)
+                                # 计算进度百分比
+                                progress = min(95, int((tokens / self.ESTIMATED_MAX_TOKENS) * 100))
+                                
+                                event = {
+                                    "type": "progress",
+                                    "progress": progress,
+                                    "tokens": tokens,
+                                    "message": "生成中..." if leg == 0 else f"续写中（第 {leg + 1} 段）..."
+                                }
+                                if leg:
+                                    event["leg"] = leg
+                                yield event
+                    except json.JSONDecodeError:
+                        continue
+        
+        return content, finish_reason, raw_usage, first_token_at
+
+    def generate_animation_stream(self, prompt: str, duration: int = 30, params: dict = None,
+                                  model: str = None) -> Generator:
         """流式生成SVG动画，实时返回进度和token数"""
         
         # 验证配置
@@ -432,8 +690,8 @@ JSON格式要求：
             yield {"type": "error", "message": error_msg}
             return
         
-        # 获取当前模型
-        model = self._get_current_model()
+        # 按路由策略选择模型（在工作线程中调用时由调用方传入，避免访问数据库）
+        model = model or self._route_model(prompt, duration, params)
         
         # 用户可调参数
         params = params or {}
@@ -442,116 +700,84 @@ JSON格式要求：
         accent_color = params.get('accentColor', '#22d3ee')
         animation_speed = params.get('speed', 1.0)
         
-        system_prompt = f"""你是一个专业的SVG动画生成助手。根据用户的描述，生成教学演示用的SVG动画。
-
-【重要】你必须返回一个有效的JSON对象，不要包含任何其他文字说明。
-
-JSON格式要求：
-{{
-    "title": "动画标题（简短）",
-    "description": "动画描述",
-    "category": "分类（物理/化学/生物/数学/地理/其他）",
-    "svg_content": "完整的SVG代码字符串",
-    "animation_data": {{}}
-}}
-
-【SVG动画核心要求】：
-1. 必须使用CSS @keyframes定义真实的动画效果
-2. 动画必须是连续循环的，使用 animation: name Xs infinite
-3. viewBox="0 0 800 600"
-4. 背景色: {bg_color}，主色调: {primary_color}，强调色: {accent_color}
-5. 动画时长约{duration}秒，速度系数{animation_speed}
-
-请确保SVG代码完整、有效，动画流畅自然。"""
-
         try:
             payload = {
                 "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"请为以下主题生成一个{duration}秒的教学动画：\n\n{prompt}"}
-                ],
+                "messages": ANIMATION_STREAM_PROMPT.build_messages(
+                    self._get_provider(model),
+                    prompt=prompt,
+                    duration=duration,
+                    bg_color=bg_color,
+                    primary_color=primary_color,
+                    accent_color=accent_color,
+                    speed=animation_speed
+                ),
                 "temperature": 0.7,
                 "max_tokens": 8000,
-                "stream": True
+                "stream": True,
+                # 要求在最后一个 chunk 中返回真实的 usage
+                "stream_options": {"include_usage": True}
             }
             
             logger.info(f"📡 流式请求: {self.base_url}/chat/completions, 模型: {model}")
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self._get_headers(),
-                json=payload,
-                timeout=240,
-                stream=True
-            )
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"❌ API 错误: {response.status_code}")
-                yield {"type": "error", "message": f"API Error: {response.status_code} - {error_text}"}
-                return
-            
             full_content = ""
             total_tokens = 0
-            estimated_max_tokens = 6000  # 预估最大token数
+            usage = None
+            for leg in range(self.max_continuations + 1):
+                leg_payload = self._continuation_payload(payload, full_content) if leg else payload
+                if leg:
+                    logger.info(f"✂️ 输出被截断，发起第 {leg} 次续写")
+                    yield {
+                        "type": "progress",
+                        "progress": min(95, int((total_tokens / self.ESTIMATED_MAX_TOKENS) * 100)),
+                        "tokens": total_tokens,
+                        "leg": leg,
+                        "message": f"输出被截断，继续生成第 {leg + 1} 段..."
+                    }
+                
+                started_at = time.time()
+                piece, finish_reason, raw_usage, first_token_at = yield from self._stream_leg(leg_payload, leg, total_tokens)
+                full_content = self._stitch(full_content, piece)
+                leg_usage = self._build_usage(model, raw_usage, leg_payload['messages'], piece, started_at, first_token_at)
+                usage = self._merge_usage(usage, leg_usage)
+                total_tokens = usage['completion_tokens']
+                
+                # 未被截断，或拼接后的 JSON 已经闭合
+                if finish_reason != 'length' or parse_model_json(full_content) is not None:
+                    break
             
-            for line in response.iter_lines():
-                if line:
-                    line_text = line.decode('utf-8')
-                    if line_text.startswith('data: '):
-                        data_str = line_text[6:]
-                        if data_str == '[DONE]':
-                            break
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                delta = data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    full_content += content
-                                    # 估算token数（粗略：1个字符约0.5-1个token）
-                                    total_tokens = len(full_content) // 2
-                                    # 计算进度百分比
-                                    progress = min(95, int((total_tokens / estimated_max_tokens) * 100))
-                                    
-                                    yield {
-                                        "type": "progress",
-                                        "progress": progress,
-                                        "tokens": total_tokens,
-                                        "message": "生成中..."
-                                    }
-                        except json.JSONDecodeError:
-                            continue
+            logger.info(f"📈 Token 用量: prompt={usage['prompt_tokens']} (cached={usage['cached_tokens']}), completion={total_tokens}, "
+                        f"ttft={usage['ttft_ms']}ms, {usage['tokens_per_second']} tokens/s, "
+                        f"continuations={usage['continuations']}, estimated={usage['estimated']}")
             
             # 解析完整内容
             yield {"type": "progress", "progress": 98, "tokens": total_tokens, "message": "解析结果..."}
             
-            try:
-                result = json.loads(full_content)
-            except json.JSONDecodeError:
-                import re
-                json_match = re.search(r'\{.*\}', full_content, re.DOTALL)
-                if json_match:
-                    try:
-                        result = json.loads(json_match.group())
-                    except:
-                        result = self._generate_default_animation(prompt, duration, params)
-                else:
-                    result = self._generate_default_animation(prompt, duration, params)
+            result = parse_model_json(full_content, truncated=finish_reason == 'length')
+            if not result or not result.get('svg_content'):
+                logger.warning(f"⚠️ 无法解析 JSON, finish_reason={finish_reason}")
+                yield {"type": "error", "message": "AI 返回内容无法解析，请重试", "usage": usage}
+                return
             
             yield {
                 "type": "complete",
                 "data": result,
-                "tokens": total_tokens
+                "tokens": total_tokens,
+                "usage": usage
             }
             
+        except AIServiceError as e:
+            yield {"type": "error", "message": str(e), "model": model}
         except requests.exceptions.Timeout:
-            yield {"type": "error", "message": "请求超时"}
+            yield {"type": "error", "message": "请求超时", "model": model}
         except requests.exceptions.ConnectionError as e:
-            yield {"type": "error", "message": f"连接失败: {str(e)}"}
+            yield {"type": "error", "message": f"连接失败: {str(e)}", "model": model}
+        except GeneratorExit:
+            logger.info("🛑 客户端已断开，已取消上游请求")
+            raise
         except Exception as e:
             logger.error(f"❌ 流式生成错误: {str(e)}")
-            yield {"type": "error", "message": f"生成失败: {str(e)}"}
+            yield {"type": "error", "message": f"生成失败: {str(e)}", "model": model}
 
 ai_service = AIService()
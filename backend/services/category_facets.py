@@ -0,0 +1,111 @@
+"""
+社区分类及其公开动画数
+社区列表每次请求都要 SELECT DISTINCT 全部公开动画的分类，再在 Python 中和预设分类合并，动画越多越慢。
+- category_counts 每个分类一行公开动画数；发布、取消公开、修改分类、删除动画时通过 ORM 事件在同一事务中增减
+- 分类列表由单独的接口提供，带 ETag（按内容计算，多个 worker 一致），未变化时返回 304
+- 启动时按动画表核对，不一致则重建
+"""
+import json
+import hashlib
+import logging
+from sqlalchemy import event, delete, func, inspect as sa_inspect
+from sqlalchemy.dialects.sqlite import insert
+from services.orm_events import value_before_flush
+from models import Animation, CategoryCount
+
+logger = logging.getLogger(__name__)
+
+# 预设分类（确保这些分类始终显示）
+DEFAULT_CATEGORIES = ['计算机科学', '电子通信', '物理', '数学', '天文', '化学', '生物', '地理', '其他']
+ALL = '全部'
+
+
+class CategoryFacets:
+    def __init__(self):
+        self._registered = False
+
+    # ============ 查询 ============
+
+    def facets(self, session) -> list:
+        """[{name, count}]：全部、预设分类（没有动画也显示），其余分类按动画数从多到少"""
+        counts = dict(session.query(CategoryCount.category, CategoryCount.public_count)
+                      .filter(CategoryCount.public_count > 0).all())
+        others = sorted((c for c in counts if c not in DEFAULT_CATEGORIES), key=lambda c: (-counts[c], c))
+        return [{'name': ALL, 'count': sum(counts.values())}] + \
+            [{'name': c, 'count': counts.get(c, 0)} for c in DEFAULT_CATEGORIES + others]
+
+    @staticmethod
+    def etag(facets: list) -> str:
+        return hashlib.sha1(json.dumps(facets, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+    # ============ 增量维护 ============
+
+    @staticmethod
+    def _adjust(connection, deltas: dict):
+        """deltas 为 {分类: 增减数}，没有记录的分类新建"""
+        rows = [{'category': c, 'public_count': d} for c, d in deltas.items() if c and d]
+        if not rows:
+            return
+        statement = insert(CategoryCount)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[CategoryCount.category],
+            set_={'public_count': CategoryCount.public_count + statement.excluded.public_count}
+        ), rows)
+
+    def _after_insert(self, mapper, connection, target):
+        if target.is_public:
+            self._adjust(connection, {target.category: 1})
+
+    def _after_update(self, mapper, connection, target):
+        state = sa_inspect(target)
+        if not (state.attrs.is_public.history.has_changes() or state.attrs.category.history.has_changes()):
+            return
+        deltas = {}
+        if value_before_flush(state, 'is_public'):
+            category = value_before_flush(state, 'category')
+            deltas[category] = deltas.get(category, 0) - 1
+        if target.is_public:
+            deltas[target.category] = deltas.get(target.category, 0) + 1
+        self._adjust(connection, deltas)
+
+    def _after_delete(self, mapper, connection, target):
+        state = sa_inspect(target)
+        if value_before_flush(state, 'is_public'):
+            self._adjust(connection, {value_before_flush(state, 'category'): -1})
+
+    def register(self):
+        """注册 ORM 事件：发布、取消公开、修改分类、删除动画在同一事务中同步到分类计数"""
+        if self._registered:
+            return
+        event.listen(Animation, 'after_insert', self._after_insert)
+        event.listen(Animation, 'after_update', self._after_update)
+        event.listen(Animation, 'after_delete', self._after_delete)
+        self._registered = True
+
+    # ============ 重建 ============
+
+    @staticmethod
+    def _actual(db) -> dict:
+        """按动画表统计各分类的公开动画数"""
+        return dict(db.session.query(Animation.category, func.count(Animation.id))
+                    .filter(Animation.is_public == True, Animation.category != None, Animation.category != '')
+                    .group_by(Animation.category).all())
+
+    def rebuild(self, db) -> int:
+        """清空并按动画表重建分类计数（不提交），返回分类数"""
+        counts = self._actual(db)
+        db.session.execute(delete(CategoryCount))
+        self._adjust(db.session.connection(), counts)
+        return len(counts)
+
+    def setup(self, db) -> int:
+        """注册同步事件；分类计数与动画表不一致时重建（不提交），返回重建的分类数"""
+        self.register()
+        stored = dict(db.session.query(CategoryCount.category, CategoryCount.public_count)
+                      .filter(CategoryCount.public_count != 0).all())
+        if stored == self._actual(db):
+            return 0
+        return self.rebuild(db)
+
+
+category_facets = CategoryFacets()
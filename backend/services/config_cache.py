@@ -0,0 +1,99 @@
+"""
+系统配置缓存
+SystemConfig 的值很少变化，但生成、注册等热路径每次都要读取。
+这里把整张配置表缓存在进程内存中，并用一个版本戳文件在多个 gunicorn worker 之间广播变更：
+- 读取时只做一次廉价的 os.stat 检查（节流），不查询数据库
+- SystemConfig.set 写入后更新版本戳，各 worker 在下一次读取时（最多 CHECK_INTERVAL 秒后）重新加载
+"""
+import os
+import time
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigCache:
+    # 版本戳检查间隔（秒）
+    CHECK_INTERVAL = 0.5
+
+    def __init__(self, version_file: str = None):
+        self.version_file = version_file or Config.CONFIG_VERSION_FILE
+        self._values = None
+        self._version = None
+        self._stale = True
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _read_version(self):
+        """读取版本戳（文件不存在视为初始版本）"""
+        try:
+            stat = os.stat(self.version_file)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _load(self) -> dict:
+        """从数据库加载全部配置"""
+        # 延迟导入避免循环依赖
+        from models import SystemConfig
+        from services.sqlite_tuning import sqlite_tuning
+        # 独立的短会话：生成过程中首次读取配置时，不让调用方的会话一直占着连接
+        with sqlite_tuning.read_only_session() as session:
+            values = {c.key: c.value for c in session.query(SystemConfig).all()}
+        logger.debug(f"系统配置缓存已加载: {len(values)} 项")
+        return values
+
+    def _ensure_fresh(self) -> dict:
+        """返回当前的配置字典。字典加载后不再修改，只整体替换，调用方持有的引用始终完整可用"""
+        values = self._values
+        now = time.monotonic()
+        if values is not None and not self._stale and now - self._checked_at < self.CHECK_INTERVAL:
+            return values
+        with self._lock:
+            version = self._read_version()
+            if self._values is None or self._stale or version != self._version:
+                self._values = self._load()
+                self._stale = False
+                self._version = version
+            self._checked_at = now
+            return self._values
+
+    def get(self, key: str, default=None):
+        """获取字符串配置值"""
+        value = self._ensure_fresh().get(key)
+        return value if value not in (None, '') else default
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        try:
+            return int(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        try:
+            return float(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+    def invalidate(self):
+        """配置已变更：标记本进程缓存过期（下一次读取时重新加载）并更新版本戳通知其他 worker"""
+        with self._lock:
+            self._stale = True
+            try:
+                tmp_path = f"{self.version_file}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(str(time.time_ns()))
+                os.replace(tmp_path, self.version_file)
+            except OSError as e:
+                logger.warning(f"更新配置版本戳失败: {e}")
+
+
+config_cache = ConfigCache()
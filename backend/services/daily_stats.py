@@ -0,0 +1,125 @@
+"""
+后台统计的每日汇总
+后台统计原来每次打开都对用户、动画、点赞、收藏表各做一次 COUNT/AVG，数据越多越慢，也没有按天的趋势。
+- daily_stats 每天一行（见 models.DailyStat），写入数据的代码在同一事务中原子累加：
+  注册/删除用户、新建/发布/取消公开/删除动画通过 ORM 事件，点赞、收藏、生成、AI 编辑、导出、Token、配额在对应的代码中调用
+- 总数为全部日期之和（新增减删除），趋势读取最近 N 天，都只和天数有关，与数据量无关
+- 首次部署时按已有数据回填（也可以 flask --app app backfill-stats 手动执行）：
+  导出没有记录、删除和取消公开无法还原，回填后这几项从 0 开始累计，发布日期按动画创建日期计
+"""
+import logging
+from datetime import datetime, date, timedelta
+from sqlalchemy import event, delete, func, inspect as sa_inspect
+from services.orm_events import value_before_flush
+from models import User, Animation, Like, Favorite, GenerationTask, UsageStat, DailyStat
+
+logger = logging.getLogger(__name__)
+
+
+class DailyStats:
+    SERIES_DAYS = (7, 30, 90)
+
+    def __init__(self):
+        self._registered = False
+
+    # ============ 增量维护 ============
+
+    def _user_inserted(self, mapper, connection, target):
+        DailyStat.record(connection, new_users=1, quota=target.quota or 0)
+
+    def _user_deleted(self, mapper, connection, target):
+        DailyStat.record(connection, deleted_users=1, quota=-(value_before_flush(sa_inspect(target), 'quota') or 0))
+
+    def _animation_inserted(self, mapper, connection, target):
+        DailyStat.record(connection, new_animations=1, publishes=1 if target.is_public else 0)
+
+    def _animation_updated(self, mapper, connection, target):
+        state = sa_inspect(target)
+        if not state.attrs.is_public.history.has_changes() or \
+                bool(value_before_flush(state, 'is_public')) == bool(target.is_public):
+            return
+        DailyStat.record(connection, **{'publishes' if target.is_public else 'unpublishes': 1})
+
+    def _animation_deleted(self, mapper, connection, target):
+        DailyStat.record(connection, deleted_animations=1,
+                         unpublishes=1 if value_before_flush(sa_inspect(target), 'is_public') else 0)
+
+    def register(self):
+        """注册 ORM 事件：用户、动画的新增、发布、取消公开、删除在同一事务中计入当天汇总"""
+        if self._registered:
+            return
+        event.listen(User, 'after_insert', self._user_inserted)
+        event.listen(User, 'after_delete', self._user_deleted)
+        event.listen(Animation, 'after_insert', self._animation_inserted)
+        event.listen(Animation, 'after_update', self._animation_updated)
+        event.listen(Animation, 'after_delete', self._animation_deleted)
+        self._registered = True
+
+    # ============ 回填 ============
+
+    def backfill(self, db) -> int:
+        """清空并按已有数据重新生成每日汇总（不提交），返回天数"""
+        days = {}
+
+        def add(metric, rows):
+            for day, value in rows:
+                if day is None or not value:
+                    continue
+                counts = days.setdefault(date.fromisoformat(day) if isinstance(day, str) else day, {})
+                counts[metric] = counts.get(metric, 0) + value
+
+        def per_day(column, *conditions, value=None):
+            # SQLite 的 date() 返回 'YYYY-MM-DD'
+            day = func.date(column)
+            return db.session.query(day, func.count() if value is None else value)\
+                .filter(*conditions).group_by(day).all()
+
+        add('new_users', per_day(User.created_at))
+        add('quota', per_day(User.created_at, value=func.sum(User.quota)))
+        add('new_animations', per_day(Animation.created_at))
+        add('publishes', per_day(Animation.created_at, Animation.is_public == True))
+        # AI 局部编辑的任务也记在任务表中，结果是修改操作列表而不是动画
+        is_edit = func.json_extract(GenerationTask.result, '$.operations').isnot(None)
+        add('generations', per_day(GenerationTask.created_at, GenerationTask.status == 'completed', ~is_edit))
+        add('edits', per_day(GenerationTask.created_at, GenerationTask.status == 'completed', is_edit))
+        add('failures', per_day(GenerationTask.created_at, GenerationTask.status == 'failed'))
+        add('likes', per_day(Like.created_at))
+        add('favorites', per_day(Favorite.created_at))
+        add('tokens', db.session.query(UsageStat.day, func.sum(UsageStat.prompt_tokens + UsageStat.completion_tokens))
+            .group_by(UsageStat.day).all())
+
+        db.session.execute(delete(DailyStat))
+        connection = db.session.connection()
+        for day, counts in days.items():
+            DailyStat.record(connection, day=day, **counts)
+        return len(days)
+
+    def setup(self, db) -> int:
+        """注册同步事件；汇总为空而已有用户时（首次部署）回填（不提交），返回回填的天数"""
+        self.register()
+        if DailyStat.query.first() is None and User.query.first() is not None:
+            return self.backfill(db)
+        return 0
+
+    # ============ 查询 ============
+
+    def totals(self, session) -> dict:
+        """各指标全部日期之和"""
+        row = session.query(*(func.coalesce(func.sum(getattr(DailyStat, m)), 0) for m in DailyStat.METRICS)).one()
+        return dict(zip(DailyStat.METRICS, row))
+
+    def series(self, session, days: int, today: date = None) -> list:
+        """最近 days 天（含今天）每天的指标，没有记录的日期补 0"""
+        today = today or datetime.utcnow().date()
+        since = today - timedelta(days=days - 1)
+        rows = {row.day: row for row in session.query(DailyStat).filter(DailyStat.day >= since).all()}
+        series = []
+        for offset in range(days):
+            day = since + timedelta(days=offset)
+            row = rows.get(day)
+            series.append({'day': day.isoformat(),
+                           **{m: (getattr(row, m) or 0) if row else 0 for m in DailyStat.METRICS}})
+        return series
+
+
+daily_stats = DailyStats()
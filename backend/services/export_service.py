@@ -259,6 +259,58 @@ class ExportService:
         
         return frames
     
+    async def _render_snapshots_async(self, svg_contents, at_ms, width, height):
+        """在同一浏览器中渲染多份SVG在指定时间点的静态帧（暂停全部动画后截图）"""
+        from playwright.async_api import async_playwright
+        
+        images = []
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(
+                headless=True,
+                args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage', '--disable-gpu']
+            )
+            try:
+                page = await browser.new_page(viewport={'width': width, 'height': height})
+                for svg_content in svg_contents:
+                    html_content = f'''
+                    <!DOCTYPE html>
+                    <html>
+                    <head>
+                        <style>
+                            * {{ margin: 0; padding: 0; }}
+                            html, body {{ width: {width}px; height: {height}px; overflow: hidden; background: #0f172a; }}
+                            svg {{ width: 100%; height: 100%; }}
+                        </style>
+                    </head>
+                    <body>{svg_content}</body>
+                    </html>
+                    '''
+                    await page.set_content(html_content)
+                    # 暂停所有 CSS 动画并定位到同一时间点，保证截图可比较
+                    await page.evaluate(
+                        "t => document.getAnimations().forEach(a => { a.pause(); a.currentTime = t; })",
+                        at_ms
+                    )
+                    screenshot = await page.screenshot(type='png')
+                    images.append(Image.open(io.BytesIO(screenshot)).convert('RGB'))
+            finally:
+                await browser.close()
+        return images
+    
+    def render_snapshots(self, svg_contents, at_ms=1000, width=800, height=600):
+        """渲染多份SVG在同一时间点的帧，Playwright 不可用时返回 None"""
+        try:
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(
+                    self._render_snapshots_async(svg_contents, at_ms, width, height)
+                )
+            finally:
+                loop.close()
+        except Exception as e:
+            logger.warning(f"渲染快照失败: {e}")
+            return None
+    
     def _create_static_frames(self, svg_content, total_frames, width, height, transparent=False):
         """创建静态帧（备用方案）"""
         import math
@@ -0,0 +1,222 @@
+"""
+模型输出的 JSON 提取与修复
+- 单次线性扫描（感知字符串和转义），找到最外层的 JSON 对象，替代回溯严重的正则
+- 去除 ```json 代码块包裹
+- 输出因 max_tokens 截断（finish_reason == "length"）时，补全未闭合的字符串、对象/数组以及 SVG 标签
+"""
+import re
+import json
+import string
+import logging
+
+logger = logging.getLogger(__name__)
+
+_FENCE_PATTERN = re.compile(r'^\s*```[a-zA-Z]*\s*\n?(.*?)(?:\n?```\s*)?$', re.DOTALL)
+_SVG_TAG_PATTERN = re.compile(r'<(/?)([a-zA-Z][\w:.-]*)[^<>]*?(/?)>')
+
+
+def strip_code_fence(text: str) -> str:
+    """去除 ```json ... ``` 包裹（允许缺少结尾的 ```）"""
+    if text.lstrip().startswith('```'):
+        match = _FENCE_PATTERN.match(text)
+        if match:
+            return match.group(1)
+    return text
+
+
+def extract_json_object(text: str):
+    """线性扫描，返回第一个能成功解析的最外层 JSON 对象（dict），没有则返回 None"""
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            # 最外层对象之外的引号不影响括号匹配
+            if depth > 0:
+                in_string = True
+        elif ch == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                try:
+                    result = json.loads(text[start:i + 1])
+                    if isinstance(result, dict):
+                        return result
+                except (ValueError, RecursionError):
+                    pass
+                start = None
+    return None
+
+
+def repair_truncated_json(text: str):
+    """补全被截断的 JSON：闭合字符串、补齐缺失的值、闭合对象和数组；无法修复返回 None"""
+    start = text.find('{')
+    if start < 0:
+        return None
+    text = text[start:]
+
+    # 每层记录 [类型, 期望的下一个 token]
+    frames = []
+    in_string = False
+    escaped = False
+    unicode_start, unicode_left = 0, 0  # 未写完的 \uXXXX 的起始位置和还差的位数
+    last_safe = 0  # 最后一个完整 token 之后的位置，用于丢弃截断的数字/字面量
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+                if ch == 'u':
+                    unicode_start, unicode_left = i - 1, 4
+            elif unicode_left:
+                unicode_left = unicode_left - 1 if ch in string.hexdigits else 0
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                frame = frames[-1]
+                frame[1] = 'colon' if frame[1] == 'key' else 'comma'
+                last_safe = i + 1
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            frames.append(['obj', 'key'] if ch == '{' else ['arr', 'value'])
+            last_safe = i + 1
+        elif ch in '}]':
+            frames.pop()
+            if not frames:
+                text = text[:i + 1]
+                break
+            frames[-1][1] = 'comma'
+            last_safe = i + 1
+        elif ch == ':':
+            frames[-1][1] = 'value'
+            last_safe = i + 1
+        elif ch == ',':
+            frames[-1][1] = 'key' if frames[-1][0] == 'obj' else 'value'
+            last_safe = i + 1
+        elif not ch.isspace():
+            # 数字 / true / false / null
+            frames[-1][1] = 'comma'
+    else:
+        if in_string:
+            # 去掉不完整的转义序列（末尾单独的反斜杠、位数不足的 \uXXXX）后闭合字符串
+            if escaped:
+                text = text[:-1]
+            elif unicode_left:
+                text = text[:unicode_start]
+            text += '"'
+            frames[-1][1] = 'colon' if frames[-1][1] == 'key' else 'comma'
+        elif frames and frames[-1][1] == 'comma' and text[last_safe:].strip():
+            # 截断在字面量中间（如 "tru"），丢弃这个不完整的值
+            text = text[:last_safe]
+            frames[-1][1] = 'value'
+
+        text = text.rstrip()
+        while frames:
+            kind, expect = frames.pop()
+            if frames:
+                # 外层的值就是刚闭合的这一层
+                frames[-1][1] = 'comma'
+            if kind == 'obj':
+                if expect == 'colon':
+                    text += ':null'
+                elif expect == 'value':
+                    text += 'null'
+                elif expect == 'key':
+                    text = text.rstrip(',')
+                text += '}'
+            else:
+                if expect == 'value':
+                    text = text.rstrip(',')
+                text += ']'
+
+    try:
+        result = json.loads(text)
+    except (ValueError, RecursionError):
+        return None
+    return result if isinstance(result, dict) else None
+
+
+def close_svg_tags(svg: str) -> str:
+    """闭合被截断的 SVG：丢弃末尾不完整的标签并按嵌套顺序补齐结束标签"""
+    if not svg or '<svg' not in svg or svg.rstrip().endswith('</svg>'):
+        return svg
+
+    # 末尾不完整的标签（如 '<rect x="1'）直接丢弃
+    last_open = svg.rfind('<')
+    if last_open > svg.rfind('>'):
+        svg = svg[:last_open]
+
+    stack = []
+    for match in _SVG_TAG_PATTERN.finditer(svg):
+        closing, name, self_closing = match.group(1), match.group(2), match.group(3)
+        if self_closing:
+            continue
+        if closing:
+            if name in stack:
+                while stack and stack.pop() != name:
+                    pass
+        else:
+            stack.append(name)
+
+    # 截断在 <style> 中时，不完整的 CSS 规则无法补全，截到最后一条完整的顶层规则
+    if stack and stack[-1] == 'style':
+        css_start = svg.find('>', svg.rfind('<style')) + 1
+        depth = 0
+        cut = css_start
+        for i in range(css_start, len(svg)):
+            if svg[i] == '{':
+                depth += 1
+            elif svg[i] == '}':
+                depth -= 1
+                if depth == 0:
+                    cut = i + 1
+        svg = svg[:cut]
+
+    return svg + ''.join(f'</{name}>' for name in reversed(stack))
+
+
+def parse_model_json(content: str, truncated: bool = False):
+    """解析模型输出中的 JSON 对象；truncated 为 True 时尝试修复截断的输出，失败返回 None"""
+    if not content:
+        return None
+    text = strip_code_fence(content).strip()
+
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict):
+            return result
+    except (ValueError, RecursionError):
+        pass
+
+    result = extract_json_object(text)
+    if result is not None:
+        logger.info("✅ 从响应中提取 JSON 成功")
+        return result
+
+    if truncated:
+        result = repair_truncated_json(text)
+        if result is not None:
+            if isinstance(result.get('svg_content'), str):
+                result['svg_content'] = close_svg_tags(result['svg_content'])
+            logger.info("🩹 已修复被截断的 JSON 输出")
+            return result
+
+    return None
@@ -0,0 +1,251 @@
+"""
+模型路由 - 按请求难度、模型价格和线上健康度为每次生成选择模型
+- 难度：提示词长度、并列的知识点数量、动画时长和（推断的）学科分类，得到 1-3 级
+- 质量：AVAILABLE_MODELS 中每个模型的 quality 等级，只在质量不低于难度的模型中选择
+- 健康度：最近生成任务（GenerationTask）中各模型的 p95 耗时和失败率，超过策略阈值的模型暂不使用
+- 成本：在健康的候选模型中按价格表（或 p95 耗时）挑选最便宜（最快）的一个
+路由策略保存在 SystemConfig 的 routing_policy（JSON）中，管理员可随时调整；默认不启用，未启用时使用管理员选择的 ai_model
+"""
+import re
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from models import GenerationTask
+from services.sqlite_tuning import sqlite_tuning
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = {
+    # 默认关闭：启用后不再使用管理员在模型设置中选择的当前模型
+    'enabled': False,
+    # 参与路由的模型，为空表示全部可用模型
+    'models': [],
+    # 候选模型的排序依据：cost（价格优先）或 latency（p95 耗时优先）
+    'prefer': 'cost',
+    # 提示词长度（字符）超过这两个阈值时难度分别 +1、+2
+    'medium_prompt_chars': 40,
+    'long_prompt_chars': 120,
+    # 动画时长（秒）达到这两个阈值时难度分别 +1、+2
+    'medium_duration': 60,
+    'long_duration': 120,
+    # 分类额外的难度分
+    'category_weights': {'化学': 1, '生物': 1},
+    # 难度分 <= simple_max_score 为 1 级，<= medium_max_score 为 2 级，其余为 3 级
+    'simple_max_score': 0,
+    'medium_max_score': 2,
+    # 健康度阈值：样本数达到 min_samples 后才生效
+    'max_error_rate': 0.3,
+    'max_p95_ms': 180000,
+    'min_samples': 5,
+    # 统计最近多少分钟的生成任务
+    'window_minutes': 60,
+}
+
+# 按关键词推断分类（请求参数中带 category 时优先使用）；只用多字词，单字（如 力、光、电）几乎出现在任何中文提示词中
+CATEGORY_KEYWORDS = {
+    '化学': ['化学', '分子', '原子', '离子', '电子', '反应', '溶液', '化合', '氧化', '还原', '酸碱', '元素'],
+    '生物': ['生物', '细胞', '基因', 'DNA', '蛋白', '光合', '呼吸作用', '神经', '遗传', '生态', '器官'],
+    '物理': ['物理', '力学', '运动', '速度', '加速', '单摆', '波动', '光学', '电路', '电流', '磁场', '能量', '透镜', '引力'],
+    '数学': ['数学', '函数', '几何', '方程', '三角', '坐标', '概率', '导数', '积分', '向量'],
+    '地理': ['地理', '地球', '板块', '气候', '季节', '洋流', '大气', '河流', '地形'],
+}
+
+# 并列的知识点之间常见的分隔：只按标点和“以及”拆分，单字的和/与/及常出现在词语中（和平、与其、及时）
+_TOPIC_SEPARATORS = re.compile(r'[、，,；;]|以及')
+
+# 估算单次生成费用时使用的 token 数（只用于模型之间比较）
+_ESTIMATE_PROMPT_TOKENS = 2000
+_ESTIMATE_COMPLETION_TOKENS = 4000
+
+
+class ModelRouter:
+    # 健康度统计缓存时间（秒）
+    STATS_TTL = 60
+    # 每个模型最多取最近多少个任务计算 p95
+    STATS_SAMPLES = 200
+
+    def __init__(self):
+        self._stats = None
+        self._stats_at = 0.0
+        self._lock = threading.Lock()
+
+    # ============ 策略 ============
+
+    def get_policy(self) -> dict:
+        """当前路由策略（缺省项使用默认值）"""
+        from services.config_cache import config_cache
+        policy = dict(DEFAULT_POLICY)
+        raw = config_cache.get('routing_policy')
+        if raw:
+            try:
+                policy.update(json.loads(raw))
+            except (TypeError, ValueError):
+                logger.warning("⚠️ 路由策略不是有效的 JSON，使用默认策略")
+        return policy
+
+    @staticmethod
+    def validate_policy(data: dict) -> dict:
+        """校验管理员提交的策略，返回合并默认值后的完整策略；无效时抛出 ValueError"""
+        # 延迟导入避免循环依赖
+        from services.ai_service import AVAILABLE_MODELS
+        if not isinstance(data, dict):
+            raise ValueError('路由策略必须是对象')
+        unknown = set(data) - set(DEFAULT_POLICY)
+        if unknown:
+            raise ValueError(f"未知的策略项: {', '.join(sorted(unknown))}")
+
+        policy = dict(DEFAULT_POLICY, **data)
+        if not isinstance(policy['enabled'], bool):
+            raise ValueError('enabled 必须是布尔值')
+        available = {m['id'] for m in AVAILABLE_MODELS}
+        if not isinstance(policy['models'], list) or not set(policy['models']) <= available:
+            raise ValueError('models 包含无效的模型ID')
+        if policy['prefer'] not in ('cost', 'latency'):
+            raise ValueError('prefer 必须是 cost 或 latency')
+        if not isinstance(policy['category_weights'], dict) or \
+                not all(isinstance(v, int) for v in policy['category_weights'].values()):
+            raise ValueError('category_weights 必须是 {分类: 整数}')
+        for key in ('medium_prompt_chars', 'long_prompt_chars', 'medium_duration', 'long_duration',
+                    'simple_max_score', 'medium_max_score', 'max_p95_ms', 'min_samples', 'window_minutes'):
+            if not isinstance(policy[key], int) or isinstance(policy[key], bool) or policy[key] < 0:
+                raise ValueError(f'{key} 必须是非负整数')
+        if not isinstance(policy['max_error_rate'], (int, float)) or not 0 <= policy['max_error_rate'] <= 1:
+            raise ValueError('max_error_rate 必须在 0-1 之间')
+        if policy['window_minutes'] < 1:
+            raise ValueError('window_minutes 至少为 1')
+        return policy
+
+    # ============ 难度 ============
+
+    @staticmethod
+    def infer_category(prompt: str) -> str:
+        hits = {category: sum(1 for word in words if word in prompt) for category, words in CATEGORY_KEYWORDS.items()}
+        category, count = max(hits.items(), key=lambda item: item[1])
+        return category if count else '其他'
+
+    def difficulty(self, prompt: str, duration, params: dict, policy: dict) -> tuple:
+        """返回 (难度等级 1-3, 分类, 难度分)"""
+        text = (prompt or '').strip()
+        category = (params or {}).get('category') or self.infer_category(text)
+        score = 0
+        if len(text) > policy['long_prompt_chars']:
+            score += 2
+        elif len(text) > policy['medium_prompt_chars']:
+            score += 1
+        # 三个以上并列的知识点
+        if len([t for t in _TOPIC_SEPARATORS.split(text) if t.strip()]) >= 4:
+            score += 1
+        try:
+            duration = int(duration or 0)
+        except (TypeError, ValueError):
+            duration = 0
+        if duration >= policy['long_duration']:
+            score += 2
+        elif duration >= policy['medium_duration']:
+            score += 1
+        score += policy['category_weights'].get(category, 0)
+
+        if score <= policy['simple_max_score']:
+            level = 1
+        elif score <= policy['medium_max_score']:
+            level = 2
+        else:
+            level = 3
+        return level, category, score
+
+    # ============ 健康度 ============
+
+    def get_stats(self, window_minutes: int = None) -> dict:
+        """最近生成任务中各模型的 {samples, error_rate, p95_ms}，缓存 STATS_TTL 秒"""
+        window_minutes = window_minutes or DEFAULT_POLICY['window_minutes']
+        now = time.monotonic()
+        with self._lock:
+            if self._stats is not None and self._stats[0] == window_minutes and now - self._stats_at < self.STATS_TTL:
+                return self._stats[1]
+
+        since = datetime.utcnow() - timedelta(minutes=window_minutes)
+        # 在生成流开始时调用：用独立的短会话，不让生成线程的会话在整个流式输出期间占着连接
+        with sqlite_tuning.read_only_session() as session:
+            rows = session.query(
+                GenerationTask.model, GenerationTask.status, GenerationTask.duration_ms
+            ).filter(
+                GenerationTask.created_at >= since,
+                GenerationTask.model.isnot(None),
+                GenerationTask.status.in_(['completed', 'failed'])
+            ).order_by(GenerationTask.id.desc()).limit(self.STATS_SAMPLES * 10).all()
+
+        grouped = {}
+        for model, status, duration_ms in rows:
+            outcomes = grouped.setdefault(model, [])
+            if len(outcomes) < self.STATS_SAMPLES:
+                outcomes.append((status, duration_ms))
+
+        stats = {}
+        for model, outcomes in grouped.items():
+            durations = sorted(d for s, d in outcomes if s == 'completed' and d)
+            failed = sum(1 for s, _ in outcomes if s == 'failed')
+            stats[model] = {
+                'samples': len(outcomes),
+                'error_rate': round(failed / len(outcomes), 3),
+                'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))] if durations else None
+            }
+
+        with self._lock:
+            self._stats = (window_minutes, stats)
+            self._stats_at = now
+        return stats
+
+    @staticmethod
+    def _healthy(stat: dict, policy: dict) -> bool:
+        if not stat or stat['samples'] < policy['min_samples']:
+            return True
+        if stat['error_rate'] > policy['max_error_rate']:
+            return False
+        return not policy['max_p95_ms'] or stat['p95_ms'] is None or stat['p95_ms'] <= policy['max_p95_ms']
+
+    # ============ 选择 ============
+
+    def select(self, prompt: str, duration, params: dict = None, default_model: str = None) -> dict:
+        """为一次生成选择模型，返回 {model, level, category, score, reason}"""
+        # 延迟导入避免循环依赖
+        from services.ai_service import AVAILABLE_MODELS, calculate_cost
+        policy = self.get_policy()
+        if not policy['enabled']:
+            return {'model': default_model, 'level': None, 'category': None, 'score': None, 'reason': '路由未启用'}
+
+        level, category, score = self.difficulty(prompt, duration, params, policy)
+        allowed = [m for m in AVAILABLE_MODELS if not policy['models'] or m['id'] in policy['models']]
+        candidates = [m for m in allowed if m.get('quality', 1) >= level]
+        if not candidates:
+            # 没有满足难度的模型时退到质量最高的一档
+            top = max((m.get('quality', 1) for m in allowed), default=None)
+            candidates = [m for m in allowed if m.get('quality', 1) == top]
+        if not candidates:
+            return {'model': default_model, 'level': level, 'category': category, 'score': score,
+                    'reason': '没有可用的候选模型'}
+
+        stats = self.get_stats(policy['window_minutes'])
+        healthy = [m for m in candidates if self._healthy(stats.get(m['id']), policy)]
+        reason = f"难度 {level}（{category}，分数 {score}）"
+        if not healthy:
+            # 全部不健康：选失败率最低的
+            chosen = min(candidates, key=lambda m: (stats.get(m['id']) or {}).get('error_rate', 0))
+            reason += '，候选模型均超出健康阈值，选择失败率最低的'
+        else:
+            def cost(m):
+                return calculate_cost(m['id'], _ESTIMATE_PROMPT_TOKENS, _ESTIMATE_COMPLETION_TOKENS)
+
+            def latency(m):
+                return (stats.get(m['id']) or {}).get('p95_ms') or 0
+
+            order = (lambda m: (latency(m), cost(m))) if policy['prefer'] == 'latency' else (lambda m: (cost(m), latency(m)))
+            chosen = min(healthy, key=order)
+            reason += f"，{len(healthy)}/{len(candidates)} 个候选模型健康，按{'耗时' if policy['prefer'] == 'latency' else '价格'}选择"
+
+        logger.info(f"🧭 模型路由: {chosen['id']} - {reason}")
+        return {'model': chosen['id'], 'level': level, 'category': category, 'score': score, 'reason': reason}
+
+
+model_router = ModelRouter()
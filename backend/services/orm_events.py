@@ -0,0 +1,9 @@
+"""
+ORM 事件中共用的小工具（分类计数、每日汇总等在 after_update/after_delete 中比较修改前后的值）
+"""
+
+
+def value_before_flush(state, attr):
+    """属性在本次 flush 之前的值；state 为 sqlalchemy.inspect(对象)"""
+    history = state.attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(state.object, attr)
@@ -0,0 +1,97 @@
+"""
+游标分页（keyset）
+列表接口原来用 paginate()：OFFSET 越往后翻越慢，每次还要额外执行一次 COUNT(*) 填充 total/pages。
+- 按排序键（如 (created_at, id)，排行类列表再加上分数）记住上一页最后一行，下一页从它之后取，
+  配合与排序一致的索引，第 500 页和第 1 页的代价相同
+- 游标对客户端不透明（base64 编码的 JSON），带有排序方式，换了排序的游标会被拒绝
+- 总数可选（include_total=1），由按查询条件缓存的计数提供，允许短时间内不精确
+"""
+import json
+import time
+import base64
+import binascii
+import threading
+from datetime import datetime
+from sqlalchemy import DateTime, and_, or_, tuple_
+
+DEFAULT_LIMIT = 12
+MAX_LIMIT = 100
+
+
+class CursorError(ValueError):
+    """游标无法解析或与当前排序不匹配"""
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    payload = json.dumps({'s': sort, 'v': [v.isoformat() if isinstance(v, datetime) else v for v in values]},
+                         separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, keys: list) -> list:
+    """解析游标，返回与 keys 对应的排序键值"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = payload['v']
+        if payload['s'] != sort or len(values) != len(keys):
+            raise CursorError('分页游标与当前排序不匹配')
+        return [datetime.fromisoformat(v) if isinstance(expr.type, DateTime) else v
+                for (expr, _), v in zip(keys, values)]
+    except CursorError:
+        raise
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise CursorError('无效的分页游标')
+
+
+def _after(keys: list, values: list):
+    """排在 values 之后的条件：方向一致时用行值比较（可以走复合索引），否则逐列展开"""
+    if all(desc == keys[0][1] for _, desc in keys):
+        row = tuple_(*(expr for expr, _ in keys))
+        return row < tuple_(*values) if keys[0][1] else row > tuple_(*values)
+    clauses = []
+    for i, (expr, desc) in enumerate(keys):
+        equal = [k == v for (k, _), v in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, expr < values[i] if desc else expr > values[i]))
+    return or_(*clauses)
+
+
+def paginate_keyset(query, keys: list, sort: str, cursor: str = None, limit: int = DEFAULT_LIMIT):
+    """
+    按 keys（[(列或表达式, 是否倒序)]，最后一个须唯一）取一页
+    返回 (本页的行, 下一页游标)；没有下一页时游标为 None
+    """
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    if cursor:
+        query = query.filter(_after(keys, decode_cursor(cursor, sort, keys)))
+    # 排序键作为额外的列一起查出，用于生成下一页游标（排序键不一定是实体的属性，如搜索相关度）
+    rows = query.add_columns(*(expr for expr, _ in keys))\
+        .order_by(None).order_by(*(expr.desc() if desc else expr.asc() for expr, desc in keys))\
+        .limit(limit + 1).all()
+    next_cursor = encode_cursor(sort, list(rows[limit - 1][1:])) if len(rows) > limit else None
+    return [row[0] for row in rows[:limit]], next_cursor
+
+
+class CountCache:
+    """列表总数缓存：按查询条件缓存 COUNT 结果 TTL 秒，翻页和重复请求不再重复计数"""
+    TTL = 60
+    MAX_ENTRIES = 10000
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, query) -> int:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+        count = query.order_by(None).count()
+        with self._lock:
+            if len(self._counts) >= self.MAX_ENTRIES:
+                self._counts = {k: v for k, v in self._counts.items() if v[0] > now}
+            self._counts[key] = (now + self.TTL, count)
+        return count
+
+
+count_cache = CountCache()
@@ -0,0 +1,248 @@
+"""
+社区排行（精选、热门、最多赞）
+精选原来在每次打开首页时按点赞+收藏数对全部公开动画排序取前 3 名，数据越多越慢，而且只看累计数，老动画一直占据精选。
+- animation_rankings 每个公开动画一行：累计点赞+收藏数（total_score）和按时间衰减的热度（hot_score），
+  各种排行都是顺着索引取前几行
+- 点赞、收藏切换时在同一事务中增减；发布、取消公开、修改分类、删除动画通过 ORM 事件同步
+- 每次点赞/收藏在热度中的权重每个半衰期减半。各动画的权重同时按相同比例衰减，排序只取决于
+  Σ 2^((点赞/收藏时间 - EPOCH)/半衰期)，热度存它的 log2（0 表示没有）：存下的值不随时间变化，
+  不需要定期改写，热门列表的游标在翻页期间始终有效
+- 后台任务定期按动画表修复累计数、分类，补齐或删除记录
+- 热度的计算方式（起点、半衰期）记在 system_config 中，变化时（包括修改 RANKING_HALF_LIFE_HOURS）启动时重建
+"""
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, select, delete, update, func, inspect as sa_inspect
+from models import Animation, AnimationRanking, Like, Favorite, SystemConfig
+
+logger = logging.getLogger(__name__)
+
+
+class Ranking:
+    SORTS = ('trending', 'top')
+    REBUILD_BATCH = 1000
+    # 热度的时间起点，早于它的点赞/收藏按起点计
+    EPOCH = datetime(2020, 1, 1)
+    # system_config 中记录热度计算方式的键
+    SCORE_VERSION_KEY = 'ranking_score_version'
+
+    def __init__(self):
+        self.half_life = timedelta(hours=24)
+        self._registered = False
+        self._refresher = None
+
+    @property
+    def score_version(self) -> str:
+        return f"log2:{self.EPOCH.date().isoformat()}:{self.half_life.total_seconds() / 3600:g}h"
+
+    def _exponent(self, at: datetime) -> float:
+        """at 时刻的一次点赞/收藏的权重 2^x 中的 x"""
+        return max(0.0, (at - self.EPOCH).total_seconds() / self.half_life.total_seconds())
+
+    @staticmethod
+    def _add(score: float, x: float) -> float:
+        """log2(2^score + 2^x)，score 为 0 表示没有点赞/收藏"""
+        if score <= 0:
+            return x
+        high, low = max(score, x), min(score, x)
+        return high + math.log2(1 + 2 ** (low - high))
+
+    @staticmethod
+    def _subtract(score: float, x: float) -> float:
+        """log2(2^score - 2^x)，减去的是最后一次（或超出）时为 0"""
+        remaining = 1 - 2 ** (x - score) if score > 0 else 0
+        if remaining <= 1e-9:
+            return 0.0
+        return score + math.log2(remaining)
+
+    # ============ 查询 ============
+
+    def apply(self, query, sort: str, category: str = None):
+        """把动画查询限定为有排行的公开动画（可按分类），返回 (查询, 游标分页的排序键)"""
+        query = query.join(AnimationRanking, AnimationRanking.animation_id == Animation.id)
+        if category:
+            query = query.filter(AnimationRanking.category == category)
+        if sort == 'trending':
+            keys = [(AnimationRanking.hot_score, True), (AnimationRanking.total_score, True),
+                    (AnimationRanking.animation_id, True)]
+        else:
+            keys = [(AnimationRanking.total_score, True), (AnimationRanking.animation_id, True)]
+        return query, keys
+
+    # ============ 增量维护 ============
+
+    def record(self, animation_id, delta: int, at: datetime = None):
+        """点赞/收藏切换（不提交）：delta 为新增(+)或取消(-)的次数，at 为点赞/收藏的时间（新增时为现在）。
+        热度是对数值，不能在 SQL 中直接加减：读出后计算，条件更新（热度未被其他请求改动）失败时重试"""
+        if not delta:
+            return
+        x = self._exponent(at or datetime.utcnow())
+        while True:
+            hot = AnimationRanking.query.with_entities(AnimationRanking.hot_score)\
+                .filter_by(animation_id=animation_id).scalar()
+            if hot is None:
+                return
+            updated = hot
+            for _ in range(abs(delta)):
+                updated = self._add(updated, x) if delta > 0 else self._subtract(updated, x)
+            if AnimationRanking.query.filter_by(animation_id=animation_id, hot_score=hot).update({
+                AnimationRanking.total_score: AnimationRanking.total_score + delta,
+                AnimationRanking.hot_score: updated
+            }, synchronize_session=False):
+                return
+
+    def _hot_scores(self, connection, animation_ids=None) -> dict:
+        """按点赞、收藏时间计算热度，返回 {animation_id: hot_score}"""
+        exponents = {}
+        for model in (Like, Favorite):
+            query = select(model.animation_id, model.created_at)
+            if animation_ids is not None:
+                query = query.where(model.animation_id.in_(list(animation_ids)))
+            for animation_id, at in connection.execute(query):
+                exponents.setdefault(animation_id, []).append(self._exponent(at))
+        scores = {}
+        for animation_id, xs in exponents.items():
+            high = max(xs)
+            scores[animation_id] = high + math.log2(sum(2 ** (x - high) for x in xs))
+        return scores
+
+    def _rows(self, connection, animations: list, now: datetime) -> list:
+        """animations 为 (id, category, likes_count, favorites_count)，返回排行记录"""
+        hot = self._hot_scores(connection, [a[0] for a in animations])
+        return [{
+            'animation_id': animation_id,
+            'category': category,
+            'total_score': (likes or 0) + (favorites or 0),
+            'hot_score': hot.get(animation_id, 0.0),
+            'decayed_at': now
+        } for animation_id, category, likes, favorites in animations]
+
+    def _after_insert(self, mapper, connection, target):
+        if target.is_public:
+            self._publish(connection, target)
+
+    def _after_update(self, mapper, connection, target):
+        state = sa_inspect(target)
+        if state.attrs.is_public.history.has_changes():
+            if target.is_public:
+                self._publish(connection, target)
+            else:
+                self._after_delete(mapper, connection, target)
+        elif target.is_public and state.attrs.category.history.has_changes():
+            connection.execute(update(AnimationRanking).where(AnimationRanking.animation_id == target.id)
+                               .values(category=target.category))
+
+    def _after_delete(self, mapper, connection, target):
+        connection.execute(delete(AnimationRanking).where(AnimationRanking.animation_id == target.id))
+
+    def _publish(self, connection, target):
+        """公开动画：加入排行，重新公开时热度按已有的点赞、收藏计算"""
+        rows = self._rows(connection, [(target.id, target.category, target.likes_count, target.favorites_count)],
+                          datetime.utcnow())
+        connection.execute(insert(AnimationRanking).prefix_with('OR REPLACE'), rows)
+
+    def register(self):
+        """注册 ORM 事件：发布、取消公开、修改分类、删除动画在同一事务中同步到排行"""
+        if self._registered:
+            return
+        event.listen(Animation, 'after_insert', self._after_insert)
+        event.listen(Animation, 'after_update', self._after_update)
+        event.listen(Animation, 'after_delete', self._after_delete)
+        self._registered = True
+
+    # ============ 重建与刷新 ============
+
+    def rebuild(self, db) -> int:
+        """清空并按动画表和点赞、收藏重建排行（不提交），返回记录数"""
+        now = datetime.utcnow()
+        connection = db.session.connection()
+        db.session.execute(delete(AnimationRanking))
+        last_id, ranked = 0, 0
+        while True:
+            # 按主键分批遍历，公开与否在取出后判断（按 is_public 过滤会走索引后再按 id 排序）
+            batch = db.session.query(Animation.id, Animation.category, Animation.likes_count,
+                                     Animation.favorites_count, Animation.is_public)\
+                .filter(Animation.id > last_id).order_by(Animation.id).limit(self.REBUILD_BATCH).all()
+            if not batch:
+                break
+            animations = [row[:4] for row in batch if row.is_public]
+            if animations:
+                db.session.execute(insert(AnimationRanking), self._rows(connection, animations, now))
+            last_id = batch[-1][0]
+            ranked += len(animations)
+        return ranked
+
+    def rescore(self, db, animation_ids) -> int:
+        """按动画表和点赞、收藏重新计算这些动画的排行（不提交），用于批量删除点赞、收藏之后，返回记录数"""
+        animation_ids = list(animation_ids)
+        if not animation_ids:
+            return 0
+        animations = db.session.query(Animation.id, Animation.category, Animation.likes_count,
+                                      Animation.favorites_count)\
+            .filter(Animation.id.in_(animation_ids), Animation.is_public == True).all()
+        if animations:
+            db.session.execute(insert(AnimationRanking).prefix_with('OR REPLACE'),
+                               self._rows(db.session.connection(), animations, datetime.utcnow()))
+        return len(animations)
+
+    def refresh(self, db) -> dict:
+        """按动画表修复累计数、分类，补齐或删除记录（不提交）；热度不随时间变化，不需要刷新"""
+        now = datetime.utcnow()
+
+        public_ids = select(Animation.id).where(Animation.is_public == True)
+        removed = AnimationRanking.query.filter(~AnimationRanking.animation_id.in_(public_ids))\
+            .delete(synchronize_session=False)
+        missing = db.session.query(Animation.id, Animation.category, Animation.likes_count, Animation.favorites_count)\
+            .filter(Animation.is_public == True, ~Animation.id.in_(select(AnimationRanking.animation_id))).all()
+        if missing:
+            db.session.execute(insert(AnimationRanking), self._rows(db.session.connection(), missing, now))
+
+        total = select(func.coalesce(Animation.likes_count, 0) + func.coalesce(Animation.favorites_count, 0))\
+            .where(Animation.id == AnimationRanking.animation_id).scalar_subquery()
+        category = select(Animation.category).where(Animation.id == AnimationRanking.animation_id).scalar_subquery()
+        repaired = AnimationRanking.query.filter(
+            (AnimationRanking.total_score != total) | AnimationRanking.category.isnot(category)
+        ).update({AnimationRanking.total_score: total, AnimationRanking.category: category},
+                 synchronize_session=False)
+        return {'added': len(missing), 'removed': removed, 'repaired': repaired}
+
+    def _refresh_loop(self, app, db, interval: int):
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    result = self.refresh(db)
+                    db.session.commit()
+                    if result['added'] or result['removed'] or result['repaired']:
+                        logger.info(f"🏆 排行已修复: 补齐 {result['added']}，删除 {result['removed']}，"
+                                    f"修正 {result['repaired']}")
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"⚠️ 刷新排行失败: {str(e)}")
+
+    def init_app(self, app, db) -> int:
+        """注册同步事件、启动后台修复；排行为空而有公开动画（首次部署）或热度计算方式变化时重建（不提交），
+        返回重建的条数"""
+        self.half_life = timedelta(hours=app.config['RANKING_HALF_LIFE_HOURS'])
+        self.register()
+
+        interval = app.config['RANKING_REFRESH_INTERVAL']
+        if interval > 0 and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, args=(app, db, interval), daemon=True)
+            self._refresher.start()
+
+        version = SystemConfig.query.filter_by(key=self.SCORE_VERSION_KEY).first()
+        if version is None:
+            version = SystemConfig(key=self.SCORE_VERSION_KEY, value='', description='社区排行热度的计算方式')
+            db.session.add(version)
+        outdated = version.value != self.score_version and AnimationRanking.query.first() is not None
+        version.value = self.score_version
+        if outdated or (AnimationRanking.query.first() is None and Animation.query.filter_by(is_public=True).first()):
+            return self.rebuild(db)
+        return 0
+
+
+ranking = Ranking()
@@ -0,0 +1,213 @@
+"""
+长动画场景合成服务 - 把并发生成的多个场景SVG拼接为一条时间轴
+- 每个场景嵌套在独立的 <svg> 中，按分镜时长依次显示（visibility 关键帧，step-end）
+- 同一文档中的 <style> 全局生效，因此给每个场景的 CSS 选择器、@keyframes 名称和 id 加上场景前缀，避免互相覆盖
+- 所有场景共用文档时间轴，场景内的 CSS 动画延迟和 SMIL begin 加上场景的开始时间，场景出现时从头播放
+"""
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_ROOT_PATTERN = re.compile(r'<svg\b([^>]*)>(.*)</svg>', re.DOTALL)
+_STYLE_PATTERN = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.DOTALL)
+_KEYFRAMES_PATTERN = re.compile(r'@(?:-webkit-)?keyframes\s+([\w-]+)')
+_ANIMATION_PATTERN = re.compile(r'(animation(?:-name)?\s*:\s*)([^;}"\']+)')
+_ID_PATTERN = re.compile(r'\bid\s*=\s*(["\'])([^"\']+)\1')
+_VIEWBOX_PATTERN = re.compile(r'\bviewBox\s*=\s*(["\'])([^"\']+)\1')
+_DELAY_PATTERN = re.compile(r'(\banimation(-delay)?\s*:\s*)([^;}"\']+)')
+_TIME_PATTERN = re.compile(r'^([+-]?(?:\d+\.?\d*|\.\d+))(ms|s)$')
+_SMIL_PATTERN = re.compile(r'<(animate|animateTransform|animateMotion|animateColor|set)\b([^>]*?)(/?)>')
+_BEGIN_PATTERN = re.compile(r'(\bbegin\s*=\s*)(["\'])([^"\']*)\2')
+_CLOCK_PATTERN = re.compile(r'^([+-]?(?:\d+\.?\d*|\.\d+))(ms|s|min|h)?$')
+
+
+class SceneComposer:
+    def __init__(self, width: int = 800, height: int = 600):
+        self.width = width
+        self.height = height
+
+    # ============ CSS 作用域 ============
+
+    def _rename_animations(self, text: str, names: dict) -> str:
+        """替换 animation / animation-name 声明中引用的关键帧名称"""
+        if not names:
+            return text
+
+        def replace(match):
+            value = re.sub(r'[\w-]+', lambda m: names.get(m.group(), m.group()), match.group(2))
+            return match.group(1) + value
+        return _ANIMATION_PATTERN.sub(replace, text)
+
+    def _scope_selectors(self, prelude: str, scope: str, ids: dict) -> str:
+        selectors = []
+        for selector in prelude.split(','):
+            selector = re.sub(r'#([\w-]+)', lambda m: '#' + ids.get(m.group(1), m.group(1)), selector.strip())
+            # 指向场景根元素的选择器改为指向场景容器
+            selector = re.sub(r'^(?::root|svg)(?=$|[\s.:#\[>~+])', '', selector).strip()
+            selectors.append(f"{scope} {selector}".strip())
+        return ','.join(selectors)
+
+    @staticmethod
+    def _seconds(value: str):
+        """CSS 时间值（s/ms）转为秒，无法解析时返回 None"""
+        match = _TIME_PATTERN.match(value)
+        if not match:
+            return None
+        return float(match.group(1)) / (1000 if match.group(2) == 'ms' else 1)
+
+    def _delay_animations(self, text: str, offset: float) -> str:
+        """animation 简写和 animation-delay 的延迟加上 offset 秒（简写中第二个时间值为延迟，没有时补上）"""
+        if not offset:
+            return text
+
+        def shift(item, shorthand):
+            tokens = item.split()
+            times = [i for i, token in enumerate(tokens) if self._seconds(token) is not None]
+            if not shorthand:
+                times = times[:1] if len(tokens) == 1 else []
+                if not times:
+                    return item
+                index = times[0]
+            elif len(times) >= 2:
+                index = times[1]
+            else:
+                # 没有延迟：时长缺省为 0s，延迟必须跟在时长之后
+                return item + (f' {offset:g}s' if times else f' 0s {offset:g}s')
+            tokens[index] = f'{self._seconds(tokens[index]) + offset:g}s'
+            return ' '.join(tokens)
+
+        def replace(match):
+            # 按括号外的逗号拆分多个动画，cubic-bezier()、steps() 中的逗号不拆
+            items = re.split(r',(?![^(]*\))', match.group(3))
+            return match.group(1) + ','.join(shift(item.strip(), not match.group(2)) for item in items)
+        return _DELAY_PATTERN.sub(replace, text)
+
+    def _delay_smil(self, inner: str, offset: float) -> str:
+        """SMIL 动画的时间偏移量 begin 加上 offset 秒，未写 begin 的补上；事件、同步基准等保持原样"""
+        if not offset:
+            return inner
+        units = {'ms': 0.001, 's': 1, 'min': 60, 'h': 3600, None: 1}
+
+        def shift(value):
+            match = _CLOCK_PATTERN.match(value.strip())
+            if not match:
+                return value
+            return f'{float(match.group(1)) * units[match.group(2)] + offset:g}s'
+
+        def replace(match):
+            attrs = match.group(2)
+            if _BEGIN_PATTERN.search(attrs):
+                attrs = _BEGIN_PATTERN.sub(
+                    lambda m: m.group(1) + m.group(2) + ';'.join(shift(v) for v in m.group(3).split(';')) + m.group(2),
+                    attrs)
+            else:
+                attrs += f' begin="{offset:g}s"'
+            return f'<{match.group(1)}{attrs}{match.group(3)}>'
+        return _SMIL_PATTERN.sub(replace, inner)
+
+    def _scope_css(self, css: str, scope: str, names: dict, ids: dict, offset: float = 0) -> str:
+        """给顶层规则的选择器加上场景前缀，@keyframes 改名，其余 @ 规则保持原样；动画延迟加上 offset 秒"""
+        output = []
+        depth = 0
+        start = 0
+        prelude_end = None
+        for i, ch in enumerate(css):
+            if ch == '{':
+                if depth == 0:
+                    prelude_end = i
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    prelude, body = css[start:prelude_end].strip(), css[prelude_end + 1:i]
+                    keyframes = _KEYFRAMES_PATTERN.match(prelude)
+                    if keyframes:
+                        prelude = prelude[:keyframes.start(1)] + names[keyframes.group(1)] + prelude[keyframes.end(1):]
+                    else:
+                        body = self._delay_animations(body, offset)
+                        if not prelude.startswith('@'):
+                            prelude = self._scope_selectors(prelude, scope, ids)
+                    output.append(f"{prelude}{{{self._rename_animations(body, names)}}}")
+                    start = i + 1
+            elif ch == ';' and depth == 0:
+                output.append(css[start:i + 1].strip())
+                start = i + 1
+        if depth != 0:
+            raise ValueError('CSS 花括号不匹配')
+        return '\n'.join(output)
+
+    # ============ 场景 ============
+
+    def _scope_scene(self, svg: str, prefix: str, start: float = 0) -> tuple:
+        """返回 (viewBox, 加上作用域后的场景内部内容)；场景内的动画推迟 start 秒开始"""
+        svg = re.sub(r'<\?xml.*?\?>|<!DOCTYPE[^>]*>', '', svg, flags=re.DOTALL)
+        match = _ROOT_PATTERN.search(svg)
+        if not match:
+            raise ValueError('场景不是有效的 SVG')
+        root_attrs, inner = match.group(1), match.group(2)
+        viewbox = _VIEWBOX_PATTERN.search(root_attrs)
+        viewbox = viewbox.group(2) if viewbox else f"0 0 {self.width} {self.height}"
+
+        scope = f".{prefix}"
+        styles = ''.join(m.group(2) for m in _STYLE_PATTERN.finditer(inner))
+        names = {name: f"{prefix}-{name}" for name in _KEYFRAMES_PATTERN.findall(styles)}
+        ids = {name: f"{prefix}-{name}" for _, name in _ID_PATTERN.findall(inner)}
+
+        def scope_style(m):
+            css = m.group(2)
+            cdata = re.fullmatch(r'\s*<!\[CDATA\[(.*)\]\]>\s*', css, flags=re.DOTALL)
+            if cdata:
+                return f"{m.group(1)}<![CDATA[{self._scope_css(cdata.group(1), scope, names, ids, start)}]]>{m.group(3)}"
+            return f"{m.group(1)}{self._scope_css(css, scope, names, ids, start)}{m.group(3)}"
+
+        inner = _STYLE_PATTERN.sub(scope_style, inner)
+        # 内联 style 中引用的关键帧
+        inner = re.sub(r'(\bstyle\s*=\s*")([^"]*)(")',
+                       lambda m: m.group(1) + self._delay_animations(self._rename_animations(m.group(2), names), start)
+                       + m.group(3), inner)
+        inner = self._delay_smil(inner, start)
+        if ids:
+            inner = _ID_PATTERN.sub(lambda m: f'id={m.group(1)}{ids[m.group(2)]}{m.group(1)}', inner)
+            inner = re.sub(r'url\(\s*#([\w-]+)\s*\)', lambda m: f"url(#{ids.get(m.group(1), m.group(1))})", inner)
+            inner = re.sub(r'((?:xlink:)?href\s*=\s*["\'])#([\w-]+)',
+                           lambda m: m.group(1) + '#' + ids.get(m.group(2), m.group(2)), inner)
+        return viewbox, inner
+
+    def _timeline_css(self, prefix: str, start: float, end: float, total: float) -> str:
+        """场景只在 [start, end) 秒内可见，随整条时间轴循环"""
+        begin = round(start / total * 100, 3)
+        finish = round(end / total * 100, 3)
+        frames = ['0%{visibility:visible}'] if begin == 0 else ['0%{visibility:hidden}', f'{begin}%{{visibility:visible}}']
+        if finish < 100:
+            frames.append(f'{finish}%{{visibility:hidden}}')
+        return (f".{prefix}{{visibility:hidden;animation:{prefix}-timeline {total:g}s step-end infinite}}"
+                f"@keyframes {prefix}-timeline{{{''.join(frames)}}}")
+
+    def compose(self, scenes: list, bg_color: str = '#0f172a') -> str:
+        """scenes: [{'scene_number', 'duration', 'svg_content'}]，按顺序合成一个SVG"""
+        total = sum(scene['duration'] for scene in scenes)
+        timeline = []
+        groups = []
+        elapsed = 0
+        for index, scene in enumerate(scenes, start=1):
+            prefix = f"s{index}"
+            viewbox, inner = self._scope_scene(scene['svg_content'], prefix, elapsed)
+            timeline.append(self._timeline_css(prefix, elapsed, elapsed + scene['duration'], total))
+            groups.append(
+                f'<g class="scene {prefix}"><svg width="{self.width}" height="{self.height}" viewBox="{viewbox}">'
+                f'{inner}</svg></g>'
+            )
+            elapsed += scene['duration']
+
+        logger.info(f"🎬 合成长动画: {len(scenes)} 个场景, 共 {total} 秒")
+        return (
+            f'<svg viewBox="0 0 {self.width} {self.height}" xmlns="http://www.w3.org/2000/svg" '
+            f'xmlns:xlink="http://www.w3.org/1999/xlink">'
+            f'<style>{"".join(timeline)}</style>'
+            f'<rect width="{self.width}" height="{self.height}" fill="{bg_color}"/>'
+            f'{"".join(groups)}</svg>'
+        )
+
+
+scene_composer = SceneComposer()
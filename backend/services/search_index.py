@@ -0,0 +1,148 @@
+"""
+动画全文搜索 - SQLite FTS5
+社区和管理后台的搜索原来是 LIKE '%关键词%'，每次都要扫描全部动画，结果也只能按时间排序。
+- animations_fts（FTS5 虚拟表）索引标题、描述、提示词和分类，rowid 即动画 id
+- 中文按字切成重叠的二元组（光合作用 -> 光合 合作 作用 用）后交给 unicode61 分词器，英文、数字按词索引；
+  多字关键词作为二元组短语查询（等价于子串匹配），单字和英文关键词用前缀查询
+- 结果按 bm25 相关度排序（标题权重最高），相关度相同时按时间倒序
+- 动画插入、修改、删除时通过 ORM 事件在同一事务中更新索引；启动时发现条数不一致则重建
+"""
+import re
+import logging
+from sqlalchemy import event, false, func, literal_column, select, table, column, text, inspect as sa_inspect
+from models import Animation
+
+logger = logging.getLogger(__name__)
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+# 连续的中文，或连续的字母数字（与 unicode61 分词器的词边界一致）
+_TERM_PATTERN = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+_CJK_PATTERN = re.compile(f'[{_CJK}]')
+
+
+class SearchIndex:
+    TABLE = 'animations_fts'
+    FIELDS = ('title', 'description', 'prompt', 'category')
+    # bm25 权重，顺序与 FIELDS 一致
+    WEIGHTS = (10.0, 3.0, 1.0, 5.0)
+    # 每个字段最多索引的字符数（提示词可能很长）
+    MAX_CHARS = 2000
+    REBUILD_BATCH = 1000
+
+    def __init__(self):
+        self._fts = table(self.TABLE, column('rowid'))
+        self._registered = False
+
+    # ============ 分词 ============
+
+    @staticmethod
+    def _terms(value: str) -> list:
+        return _TERM_PATTERN.findall((value or '').lower())
+
+    @staticmethod
+    def _bigrams(term: str) -> list:
+        return [term[i:i + 2] for i in range(len(term) - 1)]
+
+    def tokenize(self, value: str) -> str:
+        """索引用的文本：中文切成二元组，末字单独保留（单字前缀查询能匹配到每一个字）"""
+        tokens = []
+        for term in self._terms((value or '')[:self.MAX_CHARS]):
+            if _CJK_PATTERN.match(term):
+                tokens.extend(self._bigrams(term))
+                tokens.append(term[-1])
+            else:
+                tokens.append(term)
+        return ' '.join(tokens)
+
+    def match_query(self, keywords: str):
+        """把搜索关键词转换为 FTS5 MATCH 表达式（各关键词之间为 AND），没有可检索的字词时返回 None"""
+        phrases = []
+        for term in self._terms(keywords):
+            if _CJK_PATTERN.match(term) and len(term) > 1:
+                phrases.append('"' + ' '.join(self._bigrams(term)) + '"')
+            else:
+                phrases.append(f'"{term}"*')
+        return ' '.join(phrases) or None
+
+    # ============ 查询 ============
+
+    def search(self, query, keywords: str):
+        """给动画查询加上全文匹配条件，并按相关度排序；返回 (查询, 相关度列)，相关度越小越相关"""
+        match = self.match_query(keywords)
+        if match is None:
+            return query.filter(false()), None
+        fts = literal_column(self.TABLE)
+        # 先在全文索引中求出匹配的动画和相关度（MATERIALIZED 防止被展开），再按主键关联动画表；
+        # 直接 JOIN 时查询规划器会从动画表出发，对每一行单独执行一次 MATCH
+        ranked = select(self._fts.c.rowid.label('id'), func.bm25(fts, *self.WEIGHTS).label('rank'))\
+            .where(fts.op('MATCH')(match)).cte('search_ranked').prefix_with('MATERIALIZED')
+        return query.join(ranked, ranked.c.id == Animation.id)\
+            .order_by(ranked.c.rank, Animation.created_at.desc()), ranked.c.rank
+
+    # ============ 索引维护 ============
+
+    def _row(self, animation_id, values: dict) -> dict:
+        row = {field: self.tokenize(values.get(field)) for field in self.FIELDS}
+        row['id'] = animation_id
+        return row
+
+    def _insert_sql(self):
+        return text(f"INSERT INTO {self.TABLE} (rowid, {', '.join(self.FIELDS)}) "
+                    f"VALUES (:id, {', '.join(':' + field for field in self.FIELDS)})")
+
+    def _after_insert(self, mapper, connection, target):
+        connection.execute(self._insert_sql(),
+                           self._row(target.id, {field: getattr(target, field) for field in self.FIELDS}))
+
+    def _after_update(self, mapper, connection, target):
+        # 只更新变化的字段；未加载的提示词（deferred）不会被改动
+        state = sa_inspect(target)
+        changed = [field for field in self.FIELDS if state.attrs[field].history.has_changes()]
+        if not changed:
+            return
+        values = {field: self.tokenize(getattr(target, field)) for field in changed}
+        connection.execute(
+            text(f"UPDATE {self.TABLE} SET {', '.join(f'{field} = :{field}' for field in changed)} WHERE rowid = :id"),
+            dict(values, id=target.id)
+        )
+
+    def _after_delete(self, mapper, connection, target):
+        connection.execute(text(f'DELETE FROM {self.TABLE} WHERE rowid = :id'), {'id': target.id})
+
+    def register(self):
+        """注册 ORM 事件：动画的增删改在同一事务中同步到全文索引"""
+        if self._registered:
+            return
+        event.listen(Animation, 'after_insert', self._after_insert)
+        event.listen(Animation, 'after_update', self._after_update)
+        event.listen(Animation, 'after_delete', self._after_delete)
+        self._registered = True
+
+    def rebuild(self, db) -> int:
+        """清空并按动画表重建索引（不提交），返回索引的动画数"""
+        db.session.execute(text(f'DELETE FROM {self.TABLE}'))
+        last_id, indexed = 0, 0
+        while True:
+            rows = db.session.query(Animation.id, *(getattr(Animation, field) for field in self.FIELDS))\
+                .filter(Animation.id > last_id).order_by(Animation.id).limit(self.REBUILD_BATCH).all()
+            if not rows:
+                break
+            db.session.execute(self._insert_sql(), [self._row(row.id, row._asdict()) for row in rows])
+            last_id = rows[-1].id
+            indexed += len(rows)
+        return indexed
+
+    def setup(self, db) -> int:
+        """创建索引表并注册同步事件；索引条数与动画数不一致时重建（不提交），返回重建的条数"""
+        self.register()
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} USING fts5("
+            f"{', '.join(self.FIELDS)}, tokenize='unicode61', prefix='1')"
+        ))
+        indexed = db.session.execute(text(f'SELECT count(*) FROM {self.TABLE}')).scalar()
+        if indexed == Animation.query.count():
+            return 0
+        return self.rebuild(db)
+
+
+search_index = SearchIndex()
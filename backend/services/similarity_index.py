@@ -0,0 +1,222 @@
+"""
+公开动画相似度索引 - 字符 n-gram MinHash + LSH 分桶
+生成前先查一下社区里是否已有相近的动画，让用户可以直接复用而不是花配额重新生成。
+- 每个公开动画的提示词、标题、描述分别计算 MinHash 签名（短查询和长描述混在一起会拉低相似度）
+- 签名按 BANDS 段分桶，查询只比较至少有一段完全相同的候选，不做全表扫描
+- 启动时在后台线程中建立索引；发布/取消发布/编辑/删除时在本进程内增量更新
+- 其他 worker 的修改由后台线程定期同步：只读取 updated_at 较新的动画，不在请求中扫描或计算签名
+"""
+import re
+import time
+import zlib
+import random
+import logging
+import threading
+from datetime import timedelta
+from sqlalchemy import func
+from models import Animation
+from services.sqlite_tuning import sqlite_tuning
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NORMALIZE_PATTERN = re.compile(r'[\W_]+', re.UNICODE)
+
+
+class SimilarityIndex:
+    NUM_PERM = 64
+    BANDS = 32  # 每段 NUM_PERM / BANDS = 2 行，Jaccard 约 0.2 以上即可能成为候选
+    NGRAM = 2
+    # 长描述只取开头部分，控制签名计算开销
+    MAX_CHARS = 300
+    # 同步时向前回看的时长（秒），覆盖 flush 与提交之间的间隔
+    SYNC_LOOKBACK = 60
+    FIELDS = ('prompt', 'title', 'description')
+
+    def __init__(self):
+        rng = random.Random(20240607)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(self.NUM_PERM)]
+        self._rows = self.NUM_PERM // self.BANDS
+        self._signatures = {}   # (animation_id, field) -> 签名
+        self._versions = {}     # animation_id -> updated_at
+        self._buckets = [{} for _ in range(self.BANDS)]
+        self._lock = threading.RLock()
+        self._watermark = None  # 上次同步时动画表中最新的 updated_at
+        self._builder = None
+
+    # ============ MinHash ============
+
+    def _shingles(self, text: str) -> set:
+        text = _NORMALIZE_PATTERN.sub('', (text or '').lower())[:self.MAX_CHARS]
+        if len(text) <= self.NGRAM:
+            return {text} if text else set()
+        return {text[i:i + self.NGRAM] for i in range(len(text) - self.NGRAM + 1)}
+
+    def signature(self, text: str):
+        """文本的 MinHash 签名，文本为空时返回 None"""
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in self._shingles(text)]
+        if not hashes:
+            return None
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, signature):
+        for band in range(self.BANDS):
+            yield band, signature[band * self._rows:(band + 1) * self._rows]
+
+    # ============ 索引维护 ============
+
+    def _signatures_of(self, texts: dict) -> dict:
+        """各字段的签名（不加锁：签名计算是主要开销，不阻塞查询）"""
+        signatures = {}
+        for field in self.FIELDS:
+            signature = self.signature(texts.get(field))
+            if signature is not None:
+                signatures[field] = signature
+        return signatures
+
+    def _store(self, animation_id: int, signatures: dict, version):
+        """写入签名（需持有锁）；已索引的版本更新时忽略，避免后台同步用旧数据覆盖请求中的更新"""
+        current = self._versions.get(animation_id)
+        if current is not None and version is not None and current > version:
+            return
+        self._remove(animation_id)
+        for field, signature in signatures.items():
+            key = (animation_id, field)
+            self._signatures[key] = signature
+            for band, band_key in self._band_keys(signature):
+                self._buckets[band].setdefault(band_key, set()).add(key)
+        self._versions[animation_id] = version
+
+    def _remove(self, animation_id: int):
+        for field in self.FIELDS:
+            key = (animation_id, field)
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                continue
+            for band, band_key in self._band_keys(signature):
+                bucket = self._buckets[band].get(band_key)
+                if bucket:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band][band_key]
+        self._versions.pop(animation_id, None)
+
+    def update(self, animation):
+        """本进程中动画发布状态或内容变化（已提交）后调用：公开则（重新）索引，否则移出索引"""
+        if animation.is_public:
+            signatures = self._signatures_of({field: getattr(animation, field) for field in self.FIELDS})
+            with self._lock:
+                self._store(animation.id, signatures, animation.updated_at)
+        else:
+            self.remove(animation.id)
+
+    def remove(self, animation_id: int):
+        with self._lock:
+            self._remove(animation_id)
+
+    def _index_rows(self, session, animation_ids: list) -> int:
+        """按 id 分批读取并索引公开动画，返回索引的个数"""
+        indexed = 0
+        for start in range(0, len(animation_ids), 500):
+            rows = session.query(Animation.id, Animation.updated_at, Animation.prompt, Animation.title,
+                                 Animation.description, Animation.is_public)\
+                .filter(Animation.id.in_(animation_ids[start:start + 500])).all()
+            for row in rows:
+                if not row.is_public:
+                    self.remove(row.id)
+                    continue
+                signatures = self._signatures_of({'prompt': row.prompt, 'title': row.title,
+                                                  'description': row.description})
+                with self._lock:
+                    self._store(row.id, signatures, row.updated_at)
+                indexed += 1
+        return indexed
+
+    def build(self):
+        """按数据库建立索引（需在应用上下文中调用），分批计算签名，建立期间查询使用已索引的部分"""
+        with sqlite_tuning.read_only_session() as session:
+            self._watermark = session.query(func.max(Animation.updated_at)).scalar()
+            ids = [row[0] for row in session.query(Animation.id).filter(Animation.is_public == True).all()]
+            indexed = self._index_rows(session, ids)
+        logger.info(f"🔎 相似度索引已建立: {indexed} 个动画")
+
+    def sync(self):
+        """同步其他 worker 的修改：只读取 updated_at 晚于上次同步的动画（发布、取消公开、编辑都会更新它）；
+        公开动画数与索引不一致（其他 worker 删除了动画）时再比对 id，不重新计算签名"""
+        with sqlite_tuning.read_only_session() as session:
+            watermark = session.query(func.max(Animation.updated_at)).scalar()
+            changed = []
+            if watermark is not None:
+                # 回看一段时间：updated_at 在 flush 时确定，较早的时间可能晚一些才提交
+                since = (self._watermark or watermark) - timedelta(seconds=self.SYNC_LOOKBACK)
+                rows = session.query(Animation.id, Animation.updated_at, Animation.is_public)\
+                    .filter(Animation.updated_at > since).all()
+                with self._lock:
+                    changed = [row.id for row in rows if (self._versions.get(row.id) != row.updated_at
+                                                          if row.is_public else row.id in self._versions)]
+            self._index_rows(session, changed)
+
+            removed = 0
+            public_count = session.query(func.count(Animation.id)).filter(Animation.is_public == True).scalar()
+            if public_count != len(self._versions):
+                public_ids = {row[0] for row in session.query(Animation.id).filter(Animation.is_public == True)}
+                with self._lock:
+                    stale = set(self._versions) - public_ids
+                    for animation_id in stale:
+                        self._remove(animation_id)
+                removed = len(stale)
+                self._index_rows(session, list(public_ids - set(self._versions)))
+            self._watermark = watermark
+        if changed or removed:
+            logger.info(f"🔎 相似度索引同步: {len(changed)} 个动画更新, {removed} 个移除, 共 {len(self._versions)} 个")
+
+    def _sync_loop(self, app, interval: int):
+        with app.app_context():
+            try:
+                self.build()
+            except Exception as e:
+                logger.warning(f"⚠️ 建立相似度索引失败: {str(e)}")
+        while interval > 0:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.warning(f"⚠️ 同步相似度索引失败: {str(e)}")
+
+    def init_app(self, app):
+        """在后台线程中建立索引，之后定期同步其他 worker 的修改（请求中不计算索引）"""
+        if self._builder is None:
+            self._builder = threading.Thread(target=self._sync_loop,
+                                             args=(app, app.config['SIMILARITY_SYNC_INTERVAL']), daemon=True)
+            self._builder.start()
+
+    # ============ 查询 ============
+
+    def query(self, text: str, limit: int = 5, min_score: float = 0.3) -> list:
+        """返回 [(animation_id, 估计的 Jaccard 相似度)]，按相似度降序；索引建立完成前只查已索引的部分"""
+        signature = self.signature(text)
+        if signature is None:
+            return []
+
+        with self._lock:
+            candidates = set()
+            for band, band_key in self._band_keys(signature):
+                candidates |= self._buckets[band].get(band_key, set())
+
+            scores = {}
+            for key in candidates:
+                other = self._signatures[key]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.NUM_PERM
+                if score >= min_score and score > scores.get(key[0], 0):
+                    scores[key[0]] = score
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+similarity_index = SimilarityIndex()
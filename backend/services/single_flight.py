@@ -0,0 +1,119 @@
+"""
+生成请求合并（single-flight）
+双击、客户端重试等产生的相同请求合并到同一个进行中的生成上：
+- 第一个请求（leader）负责预留配额、创建任务，并在后台线程中驱动生成
+- 后续相同请求直接订阅这次生成，从头回放已产生的事件并等待后续事件，不重复调用模型也不重复扣配额
+- 生成与任何单个连接解耦；所有订阅者都断开后才取消生成（关闭上游流并退还配额）
+同一进程内的合并在这里完成；跨 worker 的重复请求由路由层按任务表中的 idempotency_key 处理
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """一次进行中的生成，事件为 dict，按产生顺序保存供后来的订阅者回放"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event: dict):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """回放已有事件并等待后续事件，直到生成结束"""
+        with self._cond:
+            self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.events) and not self.done:
+                        self._cond.wait()
+                    batch = self.events[index:]
+                    index = len(self.events)
+                    finished = self.done
+                for event in batch:
+                    yield event
+                if finished:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                # 最后一个订阅者断开且生成尚未结束：通知生产者取消
+                if self.subscribers == 0 and not self.done:
+                    self.cancelled = True
+
+    def result(self) -> dict:
+        """阻塞等待生成结束，返回最后一个事件"""
+        last = None
+        for event in self.subscribe():
+            last = event
+        return last
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join_or_create(self, key: str):
+        """返回 (flight, 是否为 leader)；leader 负责调用 run() 或 fail()"""
+        with self._lock:
+            flight = self._flights.get(key)
+            # 已被取消（订阅者全部断开）的生成不再接收新的订阅者
+            if flight is not None and not flight.cancelled:
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            return flight, True
+
+    def _release(self, flight: Flight):
+        flight.finish()
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def fail(self, flight: Flight, event: dict):
+        """leader 在开始生成前失败（如配额不足），已订阅的请求收到同样的错误"""
+        flight.publish(event)
+        self._release(flight)
+
+    def run(self, flight: Flight, app, producer):
+        """在后台线程（带应用上下文）中驱动 producer 生成器，事件发布给所有订阅者"""
+        def worker():
+            try:
+                with app.app_context():
+                    events = producer()
+                    try:
+                        for event in events:
+                            flight.publish(event)
+                            if flight.cancelled:
+                                logger.info("🛑 所有客户端已断开，取消生成")
+                                break
+                    finally:
+                        # 取消时在生成器内部触发 GeneratorExit：关闭上游流、退还配额、任务标记为已取消
+                        events.close()
+            except Exception as e:
+                logger.error(f"❌ 生成失败: {str(e)}")
+                flight.publish({'type': 'error', 'message': f'生成失败: {str(e)}'})
+            finally:
+                self._release(flight)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+
+single_flight = SingleFlight()
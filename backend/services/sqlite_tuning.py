@@ -0,0 +1,148 @@
+"""
+SQLite 并发配置
+多个 gunicorn worker 共用 db/easyanimate.db，默认的回滚日志模式下读写互相阻塞，点赞高峰时会出现 "database is locked"。
+- 连接池每建立一个连接（engine 的 connect 事件）就设置：WAL 日志、busy_timeout、synchronous=NORMAL、
+  页缓存、内存映射和 WAL 文件大小上限；WAL 模式下读不阻塞写，写也不阻塞读
+- 后台线程定期执行 PASSIVE checkpoint：一直有读事务时自动 checkpoint 跟不上，WAL 文件会持续变大
+- 列表接口、生成过程中读取配置和模型健康度使用只读连接（mode=ro + query_only）的短会话，
+  查询完立即归还连接，不会持有写锁
+非 SQLite、内存数据库或 SQLITE_TUNING=false 时不做任何处理
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteTuning:
+    def __init__(self):
+        self._engine = None
+        self._read_engine = None
+        self._checkpointer = None
+        self.last_checkpoint = None
+
+    @staticmethod
+    def _pragmas(config, read_only: bool = False) -> list:
+        pragmas = [
+            f"PRAGMA busy_timeout = {config['SQLITE_BUSY_TIMEOUT_MS']}",
+            # WAL 模式下 NORMAL 不会损坏数据库，只是掉电时可能丢失最近提交的事务
+            'PRAGMA synchronous = NORMAL',
+            f"PRAGMA cache_size = -{config['SQLITE_CACHE_SIZE_KB']}",
+            f"PRAGMA mmap_size = {config['SQLITE_MMAP_SIZE_MB'] * 1024 * 1024}",
+            'PRAGMA temp_store = MEMORY',
+            # checkpoint 回卷后把 WAL 文件截断到这个大小
+            f"PRAGMA journal_size_limit = {config['SQLITE_WAL_SIZE_LIMIT_MB'] * 1024 * 1024}",
+        ]
+        if read_only:
+            pragmas.append('PRAGMA query_only = 1')
+        return pragmas
+
+    @staticmethod
+    def _on_connect(pragmas: list, wal: bool):
+        def listener(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                if wal:
+                    # WAL 是持久设置，已经是 WAL 时这里不做任何事；放在最后，切换时可以用上 busy_timeout
+                    cursor.execute('PRAGMA journal_mode = WAL')
+            finally:
+                cursor.close()
+        return listener
+
+    def init_app(self, app, db) -> bool:
+        """为 SQLite 引擎注册连接配置、创建只读引擎并启动 checkpoint 线程（需在应用上下文中调用）"""
+        engine = db.engine
+        path = engine.url.database
+        if not app.config['SQLITE_TUNING'] or engine.dialect.name != 'sqlite' or not path or path == ':memory:':
+            return False
+
+        event.listen(engine, 'connect', self._on_connect(self._pragmas(app.config), wal=True))
+        # 已经建立的连接（如果有）重新建立，确保每个连接都应用了上述设置
+        engine.dispose()
+        self._engine = engine
+
+        self._read_engine = create_engine(f'sqlite:///file:{path}?mode=ro&uri=true')
+        event.listen(self._read_engine, 'connect',
+                     self._on_connect(self._pragmas(app.config, read_only=True), wal=False))
+
+        interval = app.config['SQLITE_CHECKPOINT_INTERVAL']
+        if interval > 0 and self._checkpointer is None:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, args=(interval,), daemon=True)
+            self._checkpointer.start()
+
+        logger.info(f"🗄️ SQLite: WAL, busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}ms, "
+                    f"cache={app.config['SQLITE_CACHE_SIZE_KB']}KB, mmap={app.config['SQLITE_MMAP_SIZE_MB']}MB, "
+                    f"checkpoint={interval}s")
+        return True
+
+    # ============ 只读会话 ============
+
+    @property
+    def read_engine(self):
+        """只读引擎，未启用时为 None"""
+        return self._read_engine
+
+    @contextmanager
+    def read_only_session(self):
+        """只读查询使用的短会话，退出时立即关闭并归还连接；未启用时使用主引擎上的独立会话"""
+        if self._read_engine is None:
+            from models import db
+            bind = db.engine
+        else:
+            bind = self._read_engine
+        session = Session(bind=bind, autoflush=False)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    # ============ checkpoint ============
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> dict:
+        """执行一次 WAL checkpoint，返回 {mode, busy, wal_pages, checkpointed_pages, wal_bytes, at}"""
+        if self._engine is None:
+            return None
+        with self._engine.connect() as conn:
+            busy, wal_pages, checkpointed = conn.exec_driver_sql(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        wal_file = f'{self._engine.url.database}-wal'
+        self.last_checkpoint = {
+            'mode': mode,
+            'busy': bool(busy),
+            'wal_pages': wal_pages,
+            'checkpointed_pages': checkpointed,
+            'wal_bytes': os.path.getsize(wal_file) if os.path.exists(wal_file) else 0,
+            'at': datetime.utcnow().isoformat()
+        }
+        return self.last_checkpoint
+
+    def _checkpoint_loop(self, interval: int):
+        while True:
+            time.sleep(interval)
+            try:
+                result = self.checkpoint()
+                if result['wal_pages'] > result['checkpointed_pages']:
+                    logger.info(f"🗄️ WAL checkpoint: {result['checkpointed_pages']}/{result['wal_pages']} 页"
+                                f"（仍有读事务在使用旧页）, WAL {result['wal_bytes'] // 1024}KB")
+            except Exception as e:
+                logger.warning(f"⚠️ WAL checkpoint 失败: {str(e)}")
+
+    def status(self) -> dict:
+        """当前连接的 SQLite 设置和最近一次 checkpoint 结果"""
+        if self._engine is None:
+            return {'enabled': False}
+        with self._engine.connect() as conn:
+            settings = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                        for name in ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size',
+                                     'journal_size_limit')}
+        return {'enabled': True, **settings, 'last_checkpoint': self.last_checkpoint}
+
+
+sqlite_tuning = SQLiteTuning()
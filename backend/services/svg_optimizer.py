@@ -0,0 +1,216 @@
+"""
+SVG 优化服务 - 在入库前压缩AI生成/用户编辑的SVG
+- 删除注释和标签间的空白
+- 坐标类属性按精度四舍五入
+- 压缩 <style> 中的CSS，去除重复规则、合并相邻的相同规则
+- 删除取默认值的属性
+- 可选：用无头浏览器在同一时间点渲染优化前后的帧，像素不一致时放弃优化
+"""
+import re
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 需要四舍五入数值的属性（不含 opacity / offset 等 0-1 区间的属性）
+# 不含 d、points、transform：路径、折线顶点和变换矩阵舍入后误差会累积或被放大，渲染校验默认关闭，不能依赖它兜底
+NUMERIC_ATTRIBUTES = {
+    'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'dx', 'dy',
+    'width', 'height', 'viewBox',
+    'stroke-width', 'stroke-dasharray', 'stroke-dashoffset', 'font-size'
+}
+
+# 取默认值时可以删除的属性（只包含不会被子元素继承的属性）
+DEFAULT_ATTRIBUTES = {
+    '*': {'opacity': '1'},
+    'svg': {'version': '1.1'},
+    'rect': {'x': '0', 'y': '0'},
+    'circle': {'cx': '0', 'cy': '0'},
+    'ellipse': {'cx': '0', 'cy': '0'},
+    'line': {'x1': '0', 'y1': '0', 'x2': '0', 'y2': '0'},
+}
+
+_NUMBER_PATTERN = re.compile(r'-?\d*\.\d+(?:[eE][-+]?\d+)?')
+_TAG_PATTERN = re.compile(r'<([a-zA-Z][\w:.-]*)((?:\s+[^<>]*?)?)\s*(/?)>')
+_ATTR_PATTERN = re.compile(r'([\w:.-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+# 最内层的花括号：只包含声明（@keyframes 的帧、普通规则的规则体），选择器中的冒号不在其中
+_DECLARATION_BLOCK_PATTERN = re.compile(r'\{[^{}]*\}')
+_PLACEHOLDER = '\x00{}\x00'
+
+
+class SVGOptimizer:
+    def __init__(self, precision: int = None, verify: bool = None):
+        self.precision = Config.SVG_OPTIMIZE_PRECISION if precision is None else precision
+        self.verify = Config.SVG_OPTIMIZE_VERIFY if verify is None else verify
+
+    # ============ 数值 ============
+
+    def _round_numbers(self, value: str) -> str:
+        def replace(match):
+            number = float(match.group())
+            text = f"{number:.{self.precision}f}".rstrip('0').rstrip('.')
+            if text in ('-0', ''):
+                text = '0'
+            # 路径数据中 "1.004.5" 这类紧凑写法，舍入成整数后需要补分隔符
+            if '.' not in text and value[match.end():match.end() + 1] == '.':
+                text += ' '
+            return text
+        return _NUMBER_PATTERN.sub(replace, value)
+
+    # ============ CSS ============
+
+    def _split_css_rules(self, css: str) -> list:
+        """按顶层花括号切分CSS，返回 (选择器/前导, 规则体) 列表，@import 等语句的规则体为 None"""
+        rules = []
+        depth = 0
+        start = 0
+        prelude_end = None
+        for i, ch in enumerate(css):
+            if ch == '{':
+                if depth == 0:
+                    prelude_end = i
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    rules.append((css[start:prelude_end].strip(), css[prelude_end + 1:i]))
+                    start = i + 1
+            elif ch == ';' and depth == 0:
+                rules.append((css[start:i + 1].strip(), None))
+                start = i + 1
+        if depth != 0:
+            raise ValueError('CSS 花括号不匹配')
+        return rules
+
+    def _minify_css(self, css: str) -> str:
+        css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+        css = re.sub(r'\s+', ' ', css)
+        css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+        # 只压缩声明中冒号两侧的空白：选择器中的空白有意义（.a :first-child 是后代选择器）
+        css = _DECLARATION_BLOCK_PATTERN.sub(lambda m: re.sub(r'\s*:\s*', ':', m.group(0)), css)
+        css = css.replace(';}', '}').strip()
+
+        rules = self._split_css_rules(css)
+
+        # 完全相同的规则只保留最后一次出现（后者本就覆盖前者）
+        seen = set()
+        deduped = []
+        for rule in reversed(rules):
+            if rule in seen:
+                continue
+            seen.add(rule)
+            deduped.append(rule)
+        deduped.reverse()
+
+        # 合并相邻的普通规则：选择器相同则合并声明，声明相同则合并选择器
+        merged = []
+        for prelude, body in deduped:
+            if merged and body is not None and not prelude.startswith('@'):
+                last_prelude, last_body = merged[-1]
+                if last_body is not None and not last_prelude.startswith('@'):
+                    if last_prelude == prelude:
+                        merged[-1] = (prelude, f"{last_body};{body}")
+                        continue
+                    if last_body == body:
+                        merged[-1] = (f"{last_prelude},{prelude}", body)
+                        continue
+            merged.append((prelude, body))
+
+        return ''.join(prelude if body is None else f"{prelude}{{{body}}}" for prelude, body in merged)
+
+    def _optimize_style_block(self, match) -> str:
+        open_tag, css, close_tag = match.group(1), match.group(2), match.group(3)
+        cdata = re.fullmatch(r'\s*<!\[CDATA\[(.*)\]\]>\s*', css, flags=re.DOTALL)
+        if cdata:
+            return f"{open_tag}<![CDATA[{self._minify_css(cdata.group(1))}]]>{close_tag}"
+        return f"{open_tag}{self._minify_css(css)}{close_tag}"
+
+    # ============ 标签属性 ============
+
+    def _optimize_tag(self, match) -> str:
+        name, attrs_text, self_closing = match.group(1), match.group(2), match.group(3)
+        attrs = _ATTR_PATTERN.findall(attrs_text)
+        # 属性无法完整解析时保持原样
+        if _ATTR_PATTERN.sub('', attrs_text).strip():
+            return match.group(0)
+
+        defaults = {**DEFAULT_ATTRIBUTES['*'], **DEFAULT_ATTRIBUTES.get(name, {})}
+        parts = [name]
+        for attr, quoted in attrs:
+            quote, value = quoted[0], quoted[1:-1]
+            if attr in NUMERIC_ATTRIBUTES:
+                value = ' '.join(self._round_numbers(value).split())
+            if defaults.get(attr) == value.strip():
+                continue
+            parts.append(f"{attr}={quote}{value}{quote}")
+
+        return f"<{' '.join(parts)}{'/' if self_closing else ''}>"
+
+    # ============ 入口 ============
+
+    def minify(self, svg: str) -> str:
+        """纯文本变换，不做渲染校验"""
+        protected = []
+
+        def protect(text):
+            protected.append(text)
+            return _PLACEHOLDER.format(len(protected) - 1)
+
+        svg = re.sub(r'(<style\b[^>]*>)(.*?)(</style>)',
+                     lambda m: protect(self._optimize_style_block(m)), svg, flags=re.DOTALL)
+        svg = re.sub(r'<script\b.*?</script>|<!\[CDATA\[.*?\]\]>',
+                     lambda m: protect(m.group()), svg, flags=re.DOTALL)
+        svg = re.sub(r'<!--.*?-->', '', svg, flags=re.DOTALL)
+        svg = _TAG_PATTERN.sub(self._optimize_tag, svg)
+
+        # 文字元素内的空白有意义（tspan 之间的空格），只压缩为单个空格
+        svg = re.sub(r'<text\b.*?</text>',
+                     lambda m: protect(re.sub(r'\s+', ' ', m.group())), svg, flags=re.DOTALL)
+        svg = re.sub(r'([>\x00])\s+(?=[<\x00])', r'\1', svg).strip()
+
+        # 占位符可能嵌套（text 中包含 CDATA），倒序还原
+        for index in range(len(protected) - 1, -1, -1):
+            svg = svg.replace(_PLACEHOLDER.format(index), protected[index])
+        return svg
+
+    def verify_render(self, original: str, optimized: str, at_ms: int = 1000):
+        """渲染同一时间点的帧并比较，返回 True/False；无法渲染时返回 None"""
+        from PIL import ImageChops
+        from services.export_service import export_service
+
+        images = export_service.render_snapshots([original, optimized], at_ms=at_ms)
+        if not images:
+            return None
+        diff = ImageChops.difference(images[0], images[1]).convert('L')
+        # 允许极少量抗锯齿像素差异
+        changed = sum(diff.histogram()[24:])
+        return changed <= diff.width * diff.height * 0.002
+
+    def optimize(self, svg: str) -> str:
+        """优化SVG，任何异常或渲染不一致时返回原内容"""
+        if not svg:
+            return svg
+        try:
+            optimized = self.minify(svg)
+        except Exception as e:
+            logger.warning(f"SVG 优化失败，保留原内容: {e}")
+            return svg
+
+        if len(optimized) >= len(svg):
+            return svg
+
+        if self.verify:
+            try:
+                same = self.verify_render(svg, optimized)
+            except Exception as e:
+                logger.warning(f"SVG 渲染校验失败: {e}")
+                same = None
+            if same is False:
+                logger.warning("SVG 优化后渲染结果不一致，保留原内容")
+                return svg
+
+        logger.info(f"🗜️ SVG 优化: {len(svg)} -> {len(optimized)} 字节")
+        return optimized
+
+
+svg_optimizer = SVGOptimizer()
@@ -0,0 +1,243 @@
+"""
+SVG 结构化补丁 - AI 编辑时只返回按元素 id 定位的修改操作，由服务端校验并应用
+- ensure_ids：给没有 id 的元素补上短 id（e1、e2...），让模型可以引用任意元素
+- apply_patch：在解析后的 SVG 树上依次执行操作，任一操作无效则整体失败
+
+支持的操作：
+    {"op": "set_attr", "id": "...", "attrs": {"fill": "#f00", "opacity": null}}   值为 null 表示删除属性
+    {"op": "set_text", "id": "...", "text": "..."}
+    {"op": "set_css", "css": "..."}                                               替换第一个 <style> 的内容
+    {"op": "replace", "id": "...", "svg": "<g>...</g>"}
+    {"op": "insert", "svg": "...", "parent": "...", "index": 0}                  或用 "before"/"after": "<id>" 定位
+    {"op": "move", "id": "...", "parent": "...", "index": 0}                     或用 "before"/"after": "<id>" 定位
+    {"op": "remove", "id": "..."}
+"""
+import re
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+OPERATIONS = {'set_attr', 'set_text', 'set_css', 'replace', 'insert', 'move', 'remove'}
+# 单次补丁最多操作数
+MAX_OPERATIONS = 50
+# 不分配 id 的元素
+_NO_ID_TAGS = {'style', 'title', 'desc', 'metadata'}
+
+
+class SVGPatchError(ValueError):
+    """补丁无效或无法应用"""
+    pass
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _parse(svg: str) -> ET.Element:
+    svg = re.sub(r'<\?xml.*?\?>|<!DOCTYPE[^>]*>', '', svg, flags=re.DOTALL).strip()
+    try:
+        root = ET.fromstring(svg)
+    except ET.ParseError as e:
+        raise SVGPatchError(f'SVG 无法解析: {e}')
+    if _local_name(root.tag) != 'svg':
+        raise SVGPatchError('根元素不是 <svg>')
+    return root
+
+
+def _serialize(root: ET.Element) -> str:
+    return ET.tostring(root, encoding='unicode')
+
+
+def _assign_ids(root: ET.Element, elements) -> int:
+    """给 elements 中缺少 id 的元素分配未被占用的 e<n>，返回分配数量"""
+    used = {el.get('id') for el in root.iter() if el.get('id')}
+    counter = 0
+    assigned = 0
+    for el in elements:
+        if el.get('id') or _local_name(el.tag) in _NO_ID_TAGS:
+            continue
+        counter += 1
+        while f'e{counter}' in used:
+            counter += 1
+        el.set('id', f'e{counter}')
+        used.add(f'e{counter}')
+        assigned += 1
+    return assigned
+
+
+def ensure_ids(svg: str) -> str:
+    """给所有没有 id 的元素补上 id；无需修改时返回原内容"""
+    root = _parse(svg)
+    if not _assign_ids(root, root.iter()):
+        return svg
+    return _serialize(root)
+
+
+def _is_script_url(value) -> bool:
+    """javascript: 链接（浏览器解析 URL 时会忽略其中的空白和控制字符）"""
+    return isinstance(value, str) and re.sub(r'[\x00-\x20]', '', value).lower().startswith('javascript:')
+
+
+def _check_safe(element: ET.Element):
+    for el in element.iter():
+        if _local_name(el.tag) in ('script', 'foreignObject'):
+            raise SVGPatchError(f'不允许插入 <{_local_name(el.tag)}>')
+        for attr, value in el.attrib.items():
+            if _local_name(attr).lower().startswith('on'):
+                raise SVGPatchError(f'不允许事件属性 {attr}')
+            if _is_script_url(value):
+                raise SVGPatchError(f'不允许的属性值: {attr}')
+
+
+def _parse_fragment(fragment: str, root: ET.Element) -> list:
+    """解析补丁中的SVG片段，命名空间与文档根元素保持一致"""
+    if not isinstance(fragment, str) or not fragment.strip():
+        raise SVGPatchError('SVG 片段为空')
+    xmlns = f' xmlns="{SVG_NS}"' if root.tag.startswith('{') else ''
+    try:
+        wrapper = ET.fromstring(f'<svg{xmlns} xmlns:xlink="{XLINK_NS}">{fragment}</svg>')
+    except ET.ParseError as e:
+        raise SVGPatchError(f'SVG 片段无法解析: {e}')
+    elements = list(wrapper)
+    if not elements:
+        raise SVGPatchError('SVG 片段不包含元素')
+    for el in elements:
+        _check_safe(el)
+    # 片段末尾的文本不属于任何元素，丢弃
+    elements[-1].tail = None
+    return elements
+
+
+class _Document:
+    def __init__(self, root: ET.Element):
+        self.root = root
+
+    def find(self, element_id) -> ET.Element:
+        if not element_id:
+            raise SVGPatchError('缺少元素 id')
+        for el in self.root.iter():
+            if el.get('id') == element_id:
+                return el
+        raise SVGPatchError(f'元素不存在: {element_id}')
+
+    def parent_of(self, target: ET.Element) -> ET.Element:
+        for el in self.root.iter():
+            for child in el:
+                if child is target:
+                    return el
+        raise SVGPatchError('不能操作根元素')
+
+    def position(self, op: dict) -> tuple:
+        """解析插入位置，返回 (父元素, 下标)"""
+        if op.get('before') or op.get('after'):
+            anchor = self.find(op.get('before') or op.get('after'))
+            parent = self.parent_of(anchor)
+            index = list(parent).index(anchor)
+            return parent, index + (1 if op.get('after') else 0)
+        parent = self.find(op['parent']) if op.get('parent') else self.root
+        index = op.get('index')
+        if index is None:
+            return parent, len(parent)
+        if not isinstance(index, int) or isinstance(index, bool):
+            raise SVGPatchError('index 必须是整数')
+        return parent, max(0, min(index, len(parent)))
+
+    # ============ 操作 ============
+
+    def set_attr(self, op):
+        el = self.find(op.get('id'))
+        attrs = op.get('attrs')
+        if not isinstance(attrs, dict) or not attrs:
+            raise SVGPatchError('set_attr 缺少 attrs')
+        for name, value in attrs.items():
+            if not re.fullmatch(r'[A-Za-z_][\w:.-]*', str(name)) or name.lower().startswith('on'):
+                raise SVGPatchError(f'不允许的属性: {name}')
+            if name == 'id':
+                raise SVGPatchError('不能修改元素 id')
+            if name.startswith('xlink:'):
+                name = f'{{{XLINK_NS}}}{name[6:]}'
+            if _is_script_url(value):
+                raise SVGPatchError(f'不允许的属性值: {name}')
+            if value is None:
+                el.attrib.pop(name, None)
+            else:
+                el.set(name, str(value))
+
+    def set_text(self, op):
+        el = self.find(op.get('id'))
+        if not isinstance(op.get('text'), str):
+            raise SVGPatchError('set_text 缺少 text')
+        for child in list(el):
+            el.remove(child)
+        el.text = op['text']
+
+    def set_css(self, op):
+        if not isinstance(op.get('css'), str):
+            raise SVGPatchError('set_css 缺少 css')
+        style = next((el for el in self.root.iter() if _local_name(el.tag) == 'style'), None)
+        if style is None:
+            style = ET.Element(f'{{{SVG_NS}}}style' if self.root.tag.startswith('{') else 'style')
+            self.root.insert(0, style)
+        style.text = op['css']
+
+    def replace(self, op):
+        el = self.find(op.get('id'))
+        parent = self.parent_of(el)
+        elements = _parse_fragment(op.get('svg'), self.root)
+        index = list(parent).index(el)
+        elements[-1].tail = el.tail
+        parent.remove(el)
+        for offset, new in enumerate(elements):
+            parent.insert(index + offset, new)
+        _assign_ids(self.root, (e for new in elements for e in new.iter()))
+
+    def insert(self, op):
+        elements = _parse_fragment(op.get('svg'), self.root)
+        parent, index = self.position(op)
+        for offset, new in enumerate(elements):
+            parent.insert(index + offset, new)
+        _assign_ids(self.root, (e for new in elements for e in new.iter()))
+
+    def move(self, op):
+        el = self.find(op.get('id'))
+        old_parent = self.parent_of(el)
+        if op.get('parent') and any(child.get('id') == op['parent'] for child in el.iter()):
+            raise SVGPatchError('不能把元素移动到自身内部')
+        old_parent.remove(el)
+        try:
+            parent, index = self.position(op)
+        except SVGPatchError:
+            raise SVGPatchError('移动目标位置无效')
+        parent.insert(index, el)
+
+    def remove(self, op):
+        el = self.find(op.get('id'))
+        self.parent_of(el).remove(el)
+
+
+def apply_patch(svg: str, operations: list) -> str:
+    """在 svg 上依次应用 operations，返回新的 SVG；补丁无效时抛出 SVGPatchError"""
+    if not isinstance(operations, list) or not operations:
+        raise SVGPatchError('补丁不包含任何操作')
+    if len(operations) > MAX_OPERATIONS:
+        raise SVGPatchError(f'单次最多 {MAX_OPERATIONS} 个操作')
+
+    document = _Document(_parse(svg))
+    for number, op in enumerate(operations, start=1):
+        if not isinstance(op, dict):
+            raise SVGPatchError(f'第 {number} 个操作格式无效')
+        if op.get('op') not in OPERATIONS:
+            raise SVGPatchError(f"第 {number} 个操作类型不支持: {op.get('op')}")
+        try:
+            getattr(document, op['op'])(op)
+        except SVGPatchError as e:
+            raise SVGPatchError(f'第 {number} 个操作无效: {e}')
+
+    return _serialize(document.root)
+
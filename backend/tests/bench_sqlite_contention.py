@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+SQLite 并发争用压测：模拟多个 gunicorn worker 同时点赞（写）、刷社区列表（读），
+另有进程不断持有较长的读事务（类似导出、生成过程中一直占着数据库连接），
+分别在默认配置（回滚日志，SQLITE_TUNING=false）和调优配置（WAL 等）下运行，对比延迟、吞吐和锁冲突。
+
+在临时数据库上运行，不影响 db/easyanimate.db：
+    python tests/bench_sqlite_contention.py
+    python tests/bench_sqlite_contention.py --writers 6 --readers 3 --duration 15 --hold-ms 500
+    python tests/bench_sqlite_contention.py --mode tuned
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import tempfile
+import warnings
+import argparse
+import multiprocessing
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+CATEGORIES = ['物理', '化学', '数学', '生物', '其他']
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fmt_ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else '-'
+
+
+def load_app(db_path: str, tuned: bool):
+    """在当前（子）进程中按指定配置创建后端，配置在导入时读取，必须在导入 app 之前设置环境变量"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['CONFIG_VERSION_FILE'] = f'{db_path}.config.version'
+    os.environ['SQLITE_TUNING'] = 'true' if tuned else 'false'
+    # 每个进程都会启动一次后端，关闭启动日志和请求中的错误堆栈（错误单独计数）
+    logging.disable(logging.ERROR)
+    warnings.filterwarnings('ignore')
+    from app import app
+    return app
+
+
+def seed(db_path: str, users: int, animations: int):
+    """用默认配置（回滚日志）建库并造数据，两种模式都从这份数据开始"""
+    app = load_app(db_path, tuned=False)
+    from models import db, User, Animation
+    with app.app_context():
+        for i in range(users):
+            user = User(username=f'bench_user{i}', email=f'bench_user{i}@example.com')
+            user.password_hash = 'x'
+            db.session.add(user)
+        db.session.flush()
+        user_ids = [u.id for u in User.query.filter(User.username.like('bench_user%')).all()]
+        for i in range(animations):
+            db.session.add(Animation(
+                title=f'压测动画 {i}', description='并发争用压测', prompt=f'压测动画 {i}',
+                category=CATEGORIES[i % len(CATEGORIES)], is_public=True, user_id=user_ids[i % len(user_ids)],
+                svg_content='<svg xmlns="http://www.w3.org/2000/svg">' + '<rect/>' * 200 + '</svg>'
+            ))
+        db.session.commit()
+
+
+def worker(role: str, db_path: str, tuned: bool, duration: float, hold_ms: int, barrier, results):
+    random.seed(os.getpid())
+    latencies, errors, operations = [], 0, 0
+    app = load_app(db_path, tuned)
+    from flask_jwt_extended import create_access_token
+    from models import User, Animation
+    with app.app_context():
+        tokens = [create_access_token(identity=str(u.id)) for u in User.query.all()]
+        animation_ids = [a.id for a in Animation.query.with_entities(Animation.id).all()]
+    client = app.test_client()
+
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == 'writer':
+                r = client.post(f'/api/community/animations/{random.choice(animation_ids)}/like',
+                                headers={'Authorization': f'Bearer {random.choice(tokens)}'})
+                ok = r.status_code < 500
+            elif role == 'reader':
+                r = client.get(f'/api/community/animations?category={random.choice(CATEGORIES)}')
+                ok = r.status_code < 500
+            else:
+                # 长读事务：逐行慢慢读出全部动画内容后才结束事务
+                conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+                conn.execute('BEGIN')
+                rows = conn.execute('SELECT animation_id, svg_content FROM animation_contents')
+                for _ in rows:
+                    if time.perf_counter() - started > hold_ms / 1000:
+                        break
+                time.sleep(max(0.0, hold_ms / 1000 - (time.perf_counter() - started)))
+                conn.execute('COMMIT')
+                conn.close()
+                ok = True
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        operations += 1
+        if not ok:
+            errors += 1
+        if role == 'holder':
+            time.sleep(0.02)
+    results.put({'role': role, 'latencies': latencies, 'errors': errors, 'operations': operations})
+
+
+def run(mode: str, template: str, workdir: str, args) -> dict:
+    tuned = mode == 'tuned'
+    db_path = os.path.join(workdir, f'{mode}.db')
+    shutil.copyfile(template, db_path)
+
+    ctx = multiprocessing.get_context('fork')
+    roles = ['writer'] * args.writers + ['reader'] * args.readers + ['holder'] * args.holders
+    barrier = ctx.Barrier(len(roles))
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(role, db_path, tuned, args.duration, args.hold_ms, barrier, results))
+                 for role in roles]
+    for p in processes:
+        p.start()
+    collected = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    summary = {'mode': mode}
+    for role in ('writer', 'reader', 'holder'):
+        items = [c for c in collected if c['role'] == role]
+        latencies = [v for c in items for v in c['latencies']]
+        summary[role] = {
+            'operations': sum(c['operations'] for c in items),
+            'errors': sum(c['errors'] for c in items),
+            'throughput': sum(c['operations'] for c in items) / args.duration,
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        }
+    journal = sqlite3.connect(db_path).execute('PRAGMA journal_mode').fetchone()[0]
+    wal_file = f'{db_path}-wal'
+    summary['journal_mode'] = journal
+    summary['wal_bytes'] = os.path.getsize(wal_file) if os.path.exists(wal_file) else 0
+    return summary
+
+
+def report(summary: dict):
+    print(f"\n📊 {summary['mode']}（journal_mode={summary['journal_mode']}，WAL {summary['wal_bytes'] // 1024}KB）")
+    print(f"   {'':<6}{'ops':>8}{'errors':>8}{'ops/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for role, label in (('writer', '点赞'), ('reader', '列表'), ('holder', '长读')):
+        s = summary[role]
+        if not s['operations']:
+            continue
+        print(f"   {label:<4}{s['operations']:>8}{s['errors']:>8}{s['throughput']:>9.1f}"
+              f"{fmt_ms(s['p50']):>9}{fmt_ms(s['p95']):>9}{fmt_ms(s['p99']):>9}{fmt_ms(s['max']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 并发争用压测')
+    parser.add_argument('--mode', choices=['both', 'baseline', 'tuned'], default='both')
+    parser.add_argument('--writers', type=int, default=4, help='点赞进程数')
+    parser.add_argument('--readers', type=int, default=2, help='社区列表进程数')
+    parser.add_argument('--holders', type=int, default=1, help='持有长读事务的进程数')
+    parser.add_argument('--hold-ms', type=int, default=300, help='每次长读事务持续的时间')
+    parser.add_argument('--duration', type=float, default=10, help='每种配置的压测时长（秒）')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--animations', type=int, default=300)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🗄️ SQLite 并发争用压测")
+    print(f"   点赞 {args.writers} 进程、列表 {args.readers} 进程、长读 {args.holders} 进程（{args.hold_ms}ms），"
+          f"每种配置 {args.duration:.0f}s")
+    print("=" * 70)
+
+    workdir = tempfile.mkdtemp(prefix='easyanimate-contention-')
+    try:
+        template = os.path.join(workdir, 'template.db')
+        ctx = multiprocessing.get_context('fork')
+        p = ctx.Process(target=seed, args=(template, args.users, args.animations))
+        p.start()
+        p.join()
+        if p.exitcode != 0:
+            print("❌ 造数据失败")
+            sys.exit(1)
+
+        modes = ['baseline', 'tuned'] if args.mode == 'both' else [args.mode]
+        summaries = [run(mode, template, workdir, args) for mode in modes]
+        for summary in summaries:
+            report(summary)
+
+        if len(summaries) == 2:
+            baseline, tuned = summaries
+            print("\n📈 调优后对比默认配置")
+            for role, label in (('writer', '点赞'), ('reader', '列表')):
+                b, t = baseline[role], tuned[role]
+                if b['throughput'] and t['p95'] and b['p95']:
+                    print(f"   {label}: 吞吐 x{t['throughput'] / b['throughput']:.1f}，"
+                          f"p95 {fmt_ms(b['p95'])} → {fmt_ms(t['p95'])}，错误 {b['errors']} → {t['errors']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
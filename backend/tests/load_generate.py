@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+生成链路压测：N 个并发的 /generate-stream 会话打到离线模拟 Provider 上
+报告端到端延迟（首个事件、完成）、吞吐、并发饱和度和数据库争用情况。
+
+默认在进程内启动后端（临时数据库 + 多线程 WSGI 服务器），可统计数据库语句耗时和锁冲突：
+    python tests/load_generate.py --sessions 40 --concurrency 20 --ttft-ms 500 --tps 120
+压测已部署的后端（如 gunicorn 多 worker），后端需设置 CLAUDE_API_BASE_URL 指向本脚本启动的模拟 Provider：
+    CLAUDE_API_BASE_URL=http://127.0.0.1:8901/v1 CLAUDE_API_KEY=mock gunicorn -w 4 -k gthread --threads 8 app:app
+    python tests/load_generate.py --target http://127.0.0.1:5000 --mock-port 8901 --sessions 40 --concurrency 20
+SVG 优化后的渲染校验默认关闭；设置 SVG_OPTIMIZE_VERIFY=true 时需要安装 Playwright 浏览器
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from mock_provider import add_arguments, provider_from_args
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def fmt_ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else '-'
+
+
+class DBProbe:
+    """进程内模式：通过 SQLAlchemy 引擎事件统计语句耗时和锁冲突"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.lock = threading.Lock()
+        self.reads = []
+        self.writes = []
+        self.locked_errors = 0
+        self.other_errors = 0
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('probe_started', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['probe_started'].pop()
+        is_read = statement.lstrip().upper().startswith(('SELECT', 'PRAGMA'))
+        with self.lock:
+            (self.reads if is_read else self.writes).append(elapsed)
+
+    def _error(self, context):
+        started = context.connection.info.get('probe_started') if context.connection is not None else None
+        if started:
+            started.pop()
+        with self.lock:
+            if 'locked' in str(context.original_exception).lower():
+                self.locked_errors += 1
+            else:
+                self.other_errors += 1
+
+
+class Sampler:
+    """定时采样进行中的会话数、上游并发和线程数，衡量饱和度"""
+
+    def __init__(self, provider, interval: float = 0.05):
+        self.provider = provider
+        self.interval = interval
+        self.active = 0
+        self.samples = []
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def session(self, delta: int):
+        with self.lock:
+            self.active += delta
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.provider._lock:
+                upstream = self.provider.stats['in_flight']
+            self.samples.append((self.active, upstream, threading.active_count()))
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        active, upstream, threads = zip(*self.samples)
+        return {
+            'peak_sessions': max(active),
+            'avg_sessions': sum(active) / len(active),
+            'peak_upstream': max(upstream),
+            'avg_upstream': sum(upstream) / len(upstream),
+            'peak_threads': max(threads),
+        }
+
+
+def start_local_backend(mock_url: str, port: int):
+    """在临时目录中启动进程内后端，返回 (base_url, app, server, 临时目录)"""
+    workdir = tempfile.mkdtemp(prefix='easyanimate-load-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ['CONFIG_VERSION_FILE'] = os.path.join(workdir, 'config.version')
+    os.environ['CLAUDE_API_BASE_URL'] = mock_url
+    os.environ['CLAUDE_API_KEY'] = os.environ.get('CLAUDE_API_KEY') or 'mock'
+
+    from werkzeug.serving import make_server
+    from app import app
+    from services.ai_service import ai_service
+    # ai_service 在导入 mock_provider 时已经创建，直接指向模拟 Provider
+    ai_service.base_url = mock_url
+    ai_service.api_key = os.environ['CLAUDE_API_KEY']
+
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", app, server, workdir
+
+
+def prepare_users(base_url: str, count: int, quota: int, admin_user: str, admin_password: str) -> list:
+    """注册压测用户并通过管理员接口设置配额，返回 token 列表"""
+    r = requests.post(f"{base_url}/api/auth/login", json={'username': admin_user, 'password': admin_password}, timeout=30)
+    r.raise_for_status()
+    admin_headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+
+    tokens = []
+    run_id = uuid.uuid4().hex[:6]
+    for i in range(count):
+        name = f"load_{run_id}_{i}"
+        r = requests.post(f"{base_url}/api/auth/register",
+                          json={'username': name, 'email': f"{name}@load.test", 'password': 'load-test'}, timeout=30)
+        r.raise_for_status()
+        body = r.json()
+        requests.put(f"{base_url}/api/admin/users/{body['user']['id']}/quota", json={'quota': quota},
+                     headers=admin_headers, timeout=30).raise_for_status()
+        tokens.append(body['access_token'])
+    return tokens
+
+
+def run_session(base_url: str, token: str, prompt: str, sampler: Sampler, timeout: float) -> dict:
+    result = {'status': None, 'outcome': 'error', 'first_event': None, 'total': None, 'events': 0, 'message': ''}
+    started = time.perf_counter()
+    sampler.session(1)
+    try:
+        with requests.post(f"{base_url}/api/animations/generate-stream",
+                           json={'prompt': prompt, 'duration': 30},
+                           headers={'Authorization': f"Bearer {token}"},
+                           stream=True, timeout=timeout) as r:
+            result['status'] = r.status_code
+            if r.status_code != 200:
+                result['message'] = r.text[:200]
+                return result
+            for line in r.iter_lines():
+                if not line or not line.startswith(b'data: '):
+                    continue
+                if result['first_event'] is None:
+                    result['first_event'] = time.perf_counter() - started
+                result['events'] += 1
+                event = json.loads(line[6:])
+                if event['type'] in ('complete', 'error'):
+                    result['outcome'] = event['type']
+                    result['message'] = event.get('message', '')
+    except requests.RequestException as e:
+        result['message'] = str(e)
+    finally:
+        result['total'] = time.perf_counter() - started
+        sampler.session(-1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成链路压测（离线模拟 Provider）')
+    parser.add_argument('--sessions', type=int, default=20, help='总会话数')
+    parser.add_argument('--concurrency', type=int, default=10, help='同时进行的会话数')
+    parser.add_argument('--target', help='已部署后端的地址；为空时在进程内启动后端')
+    parser.add_argument('--port', type=int, default=0, help='进程内后端端口（0 为随机）')
+    parser.add_argument('--mock-host', default='127.0.0.1')
+    parser.add_argument('--mock-port', type=int, default=0, help='模拟 Provider 端口（0 为随机）')
+    parser.add_argument('--same-prompt', action='store_true', help='所有会话使用同一用户和提示词（测试重复请求合并）')
+    parser.add_argument('--timeout', type=float, default=300, help='单个会话超时（秒）')
+    parser.add_argument('--admin-user', default='admin')
+    parser.add_argument('--admin-password', default='admin123')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    provider = provider_from_args(args)
+    mock_host, mock_port = provider.start(args.mock_host, args.mock_port)
+    mock_url = f"http://{mock_host}:{mock_port}/v1"
+
+    probe = None
+    workdir = None
+    server = None
+    if args.target:
+        base_url = args.target.rstrip('/')
+    else:
+        base_url, app, server, workdir = start_local_backend(mock_url, args.port)
+        from models import db
+        with app.app_context():
+            probe = DBProbe(db.engine)
+
+    print("=" * 70)
+    print("🏋️ 生成链路压测")
+    print("=" * 70)
+    print(f"  后端: {base_url}{'（进程内）' if not args.target else ''}")
+    print(f"  模拟 Provider: {mock_url}")
+    print(f"  会话: {args.sessions}, 并发: {args.concurrency}, TTFT={args.ttft_ms}ms, {args.tps} tokens/s, "
+          f"截断={args.truncate_rate}, 错误={args.error_rate}")
+
+    user_count = 1 if args.same_prompt else args.concurrency
+    tokens = prepare_users(base_url, user_count, args.sessions + 10, args.admin_user, args.admin_password)
+    prompts = [
+        '单摆运动' if args.same_prompt else f'压测动画 {i}：演示单摆运动的周期与摆长的关系'
+        for i in range(args.sessions)
+    ]
+
+    sampler = Sampler(provider)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda i: run_session(base_url, tokens[i % len(tokens)], prompts[i], sampler, args.timeout),
+            range(args.sessions)
+        ))
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    completed = [r for r in results if r['outcome'] == 'complete']
+    errors = {}
+    for r in results:
+        if r['outcome'] != 'complete':
+            key = f"{r['status']} {r['message'][:60]}"
+            errors[key] = errors.get(key, 0) + 1
+    totals = [r['total'] for r in completed]
+    firsts = [r['first_event'] for r in results if r['first_event'] is not None]
+    report = {
+        'sessions': args.sessions,
+        'completed': len(completed),
+        'failed': args.sessions - len(completed),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_min': round(len(completed) / elapsed * 60, 1) if elapsed else None,
+        'first_event_ms': {p: round(percentile(firsts, q) * 1000) if firsts else None
+                           for p, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'total_ms': {p: round(percentile(totals, q) * 1000) if totals else None
+                     for p, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'saturation': sampler.summary(),
+        'provider': dict(provider.stats),
+    }
+    if probe:
+        report['db'] = {
+            'reads': len(probe.reads),
+            'writes': len(probe.writes),
+            'read_p95_ms': round(percentile(probe.reads, 0.95) * 1000, 2) if probe.reads else None,
+            'write_p95_ms': round(percentile(probe.writes, 0.95) * 1000, 2) if probe.writes else None,
+            'write_max_ms': round(max(probe.writes) * 1000, 2) if probe.writes else None,
+            'locked_errors': probe.locked_errors,
+            'other_errors': probe.other_errors,
+        }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print("\n📊 结果")
+        print("-" * 70)
+        print(f"  完成: {report['completed']}/{args.sessions}, 耗时 {report['elapsed_s']}s, "
+              f"吞吐 {report['throughput_per_min']} 个/分钟")
+        for key, count in errors.items():
+            print(f"  ❌ {count} 个失败: {key}")
+        print(f"  首个事件: p50={fmt_ms(percentile(firsts, 0.5))}, p95={fmt_ms(percentile(firsts, 0.95))}, "
+              f"p99={fmt_ms(percentile(firsts, 0.99))}")
+        print(f"  端到端:   p50={fmt_ms(percentile(totals, 0.5))}, p95={fmt_ms(percentile(totals, 0.95))}, "
+              f"p99={fmt_ms(percentile(totals, 0.99))}")
+        saturation = report['saturation']
+        if saturation:
+            print(f"  饱和度: 会话峰值 {saturation['peak_sessions']}（均值 {saturation['avg_sessions']:.1f}）, "
+                  f"上游并发峰值 {saturation['peak_upstream']}（均值 {saturation['avg_upstream']:.1f}）, "
+                  f"线程峰值 {saturation['peak_threads']}")
+        stats = report['provider']
+        print(f"  Provider: {stats['requests']} 个请求, 截断 {stats['truncated']}, 续写 {stats['continuations']}, "
+              f"注入错误 {stats['errors_injected']}")
+        if probe:
+            db_report = report['db']
+            print(f"  数据库: 读 {db_report['reads']} 次（p95 {db_report['read_p95_ms']}ms）, "
+                  f"写 {db_report['writes']} 次（p95 {db_report['write_p95_ms']}ms, 最大 {db_report['write_max_ms']}ms）, "
+                  f"锁冲突 {db_report['locked_errors']}, 其他错误 {db_report['other_errors']}")
+        print("=" * 70)
+
+    if server:
+        server.shutdown()
+    provider.stop()
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
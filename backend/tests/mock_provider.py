@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""
+离线模拟 LLM Provider（OpenAI 兼容的 /chat/completions）
+用于在没有网络、不消耗 token 的情况下压测和调试生成链路：
+- 流式 / 非流式响应，最后一个 chunk 返回 usage（stream_options.include_usage）
+- 可配置首 token 延迟（TTFT）和输出速度（tokens/s）
+- 按比例注入截断（finish_reason=length）和上游错误（HTTP 500/429）
+- 截断后的续写请求（assistant 前缀 + 续写指令）返回剩余内容，可测试续写拼接
+- 可回放录制的 SSE 流（*.sse，原始的 "data: {...}" 行），按录制时的 chunk 边界重新按速度输出
+
+启动：
+    python tests/mock_provider.py --port 8901 --ttft-ms 500 --tps 80 --truncate-rate 0.1 --error-rate 0.05
+后端指向模拟服务：
+    CLAUDE_API_BASE_URL=http://127.0.0.1:8901/v1 CLAUDE_API_KEY=mock python app.py
+录制真实的流（用于回放）：
+    curl -N $CLAUDE_API_BASE_URL/chat/completions -H "Authorization: Bearer $KEY" -H "Content-Type: application/json" \\
+         -d '{"model": "...", "stream": true, "messages": [...]}' > recordings/pendulum.sse
+"""
+import os
+import sys
+import json
+import time
+import glob
+import random
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.prompts import CONTINUE_PROMPT
+from services.ai_service import estimate_tokens, message_text
+
+
+def load_recording(path: str) -> list:
+    """从录制的 SSE 文件中取出每个 chunk 的文本增量"""
+    chunks = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('data: ') or line == 'data: [DONE]':
+                continue
+            try:
+                data = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            for choice in data.get('choices') or []:
+                piece = (choice.get('delta') or {}).get('content')
+                if piece:
+                    chunks.append(piece)
+    return chunks
+
+
+def synthesize_animation(prompt: str, elements: int = 40) -> str:
+    """按提示词合成一个结构合法、体积接近真实输出的动画 JSON"""
+    rng = random.Random(zlib.crc32(prompt.encode('utf-8')))
+    shapes = []
+    for i in range(elements):
+        shapes.append(
+            f'<circle id="c{i}" cx="{rng.randint(50, 750)}" cy="{rng.randint(100, 450)}" r="{rng.randint(5, 30)}" '
+            f'fill="#6366f1" style="animation: pulse {rng.randint(2, 6)}s ease-in-out infinite"/>'
+        )
+    svg = (
+        '<svg viewBox="0 0 800 600" xmlns="http://www.w3.org/2000/svg"><defs><style>'
+        '@keyframes pulse { 0%, 100% { opacity: 1; transform: scale(1); } 50% { opacity: 0.5; transform: scale(1.2); } }'
+        '.title { font-size: 26px; fill: #e2e8f0; text-anchor: middle; }'
+        '</style></defs><rect width="800" height="600" fill="#0f172a"/>'
+        f'<text x="400" y="50" class="title">{prompt[:20]}</text>{"".join(shapes)}</svg>'
+    )
+    return json.dumps({
+        'title': prompt[:20],
+        'description': f'模拟生成：{prompt}',
+        'category': '其他',
+        'svg_content': svg,
+        'animation_data': {'duration': 30, 'width': 800, 'height': 600}
+    }, ensure_ascii=False)
+
+
+def split_chunks(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class MockProvider:
+    def __init__(self, ttft_ms: int = 300, tokens_per_second: float = 80, chunk_chars: int = 16,
+                 truncate_rate: float = 0.0, error_rate: float = 0.0, error_status: int = 500,
+                 recordings: str = None, elements: int = 40, seed: int = None):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.chunk_chars = chunk_chars
+        self.truncate_rate = truncate_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.elements = elements
+        self.recordings = [load_recording(p) for p in sorted(glob.glob(os.path.join(recordings, '*.sse')))] \
+            if recordings else []
+        self.recordings = [r for r in self.recordings if r]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'streams': 0, 'in_flight': 0, 'peak_in_flight': 0,
+                      'errors_injected': 0, 'truncated': 0, 'continuations': 0}
+        self._server = None
+
+    # ============ 内容 ============
+
+    def _chunks_for(self, messages: list) -> list:
+        """同一提示词总是得到相同的内容（续写请求据此计算剩余部分）"""
+        prompt = message_text(messages[-1]) if messages else ''
+        if self.recordings:
+            return self.recordings[zlib.crc32(prompt.encode('utf-8')) % len(self.recordings)]
+        return split_chunks(synthesize_animation(prompt, self.elements), self.chunk_chars)
+
+    def plan(self, payload: dict) -> tuple:
+        """返回 (要输出的 chunk 列表, finish_reason)"""
+        messages = payload.get('messages') or []
+        is_continuation = len(messages) >= 3 and messages[-2].get('role') == 'assistant' \
+            and message_text(messages[-1]) == CONTINUE_PROMPT
+        if is_continuation:
+            self._count('continuations')
+            full = ''.join(self._chunks_for(messages[:-2]))
+            partial = message_text(messages[-2])
+            rest = full[len(partial):] if full.startswith(partial) else ''
+            return split_chunks(rest, self.chunk_chars), 'stop'
+
+        chunks = self._chunks_for(messages)
+        if len(chunks) > 2 and self._chance(self.truncate_rate):
+            self._count('truncated')
+            return chunks[:self._rng.randint(len(chunks) // 3, len(chunks) * 2 // 3)], 'length'
+        return chunks, 'stop'
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return self._rng.random() < rate
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self.stats[key] += delta
+            if key == 'in_flight':
+                self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+
+    def usage(self, messages: list, content: str) -> dict:
+        prompt_tokens = sum(estimate_tokens(message_text(m)) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens}
+
+    def chunk_delay(self, piece: str) -> float:
+        return estimate_tokens(piece) / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+    # ============ HTTP ============
+
+    def start(self, host: str = '127.0.0.1', port: int = 8901):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/stats'):
+                    with provider._lock:
+                        self._send_json(200, dict(provider.stats))
+                else:
+                    self._send_json(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except json.JSONDecodeError:
+                    self._send_json(400, {'error': {'message': 'invalid json'}})
+                    return
+
+                provider._count('requests')
+                provider._count('in_flight')
+                try:
+                    if provider._chance(provider.error_rate):
+                        provider._count('errors_injected')
+                        time.sleep(provider.ttft_ms / 1000)
+                        self._send_json(provider.error_status, {'error': {'message': 'mock injected error', 'type': 'mock'}})
+                    elif payload.get('stream'):
+                        provider._count('streams')
+                        self._stream(payload)
+                    else:
+                        self._complete(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端（后端）提前关闭了上游连接
+                    pass
+                finally:
+                    provider._count('in_flight', -1)
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _complete(self, payload: dict):
+                chunks, finish_reason = provider.plan(payload)
+                content = ''.join(chunks)
+                time.sleep(provider.ttft_ms / 1000 + provider.chunk_delay(content))
+                self._send_json(200, {
+                    'id': 'mock-completion',
+                    'object': 'chat.completion',
+                    'model': payload.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': finish_reason}],
+                    'usage': provider.usage(payload.get('messages') or [], content)
+                })
+
+            def _event(self, body):
+                data = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+                line = f"data: {data}\n\n".encode('utf-8')
+                # 分块传输编码，每个 SSE 事件一个块
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, payload: dict):
+                chunks, finish_reason = provider.plan(payload)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                time.sleep(provider.ttft_ms / 1000)
+                for piece in chunks:
+                    self._event({'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+                    time.sleep(provider.chunk_delay(piece))
+                self._event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}]})
+                if (payload.get('stream_options') or {}).get('include_usage'):
+                    self._event({'choices': [], 'usage': provider.usage(payload.get('messages') or [], ''.join(chunks))})
+                self._event('[DONE]')
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--ttft-ms', type=int, default=300, help='首 token 延迟（毫秒）')
+    parser.add_argument('--tps', type=float, default=80, help='输出速度（tokens/s），0 表示不限速')
+    parser.add_argument('--chunk-chars', type=int, default=16, help='合成内容每个 chunk 的字符数')
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help='截断（finish_reason=length）比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='上游错误比例')
+    parser.add_argument('--error-status', type=int, default=500, help='注入错误的 HTTP 状态码')
+    parser.add_argument('--recordings', help='录制的 *.sse 文件目录，为空时合成内容')
+    parser.add_argument('--elements', type=int, default=40, help='合成SVG的元素数量（控制输出体积）')
+    parser.add_argument('--seed', type=int, help='随机种子（截断、错误注入可复现）')
+
+
+def provider_from_args(args) -> MockProvider:
+    return MockProvider(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tps,
+        chunk_chars=args.chunk_chars,
+        truncate_rate=args.truncate_rate,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        recordings=args.recordings,
+        elements=args.elements,
+        seed=args.seed
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线模拟 LLM Provider')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    provider = provider_from_args(args)
+    host, port = provider.start(args.host, args.port)
+    print("=" * 70)
+    print(f"🧪 模拟 Provider 已启动: http://{host}:{port}/v1")
+    print(f"   TTFT={args.ttft_ms}ms, {args.tps} tokens/s, 截断={args.truncate_rate}, 错误={args.error_rate}, "
+          f"录制={len(provider.recordings)} 个")
+    print(f"   统计: http://{host}:{port}/v1/stats")
+    print("=" * 70)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        provider.stop()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+模型输出 JSON 解析测试：前后带说明文字、代码块包裹、字符串中的转义、截断后的修复。
+不需要数据库和网络：
+    python tests/test_json_repair.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_repair import parse_model_json
+
+# (说明, 模型输出, 是否截断, 期望结果)
+CASES = [
+    ('前后带说明文字',
+     'Here is the result: {"title": "x", "svg_content": "<svg/>"} done', False,
+     {'title': 'x', 'svg_content': '<svg/>'}),
+    ('说明文字 + 字符串中的 \\uXXXX 转义',
+     '结果如下：{"title": "\\u6f14\\u793a", "svg_content": "<svg/>"} 以上', False,
+     {'title': '演示', 'svg_content': '<svg/>'}),
+    ('字符串中的转义引号和反斜杠',
+     '说明 {"title": "a \\"b\\" \\\\", "n": 1} 结束', False,
+     {'title': 'a "b" \\', 'n': 1}),
+    ('代码块包裹',
+     '```json\n{"title": "x"}\n```', False,
+     {'title': 'x'}),
+    ('截断在转义的反斜杠之后',
+     '{"title": "x\\\\', True,
+     {'title': 'x\\'}),
+    ('截断在单独的反斜杠处',
+     '{"title": "x\\', True,
+     {'title': 'x'}),
+    ('截断在 \\uXXXX 中间',
+     '{"title": "x\\u6f', True,
+     {'title': 'x'}),
+    ('截断在完整的 \\uXXXX 之后',
+     '{"title": "x\\u6f14', True,
+     {'title': 'x演'}),
+]
+
+
+def main():
+    failures = 0
+    for name, content, truncated, expected in CASES:
+        try:
+            result = parse_model_json(content, truncated=truncated)
+        except Exception as e:
+            result = f'{type(e).__name__}: {e}'
+        if result == expected:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}: 期望 {expected!r}，实际 {result!r}")
+
+    print("\n" + "=" * 70)
+    if failures:
+        print(f"❌ {failures}/{len(CASES)} 个用例失败")
+        print("=" * 70)
+        sys.exit(1)
+    print(f"✅ 全部 {len(CASES)} 个用例通过")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
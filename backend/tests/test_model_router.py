@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+模型路由难度估算测试：分类推断、并列知识点的拆分（词语中的和/与/及不算分隔）。
+不需要数据库和网络：
+    python tests/test_model_router.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.model_router import model_router, DEFAULT_POLICY
+
+# (说明, 提示词, 期望的分类, 期望的难度分)
+CASES = [
+    ('词语中的“和”', '和平鸽飞翔', '其他', 0),
+    ('词语中的和/与/及', '和平鸽与其说及时飞翔和睦相处', '其他', 0),
+    ('标点分隔的四个知识点', '力学、光学、电路、磁场', '物理', 1),
+    ('“以及”分隔', '函数，几何，方程以及概率', '数学', 1),
+    ('三个知识点不加分', '细胞、基因、遗传', '生物', 0),
+]
+
+
+def main():
+    policy = dict(DEFAULT_POLICY, category_weights={})
+    failures = 0
+    for name, prompt, category, score in CASES:
+        _, actual_category, actual_score = model_router.difficulty(prompt, 0, {}, policy)
+        if (actual_category, actual_score) == (category, score):
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}: 期望 ({category}, {score})，实际 ({actual_category}, {actual_score})")
+
+    print("\n" + "=" * 70)
+    if failures:
+        print(f"❌ {failures}/{len(CASES)} 个用例失败")
+        print("=" * 70)
+        sys.exit(1)
+    print(f"✅ 全部 {len(CASES)} 个用例通过")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
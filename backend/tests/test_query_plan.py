@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+查询计划测试：调用社区、个人主页、管理后台等列表/详情接口，
+对每条执行过的 SQL 运行 EXPLAIN QUERY PLAN，确认没有全表扫描和临时 B-tree 排序。
+
+在临时数据库上运行，不影响 db/easyanimate.db：
+    python tests/test_query_plan.py
+    python tests/test_query_plan.py -v        # 打印每条语句的查询计划
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+workdir = tempfile.mkdtemp(prefix='easyanimate-plan-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'plan.db')}"
+os.environ['CONFIG_VERSION_FILE'] = os.path.join(workdir, 'config.version')
+
+from sqlalchemy import event, inspect
+from app import app
+from models import db, User, Animation, Like, Favorite
+from services.sqlite_tuning import sqlite_tuning
+
+VERBOSE = '-v' in sys.argv
+
+# 允许的例外：(语句匹配的正则, 计划中允许出现的内容, 原因)
+ALLOWED = [
+    (r'^SELECT count\(\*\) AS count_1\s+FROM (users|animations)\s*$', 'SCAN',
+     '管理后台统计总数，本身需要遍历整张表（SQLite 会选择最小的覆盖索引）'),
+    (r'ORDER BY search_ranked\.rank', 'USE TEMP B-TREE FOR ORDER BY',
+     '搜索按相关度排序，只对全文索引匹配到的动画排序'),
+    (r'^UPDATE animations SET updated_at=animations\.updated_at, likes_count=\(SELECT', 'SCAN animations',
+     '全量计数修复（启动时、管理员手动触发）本身需要遍历所有动画'),
+    (r'^SELECT (likes|favorites)\.animation_id, \1\.created_at\s+FROM \1\s+WHERE \1\.created_at >= \?$', 'SCAN',
+     '重建排行（管理员手动触发）按最近所有的点赞、收藏计算热度'),
+    (r'FROM category_counts\s+WHERE category_counts\.public_count', 'SCAN category_counts',
+     '分类计数表每个分类一行，读取全部分类'),
+    (r'^SELECT coalesce\(sum\(daily_stats\.', 'SCAN daily_stats',
+     '后台统计总数为每日汇总之和，每天一行，与数据量无关'),
+    (r'GROUP BY date\((\w+)\.created_at\)$', 'SCAN',
+     '回填统计汇总（首次部署、管理员手动触发）本身需要按天统计全部数据'),
+    (r'GROUP BY date\((\w+)\.created_at\)$', 'USE TEMP B-TREE FOR GROUP BY',
+     '回填统计汇总按天分组，日期由 created_at 计算得出，没有对应的索引'),
+]
+
+# 需要检查的接口：(说明, 方法, 路径, 身份：None 匿名 / user 普通用户 / admin 管理员)
+ROUTES = [
+    ('社区列表', 'GET', '/api/community/animations', None),
+    ('社区列表-分类', 'GET', '/api/community/animations?category=物理', None),
+    ('社区列表-总数', 'GET', '/api/community/animations?per_page=5&include_total=1', None),
+    ('社区列表-搜索', 'GET', '/api/community/animations?search=动画', None),
+    ('社区列表-分类搜索', 'GET', '/api/community/animations?category=物理&search=测试 3', None),
+    ('社区详情', 'GET', '/api/community/animations/{public_id}', None),
+    ('社区列表-热门', 'GET', '/api/community/animations?sort=trending&per_page=5', None),
+    ('社区列表-分类热门', 'GET', '/api/community/animations?sort=trending&category=物理&per_page=5', None),
+    ('社区列表-最多赞', 'GET', '/api/community/animations?sort=top&per_page=5', None),
+    ('社区列表-分类最多赞', 'GET', '/api/community/animations?sort=top&category=物理&per_page=5', None),
+    ('精选', 'GET', '/api/community/featured', None),
+    ('分类', 'GET', '/api/community/categories', None),
+    ('点赞', 'POST', '/api/community/animations/{public_id}/like', 'user'),
+    ('取消点赞', 'POST', '/api/community/animations/{public_id}/like', 'user'),
+    ('收藏', 'POST', '/api/community/animations/{public_id}/favorite', 'user'),
+    ('我的收藏', 'GET', '/api/community/favorites?per_page=3', 'user'),
+    ('我的动画', 'GET', '/api/animations/?per_page=3', 'user'),
+    ('动画详情', 'GET', '/api/animations/{own_id}', 'user'),
+    ('取消公开', 'POST', '/api/animations/{own_id}/unpublish', 'user'),
+    ('发布', 'POST', '/api/animations/{own_id}/publish', 'user'),
+    ('个人信息', 'GET', '/api/auth/me', 'user'),
+    ('配额流水', 'GET', '/api/auth/me/quota', 'user'),
+    ('管理-用户列表', 'GET', '/api/admin/users?per_page=5', 'admin'),
+    ('管理-用户列表-按配额', 'GET', '/api/admin/users?sort_by=quota&per_page=5', 'admin'),
+    ('管理-用户列表-按用户名', 'GET', '/api/admin/users?sort_by=username&per_page=5', 'admin'),
+    ('管理-用户详情', 'GET', '/api/admin/users/{user_id}', 'admin'),
+    ('管理-动画列表', 'GET', '/api/admin/animations', 'admin'),
+    ('管理-动画搜索', 'GET', '/api/admin/animations?search=测试', 'admin'),
+    ('管理-统计', 'GET', '/api/admin/stats', 'admin'),
+    ('管理-统计-90天', 'GET', '/api/admin/stats?days=90', 'admin'),
+    ('管理-计数修复', 'POST', '/api/admin/maintenance/reconcile-counters', 'admin'),
+    ('管理-重建排行', 'POST', '/api/admin/maintenance/rebuild-rankings', 'admin'),
+    ('管理-重建分类计数', 'POST', '/api/admin/maintenance/rebuild-categories', 'admin'),
+    ('管理-回填统计汇总', 'POST', '/api/admin/maintenance/backfill-stats', 'admin'),
+]
+
+
+def seed():
+    """造一批用户、公开/私有动画、点赞和收藏，返回路径中用到的 id"""
+    categories = ['物理', '化学', '数学', '生物', '其他']
+    users = []
+    for i in range(20):
+        user = User(username=f'plan_user{i}', email=f'plan_user{i}@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        users.append(user)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    animations = []
+    for i in range(200):
+        animation = Animation(
+            title=f'测试动画 {i}', description='查询计划测试', prompt=f'测试动画 {i}',
+            category=categories[i % len(categories)], is_public=i % 3 != 0,
+            user_id=users[i % len(users)].id, created_at=now - timedelta(minutes=i),
+            svg_content='<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        )
+        db.session.add(animation)
+        animations.append(animation)
+    db.session.flush()
+
+    for i, user in enumerate(users):
+        for animation in animations[i::7][:10]:
+            db.session.add(Like(user_id=user.id, animation_id=animation.id))
+            db.session.add(Favorite(user_id=user.id, animation_id=animation.id,
+                                    created_at=now - timedelta(seconds=animation.id)))
+    db.session.commit()
+    Animation.reconcile_counters()
+    db.session.commit()
+
+    user = users[1]
+    return user, {
+        'public_id': next(a.id for a in animations if a.is_public),
+        'own_id': next(a.id for a in animations if a.user_id == user.id),
+        'user_id': user.id,
+    }
+
+
+def login(client, username, password):
+    r = client.post('/api/auth/login', json={'username': username, 'password': password})
+    return {'Authorization': 'Bearer ' + r.get_json()['access_token']}
+
+
+def problems_in(statement: str, plan: list, tables: set) -> list:
+    """返回计划中的问题：没有用索引的表扫描（全文索引的虚拟表除外）、为排序/分组建立的临时 B-tree"""
+    allowed = [pattern for regex, pattern, _ in ALLOWED if re.search(regex, statement.strip())]
+    problems = []
+    for detail in plan:
+        scan = re.match(r'SCAN (\w+)', detail)
+        if scan and scan.group(1) in tables and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+            problem = detail
+        elif 'USE TEMP B-TREE' in detail:
+            problem = detail
+        else:
+            continue
+        if not any(pattern in problem for pattern in allowed):
+            problems.append(problem)
+    return problems
+
+
+def main():
+    print("=" * 70)
+    print("🧭 查询计划测试")
+    print("=" * 70)
+
+    statements = []
+    with app.app_context():
+        user, ids = seed()
+        tables = set(inspect(db.engine).get_table_names())
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+                statements.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        # 列表接口走只读连接
+        if sqlite_tuning.read_engine is not None:
+            event.listen(sqlite_tuning.read_engine, 'before_cursor_execute', capture)
+
+    client = app.test_client()
+    headers = {
+        None: {},
+        'user': login(client, user.username, 'password'),
+        'admin': login(client, 'admin', 'admin123'),
+    }
+
+    # 列表接口再用返回的游标取下一页，检查带游标条件的查询
+    routes = []
+    for name, method, path, auth in ROUTES:
+        routes.append((name, method, path.format(**ids), auth))
+
+    failures = 0
+    checked = 0
+    while routes:
+        name, method, path, auth = routes.pop(0)
+        statements.clear()
+        r = client.open(path, method=method, headers=headers[auth])
+        if r.status_code >= 400:
+            print(f"❌ {name}: HTTP {r.status_code} {r.get_data(as_text=True)[:200]}")
+            failures += 1
+            continue
+        next_cursor = (r.get_json() or {}).get('next_cursor')
+        if next_cursor and 'cursor=' not in path:
+            separator = '&' if '?' in path else '?'
+            routes.insert(0, (f'{name}-下一页', method, f'{path}{separator}cursor={next_cursor}', auth))
+
+        with app.app_context():
+            with db.engine.connect() as conn:
+                route_problems = []
+                for statement, parameters in statements:
+                    plan = [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                    checked += 1
+                    problems = problems_in(statement, plan, tables)
+                    if problems:
+                        route_problems.append((statement, plan, problems))
+                    if VERBOSE:
+                        print(f"\n  {' '.join(statement.split())[:160]}")
+                        for detail in plan:
+                            print(f"    {detail}")
+
+        if route_problems:
+            failures += 1
+            print(f"❌ {name}: {len(route_problems)}/{len(statements)} 条语句未使用索引")
+            for statement, plan, problems in route_problems:
+                print(f"   {' '.join(statement.split())[:200]}")
+                for problem in problems:
+                    print(f"     → {problem}")
+        else:
+            print(f"✅ {name}: {len(statements)} 条语句")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    print("\n" + "=" * 70)
+    if failures:
+        print(f"❌ {failures} 个接口存在全表扫描或临时排序（共检查 {checked} 条语句）")
+        print("=" * 70)
+        sys.exit(1)
+    print(f"✅ 全部 {len(ROUTES)} 个接口（含下一页）的 {checked} 条语句均使用索引")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
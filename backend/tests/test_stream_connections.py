@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+生成流式接口的数据库连接测试：并发运行若干流式生成、批量生成、非流式生成和重复请求（模拟 Provider 输出较慢），
+记录连接池每次借出连接到归还的时长，确认等待模型输出期间没有连接被一直占用。
+
+在临时数据库上运行，不影响 db/easyanimate.db：
+    python tests/test_stream_connections.py
+    python tests/test_stream_connections.py --sessions 8 --tps 150 --max-hold-ms 500
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from mock_provider import MockProvider
+from load_generate import start_local_backend, prepare_users, percentile, fmt_ms
+
+
+class PoolProbe:
+    """通过连接池事件记录每个连接的借出时长，保留借出时的调用栈用于定位"""
+
+    def __init__(self, engines: list):
+        from sqlalchemy import event
+        self.lock = threading.Lock()
+        self.holds = []
+        self.checked_out = {}
+        self.peak = 0
+        for engine in engines:
+            event.listen(engine, 'checkout', self._checkout)
+            event.listen(engine, 'checkin', self._checkin)
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # 只保留后端代码中的调用位置
+        frames = [f for f in traceback.extract_stack()[:-1]
+                  if f.filename.startswith(BACKEND_DIR) and os.sep + 'tests' + os.sep not in f.filename]
+        stack = ''.join(traceback.format_list(frames[-6:]))
+        with self.lock:
+            self.checked_out[id(dbapi_connection)] = (time.perf_counter(), stack)
+            self.peak = max(self.peak, len(self.checked_out))
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            started = self.checked_out.pop(id(dbapi_connection), None)
+            if started:
+                self.holds.append((time.perf_counter() - started[0], started[1]))
+
+    def longest(self):
+        with self.lock:
+            now = time.perf_counter()
+            # 仍未归还的连接按当前时长计算
+            pending = [(now - started, stack) for started, stack in self.checked_out.values()]
+            return max(self.holds + pending, key=lambda h: h[0], default=(0, ''))
+
+
+def read_events(response) -> list:
+    import json
+    events = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith('data: '):
+            events.append(json.loads(line[6:]))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成流式接口的数据库连接测试')
+    parser.add_argument('--sessions', type=int, default=4, help='并发的流式生成数')
+    parser.add_argument('--ttft-ms', type=int, default=500)
+    parser.add_argument('--tps', type=float, default=300, help='模拟 Provider 每秒输出的 token 数')
+    parser.add_argument('--max-hold-ms', type=int, default=1000, help='单次借出连接允许的最长时间')
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🔌 生成流式接口数据库连接测试")
+    print("=" * 70)
+
+    os.environ.setdefault('SVG_OPTIMIZE_VERIFY', 'false')
+    provider = MockProvider(ttft_ms=args.ttft_ms, tokens_per_second=args.tps, seed=1)
+    mock_host, mock_port = provider.start(port=0)
+    mock_url = f"http://{mock_host}:{mock_port}/v1"
+    base_url, app, server, workdir = start_local_backend(mock_url, 0)
+
+    from models import db
+    from services.sqlite_tuning import sqlite_tuning
+    with app.app_context():
+        engines = [db.engine] + ([sqlite_tuning.read_engine] if sqlite_tuning.read_engine is not None else [])
+    tokens = prepare_users(base_url, args.sessions + 2, 20, 'admin', 'admin123')
+    probe = PoolProbe(engines)
+
+    def call(name, path, token, body):
+        started = time.perf_counter()
+        r = requests.post(f'{base_url}/api/animations/{path}', json=body, stream=True, timeout=300,
+                          headers={'Authorization': f'Bearer {token}'})
+        if r.headers.get('Content-Type', '').startswith('text/event-stream'):
+            events = read_events(r)
+            last = events[-1] if events else {}
+            ok = last.get('type') == 'complete' and last.get('failed', 0) == 0
+        else:
+            last = r.json()
+            ok = r.status_code == 200
+        return name, ok, time.perf_counter() - started, last
+
+    jobs = [(f'流式生成 {i}', 'generate-stream', tokens[i], {'prompt': f'连接测试动画 {i}', 'duration': 30})
+            for i in range(args.sessions)]
+    # 同一用户的相同请求：合并到第一次生成上
+    jobs.append(('重复请求', 'generate-stream', tokens[0], {'prompt': '连接测试动画 0', 'duration': 30}))
+    jobs.append(('批量生成', 'generate-batch', tokens[-2], {'prompt': '连接测试批量', 'variants': 2}))
+    jobs.append(('非流式生成', 'generate', tokens[-1], {'prompt': '连接测试非流式', 'duration': 30}))
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        results = list(pool.map(lambda job: call(*job), jobs))
+
+    failures = 0
+    for name, ok, elapsed, last in results:
+        if ok:
+            print(f"✅ {name}: {fmt_ms(elapsed)}")
+        else:
+            failures += 1
+            print(f"❌ {name}: {fmt_ms(elapsed)} {str(last)[:200]}")
+
+    holds = [h for h, _ in probe.holds]
+    longest, stack = probe.longest()
+    slowest_stream = max(elapsed for _, _, elapsed, _ in results)
+    print(f"\n   连接借出 {len(holds)} 次：p50 {fmt_ms(percentile(holds, 0.5))}，p95 {fmt_ms(percentile(holds, 0.95))}，"
+          f"最长 {fmt_ms(longest)}；同时借出峰值 {probe.peak}")
+    print(f"   最慢的请求 {fmt_ms(slowest_stream)}")
+
+    if longest * 1000 > args.max_hold_ms:
+        failures += 1
+        print(f"❌ 有连接被占用 {fmt_ms(longest)}（上限 {args.max_hold_ms}ms），借出位置：\n{stack}")
+    if slowest_stream * 1000 < args.max_hold_ms * 2:
+        failures += 1
+        print("❌ 生成过快，无法区分连接是否在流式输出期间被占用，请降低 --tps")
+
+    server.shutdown()
+    provider.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print("\n" + "=" * 70)
+    if failures:
+        print(f"❌ {failures} 项失败")
+        print("=" * 70)
+        sys.exit(1)
+    print("✅ 流式生成期间没有长时间占用数据库连接")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+SVG 优化中的 CSS 压缩测试：选择器中的空白、声明中的冒号、@keyframes、重复和相邻规则的合并。
+不需要数据库和浏览器：
+    python tests/test_svg_optimizer.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.svg_optimizer import SVGOptimizer
+
+# (说明, 原始CSS, 期望结果)
+CASES = [
+    ('后代选择器中的伪类保留空白',
+     '.a :first-child { fill: red; }',
+     '.a :first-child{fill:red}'),
+    ('选择器的属性值中冒号后的空白',
+     '[data-label="a: b"] { fill: red; }',
+     '[data-label="a: b"]{fill:red}'),
+    ('伪类选择器和声明中冒号两侧的空白',
+     'circle:hover { fill : red ; }',
+     'circle:hover{fill:red}'),
+    ('@keyframes 中各帧的声明',
+     '@keyframes m { 0% { opacity : 1; } 100% { opacity: 0.5; } }',
+     '@keyframes m{0%{opacity:1}100%{opacity:0.5}}'),
+    ('注释和重复规则',
+     '/* c */ .a { fill: red; } .a {fill:red}',
+     '.a{fill:red}'),
+    ('声明相同的相邻规则合并选择器',
+     '.a { fill: red; }\n.b :last-child { fill:red }',
+     '.a,.b :last-child{fill:red}'),
+]
+
+
+def main():
+    optimizer = SVGOptimizer(verify=False)
+    failures = 0
+    for name, css, expected in CASES:
+        try:
+            result = optimizer._minify_css(css)
+        except Exception as e:
+            result = f'{type(e).__name__}: {e}'
+        if result == expected:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}: 期望 {expected!r}，实际 {result!r}")
+
+    print("\n" + "=" * 70)
+    if failures:
+        print(f"❌ {failures}/{len(CASES)} 个用例失败")
+        print("=" * 70)
+        sys.exit(1)
+    print(f"✅ 全部 {len(CASES)} 个用例通过")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import { Link } from 'react-router-dom'
 import { Heart, Star } from 'lucide-react'
+import api from '../services/api'
 
 function AnimationCard({ animation, showAuthor = true }) {
   // 处理SVG内容，确保它能正确显示
@@ -38,6 +39,15 @@ function AnimationCard({ animation, showAuthor = true }) {
             alt={animation.title}
             className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
           />
+        ) : animation.preview_url ? (
+          // 列表接口不返回SVG内容，预览图按签名地址单独加载（可被浏览器缓存）
+          <img
+            src={`${api.defaults.baseURL}${animation.preview_url}`}
+            alt={animation.title}
+            loading="lazy"
+            className="w-full h-full object-contain"
+            style={{ background: '#1e293b' }}
+          />
         ) : animation.svg_content ? (
           renderSVGPreview()
         ) : (
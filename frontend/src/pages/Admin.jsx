@@ -4,15 +4,30 @@ import api from '../services/api'
 import useToastStore from '../store/toastStore'
 import ConfirmDialog from '../components/ConfirmDialog'
 
+// 统计趋势可选的指标
+const TREND_METRICS = [
+  { key: 'new_users', label: '新增用户' },
+  { key: 'new_animations', label: '新增动画' },
+  { key: 'generations', label: '生成' },
+  { key: 'edits', label: 'AI 编辑' },
+  { key: 'failures', label: '生成失败' },
+  { key: 'exports', label: '导出' },
+  { key: 'likes', label: '点赞' },
+  { key: 'tokens', label: 'Token' }
+]
+
 function Admin() {
   const { success, error } = useToastStore()
   const [tab, setTab] = useState('stats')
   const [stats, setStats] = useState(null)
+  const [statsDays, setStatsDays] = useState(7)
+  const [trendMetric, setTrendMetric] = useState('new_users')
   const [users, setUsers] = useState([])
   const [animations, setAnimations] = useState([])
   const [loading, setLoading] = useState(true)
   const [page, setPage] = useState(1)
   const [totalPages, setTotalPages] = useState(1)
+  const [cursors, setCursors] = useState([null])  // 每一页的分页游标，第 1 页为 null
   const [search, setSearch] = useState('')
   const [selectedUser, setSelectedUser] = useState(null)
   const [quotaInput, setQuotaInput] = useState('')
@@ -25,7 +40,7 @@ function Admin() {
 
   useEffect(() => {
     fetchData()
-  }, [tab, page])
+  }, [tab, page, statsDays])
 
   useEffect(() => {
     if (tab === 'settings') {
@@ -68,27 +83,27 @@ function Admin() {
     }
   }
 
-  const fetchData = async () => {
+  const fetchData = async (cursor = cursors[page - 1]) => {
     setLoading(true)
     try {
       if (tab === 'stats') {
-        const res = await api.get('/admin/stats')
+        const res = await api.get('/admin/stats', { params: { days: statsDays } })
         setStats(res.data)
       } else if (tab === 'settings') {
         setLoading(false)
         return
       } else if (tab === 'users') {
         const res = await api.get('/admin/users', { 
-          params: { page, per_page: 15, search } 
+          params: { cursor, per_page: 15, search, include_total: 1 } 
         })
         setUsers(res.data.users)
-        setTotalPages(res.data.pages)
+        updatePaging(res.data)
       } else if (tab === 'animations') {
         const res = await api.get('/admin/animations', { 
-          params: { page, per_page: 15, search } 
+          params: { cursor, per_page: 15, search, include_total: 1 } 
         })
         setAnimations(res.data.animations)
-        setTotalPages(res.data.pages)
+        updatePaging(res.data)
       }
     } catch (error) {
       console.error('Failed to fetch data:', error)
@@ -97,10 +112,25 @@ function Admin() {
     }
   }
 
+  // 记录下一页的游标，总页数由（缓存的）总数计算
+  const updatePaging = (data) => {
+    setCursors(prev => {
+      const next = prev.slice(0, page)
+      if (data.next_cursor) next[page] = data.next_cursor
+      return next
+    })
+    setTotalPages(Math.max(1, Math.ceil((data.total || 0) / 15)))
+  }
+
+  const resetPaging = () => {
+    setPage(1)
+    setCursors([null])
+  }
+
   const handleSearch = (e) => {
     e.preventDefault()
-    setPage(1)
-    fetchData()
+    resetPaging()
+    fetchData(null)
   }
 
   const updateQuota = async (userId, newQuota) => {
@@ -266,6 +296,11 @@ function Admin() {
     </div>
   )
 
+  // 统计趋势：所选指标在最近 statsDays 天的每日数值
+  const trendValues = stats ? stats.series.map(day => day[trendMetric]) : []
+  const trendMax = Math.max(1, ...trendValues)
+  const trendSum = trendValues.reduce((a, b) => a + b, 0)
+
   return (
     <div className="py-6 md:py-12 px-4">
       <div className="max-w-7xl mx-auto">
@@ -276,7 +311,7 @@ function Admin() {
           {tabs.map(({ id, label, icon: Icon }) => (
             <button
               key={id}
-              onClick={() => { setTab(id); setPage(1) }}
+              onClick={() => { setTab(id); resetPaging() }}
               className={`flex items-center gap-1.5 md:gap-2 px-4 md:px-6 py-2.5 md:py-3 rounded-xl transition-all whitespace-nowrap shrink-0 text-sm md:text-base ${
                 tab === id
                   ? 'bg-gradient-to-r from-primary to-accent text-white btn-glow'
@@ -329,6 +364,53 @@ function Admin() {
                     <div className="text-slate-400 mt-1 md:mt-2 text-xs md:text-sm">总互动数</div>
                   </div>
                 </div>
+
+                {/* Trend */}
+                <div className="glow-border p-4 md:p-6">
+                  <div className="flex flex-wrap items-center justify-between gap-2 mb-4">
+                    <div className="flex flex-wrap gap-1.5">
+                      {TREND_METRICS.map(metric => (
+                        <button
+                          key={metric.key}
+                          onClick={() => setTrendMetric(metric.key)}
+                          className={`px-2.5 py-1 rounded-lg text-xs transition-colors ${
+                            trendMetric === metric.key ? 'bg-primary text-white' : 'text-slate-400 hover:text-white'
+                          }`}
+                        >
+                          {metric.label}
+                        </button>
+                      ))}
+                    </div>
+                    <div className="flex gap-1.5">
+                      {[7, 30, 90].map(days => (
+                        <button
+                          key={days}
+                          onClick={() => setStatsDays(days)}
+                          className={`px-2.5 py-1 rounded-lg text-xs border transition-colors ${
+                            statsDays === days ? 'border-accent text-white' : 'border-dark-300 text-slate-400 hover:text-white'
+                          }`}
+                        >
+                          {days}天
+                        </button>
+                      ))}
+                    </div>
+                  </div>
+                  <div className="flex items-end gap-px h-32">
+                    {stats.series.map(day => (
+                      <div
+                        key={day.day}
+                        title={`${day.day}: ${day[trendMetric]}`}
+                        className="flex-1 bg-accent/60 hover:bg-accent rounded-t-sm min-h-[1px]"
+                        style={{ height: `${(day[trendMetric] / trendMax) * 100}%` }}
+                      />
+                    ))}
+                  </div>
+                  <div className="flex justify-between text-slate-500 text-xs mt-2">
+                    <span>{stats.series[0].day}</span>
+                    <span>合计 {trendSum}</span>
+                    <span>{stats.series[stats.series.length - 1].day}</span>
+                  </div>
+                </div>
               </div>
             )}
 
@@ -485,8 +567,8 @@ function Admin() {
                     </button>
                     <span className="px-3 md:px-4 py-2 text-sm">{page} / {totalPages}</span>
                     <button
-                      onClick={() => setPage(p => Math.min(totalPages, p + 1))}
-                      disabled={page === totalPages}
+                      onClick={() => setPage(p => p + 1)}
+                      disabled={!cursors[page]}
                       className="px-3 md:px-4 py-2 bg-dark-100 rounded-lg disabled:opacity-50 text-sm"
                     >
                       下一页
@@ -578,8 +660,8 @@ function Admin() {
                     </button>
                     <span className="px-3 md:px-4 py-2 text-sm">{page} / {totalPages}</span>
                     <button
-                      onClick={() => setPage(p => Math.min(totalPages, p + 1))}
-                      disabled={page === totalPages}
+                      onClick={() => setPage(p => p + 1)}
+                      disabled={!cursors[page]}
                       className="px-3 md:px-4 py-2 bg-dark-100 rounded-lg disabled:opacity-50 text-sm"
                     >
                       下一页
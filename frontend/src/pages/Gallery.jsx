@@ -1,48 +1,90 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { Search } from 'lucide-react'
 import api from '../services/api'
 import AnimationCard from '../components/AnimationCard'
 
+const SORTS = [
+  { value: 'newest', label: '最新' },
+  { value: 'trending', label: '热门' },
+  { value: 'top', label: '最多赞' }
+]
+
 function Gallery() {
   const [animations, setAnimations] = useState([])
   const [loading, setLoading] = useState(true)
   const [category, setCategory] = useState('全部')
-  const [categories, setCategories] = useState(['全部'])
+  const [sort, setSort] = useState('newest')
+  const [categories, setCategories] = useState([{ name: '全部', count: null }])
   const [search, setSearch] = useState('')
-  const [page, setPage] = useState(1)
-  const [totalPages, setTotalPages] = useState(1)
+  const [keyword, setKeyword] = useState('')  // 已提交的搜索词
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const sentinelRef = useRef(null)
+  const requestRef = useRef(0)
+
+  useEffect(() => {
+    // 分类及动画数（接口带 ETag，未变化时浏览器直接使用缓存）
+    api.get('/community/categories')
+      .then(res => setCategories(res.data.categories))
+      .catch(error => console.error('Failed to fetch categories:', error))
+  }, [])
 
   useEffect(() => {
     fetchAnimations()
-  }, [category, page])
+  }, [category, keyword, sort])
+
+  // 滚动到列表底部附近时用游标加载下一页
+  useEffect(() => {
+    const sentinel = sentinelRef.current
+    if (!sentinel || !nextCursor || loadingMore) return
+    const observer = new IntersectionObserver(entries => {
+      if (entries[0].isIntersecting) {
+        fetchAnimations(nextCursor)
+      }
+    }, { rootMargin: '400px' })
+    observer.observe(sentinel)
+    return () => observer.disconnect()
+  }, [nextCursor, loadingMore])
 
-  const fetchAnimations = async () => {
-    setLoading(true)
+  const fetchAnimations = async (cursor = null) => {
+    // 切换分类/搜索/排序后，丢弃之前还未返回的请求
+    const requestId = cursor ? requestRef.current : ++requestRef.current
+    cursor ? setLoadingMore(true) : setLoading(true)
     try {
-      const params = { page, per_page: 12 }
+      const params = { per_page: 12 }
+      if (cursor) {
+        params.cursor = cursor
+      }
       if (category !== '全部') {
         params.category = category
       }
-      if (search) {
-        params.search = search
+      if (keyword) {
+        params.search = keyword
       }
-      const res = await api.get('/community/animations', { params })
-      setAnimations(res.data.animations)
-      setTotalPages(res.data.pages)
-      if (res.data.categories) {
-        setCategories(res.data.categories)
+      if (sort !== 'newest') {
+        params.sort = sort
       }
+      const res = await api.get('/community/animations', { params })
+      if (requestId !== requestRef.current) return
+      setAnimations(prev => cursor ? [...prev, ...res.data.animations] : res.data.animations)
+      setNextCursor(res.data.next_cursor)
     } catch (error) {
       console.error('Failed to fetch animations:', error)
     } finally {
-      setLoading(false)
+      if (requestId === requestRef.current) {
+        setLoading(false)
+        setLoadingMore(false)
+      }
     }
   }
 
   const handleSearch = (e) => {
     e.preventDefault()
-    setPage(1)
-    fetchAnimations()
+    if (search === keyword) {
+      fetchAnimations()
+    } else {
+      setKeyword(search)
+    }
   }
 
   return (
@@ -73,19 +115,37 @@ function Gallery() {
           </div>
         </form>
 
+        {/* Sort */}
+        <div className="flex justify-center gap-2 sm:gap-3 mb-4 sm:mb-6">
+          {SORTS.map(item => (
+            <button
+              key={item.value}
+              onClick={() => setSort(item.value)}
+              className={`px-3 sm:px-4 py-1 sm:py-1.5 rounded-full text-xs sm:text-sm transition-colors ${
+                sort === item.value
+                  ? 'bg-accent/20 text-white border border-accent'
+                  : 'text-gray-400 hover:text-white border border-dark-300'
+              }`}
+            >
+              {item.label}
+            </button>
+          ))}
+        </div>
+
         {/* Categories */}
         <div className="flex flex-wrap justify-center gap-2 sm:gap-3 mb-6 sm:mb-8 px-2">
           {categories.map(cat => (
             <button
-              key={cat}
-              onClick={() => { setCategory(cat); setPage(1) }}
+              key={cat.name}
+              onClick={() => setCategory(cat.name)}
               className={`px-3 sm:px-4 py-1.5 sm:py-2 rounded-lg text-xs sm:text-sm transition-colors ${
-                category === cat
+                category === cat.name
                   ? 'bg-primary text-white'
                   : 'bg-dark-100 text-gray-400 hover:text-white border border-dark-300'
               }`}
             >
-              {cat}
+              {cat.name}
+              {cat.count !== null && <span className="ml-1 opacity-60">{cat.count}</span>}
             </button>
           ))}
         </div>
@@ -103,26 +163,10 @@ function Gallery() {
               ))}
             </div>
 
-            {/* Pagination */}
-            {totalPages > 1 && (
-              <div className="flex justify-center items-center gap-2 mt-8 sm:mt-12">
-                <button
-                  onClick={() => setPage(p => Math.max(1, p - 1))}
-                  disabled={page === 1}
-                  className="px-3 sm:px-4 py-2 bg-dark-100 rounded-lg disabled:opacity-50 text-sm"
-                >
-                  上一页
-                </button>
-                <span className="px-3 sm:px-4 py-2 text-sm">{page} / {totalPages}</span>
-                <button
-                  onClick={() => setPage(p => Math.min(totalPages, p + 1))}
-                  disabled={page === totalPages}
-                  className="px-3 sm:px-4 py-2 bg-dark-100 rounded-lg disabled:opacity-50 text-sm"
-                >
-                  下一页
-                </button>
-              </div>
-            )}
+            {/* Infinite scroll */}
+            <div ref={sentinelRef} className="text-center py-8 sm:py-12 text-sm text-gray-500">
+              {loadingMore ? '加载中...' : nextCursor ? '' : '没有更多了'}
+            </div>
           </>
         )}
       </div>
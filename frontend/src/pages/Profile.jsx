@@ -13,6 +13,8 @@ function Profile() {
   const [animations, setAnimations] = useState([])
   const [favorites, setFavorites] = useState([])
   const [loading, setLoading] = useState(true)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [isEditing, setIsEditing] = useState(false)
   const [editEmail, setEditEmail] = useState(user?.email || '')
   const [editAvatar, setEditAvatar] = useState(user?.avatar || '')
@@ -27,27 +29,39 @@ function Profile() {
     }
   }, [tab])
 
-  const fetchMyAnimations = async () => {
-    setLoading(true)
+  const fetchMyAnimations = async (cursor = null) => {
+    cursor ? setLoadingMore(true) : setLoading(true)
     try {
-      const res = await api.get('/animations/')
-      setAnimations(res.data.animations)
+      const res = await api.get('/animations/', { params: { cursor } })
+      setAnimations(prev => cursor ? [...prev, ...res.data.animations] : res.data.animations)
+      setNextCursor(res.data.next_cursor)
     } catch (error) {
       console.error('Failed to fetch animations:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
-  const fetchFavorites = async () => {
-    setLoading(true)
+  const fetchFavorites = async (cursor = null) => {
+    cursor ? setLoadingMore(true) : setLoading(true)
     try {
-      const res = await api.get('/community/favorites')
-      setFavorites(res.data.animations)
+      const res = await api.get('/community/favorites', { params: { cursor } })
+      setFavorites(prev => cursor ? [...prev, ...res.data.animations] : res.data.animations)
+      setNextCursor(res.data.next_cursor)
     } catch (error) {
       console.error('Failed to fetch favorites:', error)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
+    }
+  }
+
+  const handleLoadMore = () => {
+    if (tab === 'my') {
+      fetchMyAnimations(nextCursor)
+    } else {
+      fetchFavorites(nextCursor)
     }
   }
 
@@ -216,6 +230,18 @@ function Profile() {
           </div>
         )}
 
+        {!loading && nextCursor && (
+          <div className="flex justify-center mt-8 sm:mt-12">
+            <button
+              onClick={handleLoadMore}
+              disabled={loadingMore}
+              className="px-4 sm:px-6 py-2 bg-dark-100 rounded-lg disabled:opacity-50 text-sm"
+            >
+              {loadingMore ? '加载中...' : '加载更多'}
+            </button>
+          </div>
+        )}
+
         {!loading && (tab === 'my' ? animations : favorites).length === 0 && (
           <div className="text-center py-16 sm:py-20 text-slate-500">
             {tab === 'my' ? '还没有创作任何动画' : '还没有收藏任何动画'}